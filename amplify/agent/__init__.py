@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from collections import defaultdict
+from threading import Lock
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -49,7 +50,24 @@ class CommonDataTank(Singleton):
 
 
 class CommonDataClient(object):
+    """
+    Collectors write to the current buffer, flush() takes it away at once with swap() and builds
+    the payload from it while new data goes to a new buffer - nothing is copied.
+    Writers which read and then update the current buffer hold the lock, so they can run in other threads.
+    """
     def __init__(self, object=None):
         self.object = object
         self.current = {}
         self.delivery = {}
+        self.lock = Lock()
+
+    def swap(self, empty=None):
+        """
+        Replaces the current buffer with an empty one
+
+        :param empty: new buffer, {} by default
+        :return: previous buffer
+        """
+        with self.lock:
+            delivery, self.current = self.current, {} if empty is None else empty
+        return delivery
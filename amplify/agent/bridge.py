@@ -32,7 +32,7 @@ class Bridge(Singleton):
         :return: dict of structure
         """
         # TODO check docker or OS around
-        tree = {'system': ['nginx']}
+        tree = {'system': ['nginx', 'statsd']}
         return tree
 
     def run(self):
@@ -52,6 +52,22 @@ class AbstractConfig(object):
             default = {}
         return self.config.get(section, default)
 
+    def getboolean(self, section, key, default=False):
+        value = self.get(section).get(key)
+        if value is None or value == '':
+            return default
+        if isinstance(value, basestring):
+            return value.strip().lower() in ('1', 'yes', 'true', 'on')
+        return bool(value)
+
+    def getint(self, section, key, default=None):
+        value = self.get(section).get(key)
+        return default if value is None or value == '' else int(value)
+
+    def getfloat(self, section, key, default=None):
+        value = self.get(section).get(key)
+        return default if value is None or value == '' else float(value)
+
     def __getitem__(self, item):
         return self.config[item]
 
@@ -32,6 +32,11 @@ class Config(AbstractConfig):
             api_key=None,
             uuid=None,
             hostname=None
+        ),
+        tail=dict(
+            offsets_file='/var/run/amplify-agent/tail.offsets',
+            offsets_save_interval=60.0,
+            max_catchup=50 * 1024 * 1024,
         )
     )
 
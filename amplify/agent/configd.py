@@ -1,6 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
-
 from amplify.agent import CommonDataTank, CommonDataClient
 
 
@@ -34,8 +32,7 @@ class ConfigdClient(CommonDataClient):
         if not self.current:
             return
 
-        delivery = copy.deepcopy(self.current)
-        self.current = {}
+        delivery = self.swap()
         return {
             'object': self.object.definition,
             'config': delivery,
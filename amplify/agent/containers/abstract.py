@@ -8,10 +8,13 @@ from threading import current_thread
 from gevent import queue
 
 from amplify.agent.context import context
-from amplify.agent.statsd import StatsdClient
+from amplify.agent.statsd import StatsdClient, TimerOptions
 from amplify.agent.eventd import EventdClient
 from amplify.agent.metad import MetadClient
 from amplify.agent.configd import ConfigdClient
+from amplify.agent.util.clock import clock
+from amplify.agent.util.inotify import file_watcher
+from amplify.agent.util.tail import FileTail
 from amplify.agent.util.threads import spawn
 
 __author__ = "Mike Belov"
@@ -33,13 +36,24 @@ def definition_id(definition):
     return result
 
 
+def container_config(container_type):
+    """
+    Returns the cloud config of a container type
+
+    :param container_type: str container type
+    :return: {} of config, empty if the type is not configured
+    """
+    return context.app_config['containers'].get(container_type) or {}
+
+
 class AbstractContainer(object):
     type = None
+    default_intervals = None  # for containers run without the cloud config
 
     def __init__(self, object_configs=None):
         self.objects = {}
         self.object_configs = object_configs if object_configs else {}
-        self.intervals = context.app_config['containers'][self.type]['poll_intervals']
+        self.intervals = container_config(self.type).get('poll_intervals') or self.default_intervals
         self.last_discover = 0
 
     def schedule_cloud_commands(self):
@@ -87,13 +101,14 @@ class AbstractObject(object):
     Abstract object. Supervisor for collectors.
     """
     type = None
+    default_intervals = {'default': 10}
 
     def __init__(self, definition=None, data=None):
         self.definition = {} if definition is None else definition
         self.definition['type'] = self.type
         self.id = definition_id(self.definition)
         self.data = data
-        self.intervals = context.app_config['containers'][self.type]['poll_intervals'] or {'default': 10}
+        self.intervals = container_config(self.type).get('poll_intervals') or self.default_intervals
         self.running = False
         self.need_restart = False
 
@@ -103,7 +118,15 @@ class AbstractObject(object):
         self.queue = queue.Queue()
 
         # data clients
-        self.statsd = StatsdClient(object=self, interval=max(self.intervals.values()))
+        timer_accuracy = None
+        if context.app_config.getboolean('statsd', 'timer_sketch', default=False):
+            timer_accuracy = context.app_config.getfloat('statsd', 'timer_sketch_accuracy', default=0.01)
+        self.statsd = StatsdClient(
+            object=self, interval=max(self.intervals.values()), timer_accuracy=timer_accuracy,
+            timer_options=TimerOptions.from_config(context.app_config.get('statsd')),
+            max_series=context.app_config.getint('statsd', 'max_series', default=10000),
+            max_samples=context.app_config.getint('statsd', 'max_samples', default=1000000)
+        )
         self.eventd = EventdClient(object=self)
         self.metad = MetadClient(object=self)
         self.configd = ConfigdClient(object=self)
@@ -174,6 +197,7 @@ class AbstractCollector(object):
 
     def _collect(self):
         start_time = time.time()
+        clock.tick(start_time)  # samples of the cycle are stamped with its start
         try:
             self.collect()
         except:
@@ -192,3 +216,42 @@ class AbstractCollector(object):
         Override it
         """
         pass
+
+
+class AbstractLogsCollector(AbstractCollector):
+    """
+    Abstract log collector
+    Reads new lines of a log with FileTail
+
+    If watch is enabled the collector is woken up by file changes instead of sleeping for the whole interval
+    """
+    def __init__(self, filename=None, tail=None, watch=False, min_delay=None, **kwargs):
+        super(AbstractLogsCollector, self).__init__(**kwargs)
+        self.filename = filename
+        self.tail = tail if tail is not None else FileTail(filename, bulk=True, offsets=context.tail_offsets)
+        self.watcher = file_watcher(filename) if watch and tail is None else None
+        self.min_delay = min_delay
+
+    def run(self):
+        try:
+            super(AbstractLogsCollector, self).run()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Closes the file watcher (inotify descriptor), so it is not left open until the collector is garbage collected
+        """
+        if self.watcher is not None:
+            self.watcher.close()
+        self.watcher = None
+
+    def _sleep(self):
+        if self.watcher is None:
+            super(AbstractLogsCollector, self)._sleep()
+            return
+
+        # wake up on the first change (or once per interval to report zero counters)
+        # and then let more lines arrive to process them as one batch
+        if self.watcher.wait(self.interval) and self.min_delay:
+            time.sleep(self.min_delay)
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
-from amplify.agent.containers.abstract import AbstractCollector
+import time
+
+from collections import Counter
+from itertools import compress, islice, izip
+from operator import or_
+
+from gevent.pool import Pool
+
+from amplify.agent.containers.abstract import AbstractLogsCollector
 from amplify.agent.context import context
-from amplify.agent.nginx.log.access import NginxAccessLogParser
-from amplify.agent.util.tail import FileTail
+from amplify.agent.nginx.filters import FilterIndex
+from amplify.agent.nginx.log.access import NginxAccessLogParser, parse_time_local
+from amplify.agent.statsd import SampledStatsdBuffer, StatsdBuffer
+from amplify.agent.util.sketch import SpaceSaving
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -12,7 +22,7 @@ __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
-class NginxAccessLogsCollector(AbstractCollector):
+class NginxAccessLogsCollector(AbstractLogsCollector):
 
     short_name = 'nginx_alog'
 
@@ -54,6 +64,41 @@ class NginxAccessLogsCollector(AbstractCollector):
         # 'upstream.request.count': None  # Not sure how to handle for same reason above.
     }
 
+    # fields used by collector methods in addition to the counters ones
+    fields = {
+        'gzip_ratio',
+        'request_time',
+        'upstream_connect_time',
+        'upstream_header_time',
+        'upstream_response_time',
+    }
+
+    upstream_timers = {
+        'nginx.upstream.connect.time': 'upstream_connect_time',
+        'nginx.upstream.response.time': 'upstream_response_time',
+        'nginx.upstream.header.time': 'upstream_header_time'
+    }
+
+    # lines parsed at once in columnar mode
+    batch_size = 10000
+
+    # heavy hitters of request uris: keys kept in the sketch per a reported one and reported metrics
+    uri_sketch_factor = 10
+    uri_interval = 20.0
+    uri_metrics = ('nginx.http.uri.count', 'nginx.http.uri.status.5xx', 'nginx.http.uri.time')
+
+    # peers over the limit are counted together under this name, the reported peers are chosen again every interval
+    overflow_peer = 'other'
+    peers_interval = 20.0
+
+    # values kept per timer in a cycle when lines are sampled
+    reservoir_size = 1000
+
+    # event time: seconds per bucket, max seconds a line can be late and max cached $time_local values
+    time_bucket = 1
+    late_window = 60
+    time_cache_size = 1000
+
     valid_http_methods = (
         'head',
         'get',
@@ -63,13 +108,76 @@ class NginxAccessLogsCollector(AbstractCollector):
         'options'
     )
 
-    def __init__(self, filename=None, log_format=None, tail=None, **kwargs):
+    # pre-built metric names by raw values of the most common fields, other values are formatted on the fly
+    method_metrics = dict(
+        (method.upper(), 'nginx.http.method.%s' % method) for method in valid_http_methods
+    )
+
+    status_metrics = dict(
+        (str(code), 'nginx.http.status.%s' % ('discarded' if code in (499, 444, 408) else '%sxx' % (code // 100)))
+        for code in xrange(100, 600)
+    )
+
+    version_metrics = {
+        'HTTP/0.9': 'nginx.http.v0_9',
+        'HTTP/1.0': 'nginx.http.v1_0',
+        'HTTP/1.1': 'nginx.http.v1_1',
+        'HTTP/2.0': 'nginx.http.v2',
+    }
+
+    upstream_status_metrics = dict(
+        (str(digit), 'nginx.upstream.http.status.%sxx' % digit) for digit in xrange(1, 6)
+    )
+
+    status_classes = dict((str(digit), '%sxx' % digit) for digit in xrange(1, 6))
+
+    cache_metrics = dict(
+        (cache_status, 'nginx.cache.%s' % cache_status.lower())
+        for cache_status in ('BYPASS', 'EXPIRED', 'HIT', 'MISS', 'REVALIDATED', 'STALE', 'UPDATING')
+    )
+
+    # per-line extractors and the fields they are applied for, None means any upstream variable
+    extractors = (
+        ('http_method', 'request_method'),
+        ('http_status', 'status'),
+        ('http_version', 'server_protocol'),
+        ('request_length', 'request_length'),
+        ('body_bytes_sent', 'body_bytes_sent'),
+        ('bytes_sent', 'bytes_sent'),
+        ('gzip_ration', 'gzip_ratio'),
+        ('request_time', 'request_time'),
+        ('upstreams', None),
+    )
+
+    def __init__(self, log_format=None, log_escape=None, workers=None, top_uris=0, uri_interval=None, upstream_peers=0,
+                 peers_interval=None, sampler=None, event_time=False, time_bucket=None, late_window=None, **kwargs):
         super(NginxAccessLogsCollector, self).__init__(**kwargs)
-        self.filename = filename
-        self.parser = NginxAccessLogParser(log_format)
-        self.tail = tail if tail is not None else FileTail(filename)
+        self.log_format = log_format
+        self.log_escape = log_escape
+        self.workers = workers
+
+        # 1-in-N sampling of lines under overload
+        self.sampler = sampler
+        self.sample_rate = 1
+        self.collect_time = 0.0
+
+        # top uris are counted during the interval (the push one) and reported at once
+        self.top_uris = top_uris
+        self.uri_sketch = SpaceSaving(top_uris * self.uri_sketch_factor) if top_uris else None
+        if uri_interval:
+            self.uri_interval = uri_interval
+        self.uri_reported = time.time()
+
+        self.parser = NginxAccessLogParser(log_format, escape=log_escape)
         self.filters = []
-        
+
+        # peers of $upstream_addr reported separately, the first ones seen in an interval are kept
+        self.upstream_peers = upstream_peers if 'upstream_addr' in self.parser.keys else 0
+        self.peers = set()
+        if peers_interval:
+            self.peers_interval = peers_interval
+        self.peers_reset = time.time()
+
         # skip empty filters and filters for other log file
         for log_filter in self.object.filters:
             if log_filter.empty:
@@ -78,6 +186,86 @@ class NginxAccessLogsCollector(AbstractCollector):
                 continue
             self.filters.append(log_filter)
 
+        self.filter_index = FilterIndex(self.filters)
+
+        # metrics can be stamped with the time of requests instead of the time of processing
+        self.time_key = None
+        if event_time:
+            if 'msec' in self.parser.keys:
+                self.time_key = 'msec'
+            elif 'time_local' in self.parser.keys:
+                self.time_key = 'time_local'
+            else:
+                context.log.warning(
+                    '%s: log format of %s has neither $msec nor $time_local, event time is not used' %
+                    (self.object.id, self.filename)
+                )
+        if time_bucket:
+            self.time_bucket = time_bucket
+        if late_window is not None:
+            self.late_window = late_window
+        self.time_cache = {}  # $time_local -> timestamp
+        self.buckets = {}  # timestamp -> buffer of the cycle
+
+        # parse only what is counted or filtered
+        self.parser.project(self.required_fields(), time_values=self.required_time_values())
+
+        # upstreams() looks only at the upstream variables of the format and the counted ones
+        format_upstream_keys = set(key for key in self.parser.keys if key.startswith('upstream'))
+        counted_upstream_keys = set(self.upstream_timers.itervalues()) | set(
+            key for key in self.counters.itervalues() if key.startswith('upstream')
+        )
+        self.upstream_keys = tuple(sorted(format_upstream_keys | counted_upstream_keys))
+        self.line_plan = self.build_line_plan(format_upstream_keys)
+
+    def required_fields(self):
+        """
+        Returns the set of parsed fields needed for the metrics and the filters
+
+        :return: set of field names
+        """
+        fields = set(self.counters.itervalues()) | self.fields
+
+        # upstreams() looks through all upstream variables to find out if a request was proxied
+        fields.update(key for key in self.parser.keys if key.startswith('upstream'))
+
+        for log_filter in self.filters:
+            fields.update(log_filter.data.iterkeys())
+
+        if self.top_uris:
+            fields.add('request_uri')
+
+        if self.time_key is not None:
+            fields.add(self.time_key)
+
+        return fields
+
+    def build_line_plan(self, upstream_keys):
+        """
+        Returns per-line extractors which can find something in lines of this format
+
+        :param upstream_keys: set of upstream variables of the format
+        :return: tuple of bound methods
+        """
+        keys = set(self.parser.keys)
+        if 'request' in keys:
+            keys.update(self.parser.request_variables)
+
+        plan = []
+        for method_name, key in self.extractors:
+            applies = bool(upstream_keys) if key is None else key in keys
+            if applies:
+                plan.append(getattr(self, method_name))
+        return tuple(plan)
+
+    def required_time_values(self):
+        """
+        Returns time variables which are needed value by value in batches
+
+        :return: set of field names
+        """
+        return {'upstream_response_time'} if self.upstream_peers else set()
+
     def init_counters(self):
         for counter, key in self.counters.iteritems():
             # If keys are in the parser format (access log) or not defined (error log)
@@ -85,49 +273,605 @@ class NginxAccessLogsCollector(AbstractCollector):
                 self.statsd.incr(counter, value=0)
 
     def collect(self):
-        self.init_counters()  # set all counters to 0
+        start_time = time.time()
+        if self.sampler is not None:
+            self.update_sample_rate()
+        if self.upstream_peers:
+            self.reset_peers()
+
+        # metrics of the cycle are aggregated locally and merged into the object statsd at once
+        if self.sample_rate > 1:
+            lines = islice(self.tail, 0, None, self.sample_rate)
+        else:
+            lines = self.tail
+
+        statsd, self.statsd = self.statsd, self.new_buffer()
+        try:
+            self.init_counters()  # set all counters to 0
+
+            # filters are matched against whole parsed lines, without them lines are processed in columns
+            if self.filters:
+                count = self.collect_lines(lines)
+            elif self.workers and self.time_key is None:
+                count = self.collect_in_workers(lines)
+            else:
+                count = self.collect_batches(lines)
+        finally:
+            buffer, self.statsd = self.statsd, statsd
+            statsd.merge(buffer)
+
+            # event time buckets are merged with their own timestamps
+            for bucket, buffer in sorted(self.buckets.iteritems()):
+                statsd.merge(buffer, timestamp=bucket)
+            self.buckets = {}
+
+        if self.uri_sketch is not None:
+            self.report_top_uris()
+
+        self.collect_time = time.time() - start_time
+        context.log.debug(
+            '%s processed %s lines (1 in %s) from %s' % (self.object.id, count, self.sample_rate, self.filename)
+        )
+
+    def update_sample_rate(self):
+        """
+        log.sample_rate||filename
+
+        Chooses the sampling rate for the cycle by the duration of the previous cycle
+        """
+        rate = self.sampler.update(self.collect_time)
+        if rate != self.sample_rate:
+            context.log.info(
+                '%s: the last cycle of %s took %.2fs, parsing 1 in %s lines' %
+                (self.object.id, self.filename, self.collect_time, rate)
+            )
+        self.sample_rate = rate
+        self.statsd.agent('log.sample_rate||%s' % self.filename, rate)
+
+    def new_buffer(self):
+        """
+        :return: StatsdBuffer or SampledStatsdBuffer for the current sampling rate
+        """
+        if self.sample_rate > 1:
+            return SampledStatsdBuffer(self.sample_rate, self.reservoir_size)
+        return StatsdBuffer()
+
+    def event_time(self, value):
+        """
+        Converts a value of the time variable to a timestamp, $time_local values are cached as they repeat a lot
+
+        :param value: float $msec or str $time_local
+        :return: int timestamp or None
+        """
+        if self.time_key == 'msec':
+            return int(value)
+
+        timestamp = self.time_cache.get(value)
+        if timestamp is None:
+            try:
+                timestamp = parse_time_local(value)
+            except ValueError:
+                return None
+            if len(self.time_cache) >= self.time_cache_size:
+                self.time_cache.clear()
+            self.time_cache[value] = timestamp
+        return timestamp
+
+    def time_bucket_of(self, timestamp, now):
+        """
+        Returns the bucket of a timestamp
+
+        Lines older than the late window are counted in its oldest bucket, lines from the future - in the current one.
+
+        :param timestamp: int timestamp or None
+        :param now: int current timestamp
+        :return: int bucket timestamp
+        """
+        if timestamp is None:
+            timestamp = now
+        else:
+            timestamp = min(max(timestamp, now - self.late_window), now)
+        return timestamp - timestamp % self.time_bucket
+
+    def bucket_buffer(self, bucket):
+        """
+        :param bucket: int bucket timestamp
+        :return: buffer of the bucket
+        """
+        buffer = self.buckets.get(bucket)
+        if buffer is None:
+            buffer = self.buckets[bucket] = self.new_buffer()
+        return buffer
+
+    def split_batch(self, batch, now):
+        """
+        Splits AccessLogBatch by event time buckets
+
+        :param batch: AccessLogBatch
+        :param now: int current timestamp
+        :return: [] of (bucket timestamp, AccessLogBatch)
+        """
+        time_bucket_of, event_time = self.time_bucket_of, self.event_time
+        buckets = [time_bucket_of(event_time(value), now) for value in batch.columns.get(self.time_key, ())]
+
+        # usually all the lines of a batch are written in the same second
+        if not buckets or buckets.count(buckets[0]) == len(buckets):
+            return [(buckets[0] if buckets else self.time_bucket_of(None, now), batch)]
+
+        indices = {}
+        for i, bucket in enumerate(buckets):
+            indices.setdefault(bucket, []).append(i)
+        return [(bucket, batch.select(indices[bucket])) for bucket in sorted(indices)]
+
+    def collect_lines(self, lines):
+        """
+        Parses and counts lines one by one
+
+        :param lines: iterable of log lines
+        :return: int number of lines
+        """
+        count = 0
+        peers = {}
+        now = int(time.time())
+        cycle_statsd = self.statsd
+        try:
+            for line in lines:
+                count += 1
+                try:
+                    parsed = self.parser.parse(line)
+                except:
+                    context.log.debug('could parse line %s' % line, exc_info=True)
+                    parsed = None
 
+                if not parsed:
+                    continue
+
+                if self.time_key is not None:
+                    timestamp = self.event_time(parsed[self.time_key]) if self.time_key in parsed else None
+                    self.statsd = self.bucket_buffer(self.time_bucket_of(timestamp, now))
+
+                if parsed['malformed']:
+                    self.request_malformed()
+                else:
+                    # try to match custom filters
+                    matched_filters = self.filter_index.match(parsed)
+                    self.count_line(parsed, matched_filters)
+
+                    if self.uri_sketch is not None and 'request_uri' in parsed:
+                        self.count_uri(parsed)
+
+                    if self.upstream_peers and 'upstream_addr' in parsed:
+                        self.add_peers(
+                            peers, parsed['upstream_addr'], parsed.get('upstream_status'),
+                            parsed.get('upstream_response_time', ())
+                        )
+        finally:
+            self.statsd = cycle_statsd
+
+        if peers:
+            self.count_peers(peers)
+
+        return count
+
+    def count_line(self, data, matched_filters=None):
+        """
+        Counts a parsed line with the extractors of the line plan
+
+        :param data: {} of parsed line
+        :param matched_filters: [] of matched filters
+        """
+        for method in self.line_plan:
+            try:
+                method(data, matched_filters)
+            except Exception as e:
+                exception_name = e.__class__.__name__
+                context.log.error(
+                    'failed to collect log metrics %s due to %s' % (method.__name__, exception_name))
+                context.log.debug('additional info:', exc_info=True)
+
+    def collect_batches(self, lines):
+        """
+        Parses lines in batches into columns and counts every batch at once
+
+        :param lines: iterable of log lines
+        :return: int number of lines
+        """
         count = 0
-        for line in self.tail:
-            count += 1
+        now = int(time.time())
+        lines = iter(lines)
+        while True:
+            batch = self.parser.parse_batch(islice(lines, self.batch_size))
+            count += batch.lines
+
+            if batch.failed:
+                context.log.debug('could not parse %s lines' % batch.failed)
+
             try:
-                parsed = self.parser.parse(line)
-            except:
-                context.log.debug('could parse line %s' % line, exc_info=True)
-                parsed = None
+                if self.time_key is not None:
+                    for bucket, part in self.split_batch(batch, now):
+                        self.count_batch(part, self.bucket_buffer(bucket))
+                else:
+                    self.count_batch(batch, self.statsd)
+                if self.uri_sketch is not None:
+                    self.count_batch_uris(batch, self.uri_sketch, self.sample_rate)
+                if self.upstream_peers:
+                    self.count_peers(self.batch_peers(batch))
+            except Exception as e:
+                exception_name = e.__class__.__name__
+                context.log.error('failed to collect log metrics due to %s' % exception_name)
+                context.log.debug('additional info:', exc_info=True)
 
-            if not parsed:
-                continue
+            if batch.lines < self.batch_size:
+                return count
 
-            if parsed['malformed']:
-                self.request_malformed()
+    def collect_in_workers(self, lines):
+        """
+        Sends batches of lines to worker processes and merges their partial results
+
+        :param lines: iterable of log lines
+        :return: int number of lines
+        """
+        count = 0
+        lines = iter(lines)
+        batches = iter(lambda: list(islice(lines, self.batch_size)), [])
+
+        results = Pool(self.workers.size).imap_unordered(self.count_in_worker, batches)
+        for batch_lines, failed, partial, sketch, peers in results:
+            count += batch_lines
+            if failed:
+                context.log.debug('could not parse %s lines' % failed)
+            if partial is not None:
+                self.statsd.merge(partial)
+            if sketch is not None:
+                self.uri_sketch.merge(sketch, self.sample_rate)
+            if peers:
+                self.count_peers(peers)
+
+        return count
+
+    def count_in_worker(self, lines):
+        """
+        :param lines: [] of log lines
+        :return: (number of lines, number of failed lines, StatsdBuffer or None, SpaceSaving or None, {} of peers)
+        """
+        uri_capacity = self.uri_sketch.capacity if self.uri_sketch is not None else 0
+        try:
+            return self.workers.call(
+                count_lines, self.log_format, self.log_escape, self.parser.fields, lines, uri_capacity,
+                bool(self.upstream_peers)
+            )
+        except Exception as e:
+            exception_name = e.__class__.__name__
+            context.log.error('failed to collect log metrics in a worker due to %s' % exception_name)
+            context.log.debug('additional info: %s' % e, exc_info=True)
+            return len(lines), len(lines), None, None, None
+
+    @classmethod
+    def count_batch(cls, batch, statsd):
+        """
+        Counts the same metrics as collect_lines does, but for a whole AccessLogBatch
+
+        :param batch: AccessLogBatch
+        :param statsd: StatsdClient or StatsdBuffer
+        """
+        malformed = sum(batch.malformed)
+        if malformed:
+            statsd.incr('nginx.http.request.malformed', malformed)
+
+        if malformed == len(batch):
+            return
+
+        valid = [not x for x in batch.malformed]
+        columns = batch.columns
+        counters = Counter()
+
+        if 'request_method' in columns:
+            for method, value in Counter(compress(columns['request_method'], valid)).iteritems():
+                counters[cls.method_metric(method)] += value
+
+        if 'status' in columns:
+            for status, value in Counter(compress(columns['status'], valid)).iteritems():
+                counters[cls.status_metrics.get(status) or 'nginx.http.status.%s' % cls.status_suffix(status)] += value
+
+        if 'server_protocol' in columns:
+            for proto, value in Counter(compress(columns['server_protocol'], valid)).iteritems():
+                metric_name = cls.version_metric(proto)
+                if metric_name is not None:
+                    counters[metric_name] += value
+
+        for metric_name, key in (
+            ('nginx.http.request.length', 'request_length'),
+            ('nginx.http.request.body_bytes_sent', 'body_bytes_sent'),
+            ('nginx.http.request.bytes_sent', 'bytes_sent'),
+        ):
+            if key in columns:
+                counters[metric_name] += sum(compress(columns[key], valid))
+
+        for metric_name, value in counters.iteritems():
+            statsd.incr(metric_name, value)
+
+        if 'gzip_ratio' in columns:
+            values = list(compress(columns['gzip_ratio'], valid))
+            if values:
+                statsd.averages('nginx.http.gzip.ratio', values)
+
+        if 'request_time' in columns:
+            values = cls.present_times(batch, 'request_time', valid)
+            if values:
+                statsd.timers('nginx.http.request.time', values)
+
+        cls.count_batch_upstreams(batch, valid, statsd)
+
+    @classmethod
+    def count_batch_upstreams(cls, batch, valid, statsd):
+        """
+        Counts upstream metrics of AccessLogBatch, see upstreams()
+
+        :param batch: AccessLogBatch
+        :param valid: [] mask of lines to count
+        :param statsd: StatsdClient or StatsdBuffer
+        """
+        columns, time_counts = batch.columns, batch.time_counts
+        empty_values = ('-', '')
+
+        # find out which lines have info about upstreams
+        found = None
+        for key in columns:
+            if not key.startswith('upstream'):
+                continue
+            if key in time_counts:
+                present = time_counts[key]
+            elif isinstance(columns[key], list):
+                present = [value not in empty_values for value in columns[key]]
             else:
-                # try to match custom filters 
-                matched_filters = []
-                for log_filter in self.filters:
-                    if log_filter.match(parsed):
-                        matched_filters.append(log_filter)
-                
-                for method in (
-                    self.http_method,
-                    self.http_status,
-                    self.http_version,
-                    self.request_length,
-                    self.body_bytes_sent,
-                    self.bytes_sent,
-                    self.gzip_ration,
-                    self.request_time,
-                    self.upstreams,
-                ):
-                    try:
-                        method(parsed, matched_filters)
-                    except Exception as e:
-                        exception_name = e.__class__.__name__
-                        context.log.error(
-                            'failed to collect log metrics %s due to %s' % (method.__name__, exception_name))
-                        context.log.debug('additional info:', exc_info=True)
-
-        context.log.debug('%s processed %s lines from %s' % (self.object.id, count, self.filename))
+                present = valid  # numbers are always there
+            found = present if found is None else map(or_, found, present)
+
+        if found is None:
+            return
+
+        proxied = [bool(v and f) for v, f in zip(valid, found)]
+        requests = sum(proxied)
+        if not requests:
+            return
+
+        counters = Counter()
+
+        # counters
+        if 'upstream_status' in columns:
+            responded = [False] * len(proxied)
+            for i, status in enumerate(columns['upstream_status']):
+                if proxied[i] and status not in empty_values:
+                    digit = status[0]
+                    counters[cls.upstream_status_metrics.get(digit) or 'nginx.upstream.http.status.%sxx' % digit] += 1
+                    responded[i] = digit in ('2', '3')
+
+            if 'upstream_response_length' in columns:
+                counters['nginx.upstream.http.response.length'] += sum(
+                    compress(columns['upstream_response_length'], responded)
+                )
+
+        # timers
+        switches = [None] * len(proxied)
+        for metric_name, key_name in cls.upstream_timers.iteritems():
+            if key_name in columns:
+                for i, length in enumerate(time_counts[key_name]):
+                    if length > 1 and switches[i] is None:
+                        switches[i] = length - 1
+
+                values = cls.present_times(batch, key_name, proxied)
+                if values:
+                    statsd.timers(metric_name, values)
+
+        counters['nginx.upstream.next.count'] += sum(filter(None, compress(switches, proxied)))
+
+        # cache
+        if 'upstream_cache_status' in columns:
+            for cache_status, value in Counter(compress(columns['upstream_cache_status'], proxied)).iteritems():
+                if cache_status and not cache_status.startswith('-'):
+                    counters['nginx.cache.%s' % cache_status.lower()] += value
+
+        counters['nginx.upstream.request.count'] += requests
+
+        for metric_name, value in counters.iteritems():
+            statsd.incr(metric_name, value)
+
+    @classmethod
+    def count_batch_uris(cls, batch, sketch, weight=1):
+        """
+        Adds request uris of AccessLogBatch to the heavy hitters sketch, see count_uri()
+
+        :param batch: AccessLogBatch
+        :param sketch: SpaceSaving
+        :param weight: int number of requests every line stands for
+        """
+        columns = batch.columns
+        if 'request_uri' not in columns:
+            return
+
+        statuses = columns['status'] if 'status' in columns else [''] * len(batch)
+        times = columns['request_time'] if 'request_time' in columns else [0.0] * len(batch)
+
+        # uris of a batch are summed up first, there are not more of them than lines
+        totals = {}
+        for uri, status, request_time in izip(columns['request_uri'], statuses, times):
+            if uri is None:
+                continue  # malformed request
+
+            uri = cls.normalize_uri(uri)
+            total = totals.get(uri)
+            if total is None:
+                total = totals[uri] = [0, 0, 0.0]
+            total[0] += 1
+            if status.startswith('5'):
+                total[1] += 1
+            total[2] += request_time
+
+        for uri, (count, errors, total_time) in totals.iteritems():
+            sketch.add(uri, count * weight, errors * weight, total_time * weight)
+
+    @classmethod
+    def batch_peers(cls, batch):
+        """
+        Collects upstream attempts of AccessLogBatch by peers, see add_peers()
+
+        :param batch: AccessLogBatch
+        :return: {} of peers
+        """
+        columns = batch.columns
+        peers = {}
+        if 'upstream_addr' not in columns:
+            return peers
+
+        statuses = columns['upstream_status'] if 'upstream_status' in columns else [None] * len(batch)
+        times = batch.time_values.get('upstream_response_time') or [()] * len(batch)
+
+        for malformed, addrs, status, values in izip(batch.malformed, columns['upstream_addr'], statuses, times):
+            if not malformed:
+                cls.add_peers(peers, addrs, status, values)
+
+        return peers
+
+    @staticmethod
+    def split_upstreams(value):
+        """
+        Splits values of upstream variables: attempts are separated with commas, internal redirects with colons
+
+        :param value: str variable value
+        :return: [] of str
+        """
+        return value.replace(' : ', ', ').split(', ')
+
+    @classmethod
+    def add_peers(cls, peers, addrs, status, times):
+        """
+        Adds upstream attempts of a request to per-peer stats
+
+        :param peers: {} of peer -> [requests, {status class: requests}, [response times]]
+        :param addrs: str $upstream_addr
+        :param status: str $upstream_status or None
+        :param times: [] of $upstream_response_time values
+        """
+        if addrs in ('-', ''):
+            return
+
+        addrs = cls.split_upstreams(addrs)
+        statuses = cls.split_upstreams(status) if status else ()
+        if len(times) != len(addrs):
+            times = ()  # some of the times were empty or skipped, so they can't be matched with peers
+
+        for i, peer in enumerate(addrs):
+            stats = peers.get(peer)
+            if stats is None:
+                stats = peers[peer] = [0, {}, []]
+
+            stats[0] += 1
+            if i < len(statuses) and statuses[i][:1].isdigit():
+                status_class = cls.status_classes.get(statuses[i][0]) or '%sxx' % statuses[i][0]
+                stats[1][status_class] = stats[1].get(status_class, 0) + 1
+            if times:
+                stats[2].append(times[i])
+
+    def count_peers(self, peers):
+        """
+        nginx.upstream.peer.request.count||peer
+        nginx.upstream.peer.http.status.1xx||peer
+        nginx.upstream.peer.http.status.2xx||peer
+        nginx.upstream.peer.http.status.3xx||peer
+        nginx.upstream.peer.http.status.4xx||peer
+        nginx.upstream.peer.http.status.5xx||peer
+        nginx.upstream.peer.response.time||peer
+        nginx.upstream.peer.response.time.median||peer
+        nginx.upstream.peer.response.time.max||peer
+        nginx.upstream.peer.response.time.pctl95||peer
+        nginx.upstream.peer.response.time.count||peer
+
+        Only the first upstream_peers peers of an interval are reported by their addresses, the rest are counted
+        as overflow_peer. The busiest peers are taken first.
+
+        :param peers: {} of peers, see add_peers()
+        """
+        for peer, (requests, statuses, times) in sorted(peers.iteritems(), key=lambda item: (-item[1][0], item[0])):
+            if peer not in self.peers:
+                if len(self.peers) < self.upstream_peers:
+                    self.peers.add(peer)
+                else:
+                    peer = self.overflow_peer
+
+            self.statsd.incr('nginx.upstream.peer.request.count||%s' % peer, requests)
+            for status_class, value in statuses.iteritems():
+                self.statsd.incr('nginx.upstream.peer.http.status.%s||%s' % (status_class, peer), value)
+            if times:
+                self.statsd.timers('nginx.upstream.peer.response.time||%s' % peer, times)
+
+    def reset_peers(self):
+        """
+        Forgets the reported peers once per peers_interval, so new peers (after upstream changes) can take their place
+        """
+        now = time.time()
+        if now >= self.peers_reset + self.peers_interval:
+            self.peers = set()
+            self.peers_reset = now
+
+    @staticmethod
+    def present_times(batch, key, mask):
+        """
+        Returns sums of non-empty time variables for the lines of the mask
+
+        :param batch: AccessLogBatch
+        :param key: str time variable
+        :param mask: [] mask of lines
+        :return: [] of float
+        """
+        return [
+            value for value, length, selected in zip(batch.columns[key], batch.time_counts[key], mask)
+            if selected and length
+        ]
+
+    @staticmethod
+    def normalize_uri(uri):
+        """
+        :param uri: str request uri
+        :return: str uri without query string
+        """
+        return uri.split('?', 1)[0]
+
+    def count_uri(self, data):
+        """
+        Adds a request uri to the heavy hitters sketch
+
+        :param data: {} of parsed line
+        """
+        weight = self.sample_rate
+        self.uri_sketch.add(
+            self.normalize_uri(data['request_uri']),
+            weight,
+            weight if data.get('status', '').startswith('5') else 0,
+            sum(data.get('request_time', ())) * weight
+        )
+
+    def report_top_uris(self, force=False):
+        """
+        nginx.http.uri.count||uri
+        nginx.http.uri.status.5xx||uri
+        nginx.http.uri.time||uri
+
+        Reports the heavy hitters once per push interval and starts counting from scratch
+
+        :param force: bool - report even if the interval has not passed yet
+        """
+        now = time.time()
+        if not force and now < self.uri_reported + self.uri_interval:
+            return
+
+        count_metric, errors_metric, time_metric = self.uri_metrics
+        for uri, count, errors, total_time in self.uri_sketch.top(self.top_uris):
+            self.statsd.incr('%s||%s' % (count_metric, uri), count)
+            self.statsd.incr('%s||%s' % (errors_metric, uri), errors)
+            self.statsd.incr('%s||%s' % (time_metric, uri), total_time)
+
+        self.uri_sketch.reset()
+        self.uri_reported = now
 
     def request_malformed(self):
         """
@@ -149,9 +893,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         :param matched_filters: [] of matched filters
         """
         if 'request_method' in data:
-            method = data['request_method'].lower()
-            method = method if method in self.valid_http_methods else 'other'
-            metric_name = 'nginx.http.method.%s' % method
+            metric_name = self.method_metric(data['request_method'])
             self.statsd.incr(metric_name)
 
             # call custom filters
@@ -172,8 +914,7 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         if 'status' in data:
             status = data['status']
-            suffix = 'discarded' if status in ('499', '444', '408') else '%sxx' % status[0]
-            metric_name = 'nginx.http.status.%s' % suffix
+            metric_name = self.status_metrics.get(status) or 'nginx.http.status.%s' % self.status_suffix(status)
             self.statsd.incr(metric_name)
 
             # call custom filters
@@ -191,30 +932,71 @@ class NginxAccessLogsCollector(AbstractCollector):
         :param matched_filters: [] of matched filters
         """
         if 'server_protocol' in data:
-            proto = data['server_protocol']
-            if not proto.startswith('HTTP'):
+            metric_name = self.version_metric(data['server_protocol'])
+            if metric_name is None:
                 return
 
-            version = proto.split('/')[-1]
-
-            if version.startswith('0.9'):
-                suffix = '0_9'
-            elif version.startswith('1.0'):
-                suffix = '1_0'
-            elif version.startswith('1.1'):
-                suffix = '1_1'
-            elif version.startswith('2.0'):
-                suffix = '2'
-            else:
-                suffix = version.replace('.', '_')
-
-            metric_name = 'nginx.http.v%s' % suffix
             self.statsd.incr(metric_name)
 
             # call custom filters
             if matched_filters:
                 self.count_custom_filter(matched_filters, metric_name, 1, self.statsd.incr)
 
+    @classmethod
+    def method_metric(cls, method):
+        """
+        :param method: str HTTP method
+        :return: str method metric name
+        """
+        metric_name = cls.method_metrics.get(method)
+        if metric_name is None:
+            method = method.lower()
+            metric_name = 'nginx.http.method.%s' % (method if method in cls.valid_http_methods else 'other')
+        return metric_name
+
+    @classmethod
+    def version_metric(cls, proto):
+        """
+        :param proto: str server protocol
+        :return: str HTTP version metric name or None if it is not HTTP
+        """
+        metric_name = cls.version_metrics.get(proto)
+        if metric_name is None:
+            suffix = cls.version_suffix(proto)
+            if suffix is not None:
+                metric_name = 'nginx.http.v%s' % suffix
+        return metric_name
+
+    @staticmethod
+    def status_suffix(status):
+        """
+        :param status: str HTTP status
+        :return: str status metric suffix
+        """
+        return 'discarded' if status in ('499', '444', '408') else '%sxx' % status[0]
+
+    @staticmethod
+    def version_suffix(proto):
+        """
+        :param proto: str server protocol
+        :return: str HTTP version metric suffix or None if it is not HTTP
+        """
+        if not proto.startswith('HTTP'):
+            return None
+
+        version = proto.split('/')[-1]
+
+        if version.startswith('0.9'):
+            return '0_9'
+        elif version.startswith('1.0'):
+            return '1_0'
+        elif version.startswith('1.1'):
+            return '1_1'
+        elif version.startswith('2.0'):
+            return '2'
+        else:
+            return version.replace('.', '_')
+
     def request_length(self, data, matched_filters=None):
         """
         nginx.http.request.length
@@ -334,8 +1116,8 @@ class NginxAccessLogsCollector(AbstractCollector):
         # find out if we have info about upstreams
         empty_values = ('-', '')
         upstream_data_found = False
-        for key in data.iterkeys():
-            if key.startswith('upstream') and data[key] not in empty_values:
+        for key in self.upstream_keys:
+            if key in data and data[key] not in empty_values:
                 upstream_data_found = True
                 break
 
@@ -344,11 +1126,10 @@ class NginxAccessLogsCollector(AbstractCollector):
 
         # counters
         upstream_response = False
-        if 'upstream_status' in data:
-            status = data['upstream_status']
-            suffix = '%sxx' % status[0]
-            metric_name = 'nginx.upstream.http.status.%s' % suffix
-            upstream_response = True if suffix in ('2xx', '3xx') else False  # Set flag for upstream length processing
+        status = data.get('upstream_status')
+        if status and status not in empty_values:
+            metric_name = self.upstream_status_metrics.get(status[0]) or 'nginx.upstream.http.status.%sxx' % status[0]
+            upstream_response = status[0] in ('2', '3')  # Set flag for upstream length processing
             self.statsd.incr(metric_name)
 
             # call custom filters
@@ -365,11 +1146,7 @@ class NginxAccessLogsCollector(AbstractCollector):
 
         # gauges
         upstream_switches = None
-        for metric_name, key_name in {
-            'nginx.upstream.connect.time': 'upstream_connect_time',
-            'nginx.upstream.response.time': 'upstream_response_time',
-            'nginx.upstream.header.time': 'upstream_header_time'
-        }.iteritems():
+        for metric_name, key_name in self.upstream_timers.iteritems():
             if key_name in data:
                 values = data[key_name]
 
@@ -396,8 +1173,8 @@ class NginxAccessLogsCollector(AbstractCollector):
         # cache
         if 'upstream_cache_status' in data:
             cache_status = data['upstream_cache_status']
-            if not cache_status.startswith('-'):
-                metric_name = 'nginx.cache.%s' % cache_status.lower()
+            if cache_status and not cache_status.startswith('-'):
+                metric_name = self.cache_metrics.get(cache_status) or 'nginx.cache.%s' % cache_status.lower()
                 self.statsd.incr(metric_name)
 
                 # call custom filters
@@ -425,5 +1202,39 @@ class NginxAccessLogsCollector(AbstractCollector):
         """
         for log_filter in matched_filters:
             if log_filter.metric == metric_name:
-                full_metric_name = '%s||%s' % (log_filter.metric, log_filter.filter_rule_id)
-                method(full_metric_name, value)
+                method(log_filter.full_metric_name, value)
+
+
+parsers = {}  # parsers of a worker process by format and fields
+
+
+def count_lines(log_format, escape, fields, lines, uri_capacity=0, peers=False):
+    """
+    Parses and counts lines in a worker process
+
+    :param log_format: str log format
+    :param escape: str escape= parameter of the log format or None
+    :param fields: set of fields to parse
+    :param lines: [] of log lines
+    :param uri_capacity: int capacity of the request uris sketch, 0 if top uris are not counted
+    :param peers: bool - collect upstream attempts by peers
+    :return: (number of lines, number of failed lines, StatsdBuffer, SpaceSaving or None, {} of peers or None)
+    """
+    key = (log_format, escape, frozenset(fields) if fields is not None else None, peers)
+    if key not in parsers:
+        parser = NginxAccessLogParser(log_format, escape=escape)
+        parser.project(fields, time_values={'upstream_response_time'} if peers else None)
+        parsers[key] = parser
+
+    batch = parsers[key].parse_batch(lines)
+    partial = StatsdBuffer()
+    NginxAccessLogsCollector.count_batch(batch, partial)
+
+    sketch = None
+    if uri_capacity:
+        sketch = SpaceSaving(uri_capacity)
+        NginxAccessLogsCollector.count_batch_uris(batch, sketch)
+
+    batch_peers = NginxAccessLogsCollector.batch_peers(batch) if peers else None
+
+    return batch.lines, batch.failed, partial, sketch, batch_peers
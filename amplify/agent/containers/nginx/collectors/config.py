@@ -109,9 +109,9 @@ class NginxConfigCollector(AbstractCollector):
             'index': config.index,
             'tree': config.tree,
             'files': config.files,
-            'ssl_certificates': config.ssl_certificates,
-            'access_logs': config.access_logs,
-            'error_logs': config.error_logs,
+            'ssl_certificates': dict(config.ssl_certificates),
+            'access_logs': dict(config.access_logs),
+            'error_logs': dict(config.error_logs),
             'errors': {
                 'parser': len(config.parser_errors),
                 'test': len(config.test_errors)
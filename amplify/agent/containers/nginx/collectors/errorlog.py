@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
-from amplify.agent.containers.abstract import AbstractCollector
+import time
+
+from amplify.agent.containers.abstract import AbstractLogsCollector
 from amplify.agent.context import context
 from amplify.agent.nginx.config.config import ERROR_LOG_LEVELS
 from amplify.agent.nginx.log.error import NginxErrorLogParser
-from amplify.agent.util.tail import FileTail
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -13,7 +14,7 @@ __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
-class NginxErrorLogsCollector(AbstractCollector):
+class NginxErrorLogsCollector(AbstractLogsCollector):
 
     short_name = 'nginx_elog'
 
@@ -24,12 +25,28 @@ class NginxErrorLogsCollector(AbstractCollector):
         'nginx.upstream.response.failed',
     )
 
-    def __init__(self, filename=None, level=None, log_format=None, tail=None, **kwargs):
+    # peers and servers over the limits are counted together under this name,
+    # the reported ones are chosen again every interval
+    overflow_key = 'other'
+    names_interval = 20.0
+
+    def __init__(self, level=None, log_format=None, upstream_peers=0, servers=0, names_interval=None, **kwargs):
         super(NginxErrorLogsCollector, self).__init__(**kwargs)
-        self.filename = filename
         self.level = level
         self.parser = NginxErrorLogParser()
-        self.tail = tail if tail is not None else FileTail(filename)
+
+        # lines below the configured level are not counted
+        self.min_level = ERROR_LOG_LEVELS.index(level) if level in ERROR_LOG_LEVELS else 0
+        self.level_ranks = dict((name, rank) for rank, name in enumerate(ERROR_LOG_LEVELS))
+
+        # failures are reported by upstream peers and servers, the first ones seen in an interval are kept
+        self.upstream_peers = upstream_peers
+        self.servers = servers
+        self.peers = set()
+        self.server_names = set()
+        if names_interval:
+            self.names_interval = names_interval
+        self.names_reset = time.time()
 
     def init_counters(self):
         for counter in self.counters:
@@ -40,9 +57,17 @@ class NginxErrorLogsCollector(AbstractCollector):
         if ERROR_LOG_LEVELS.index(self.level) <= 3:
             self.init_counters()  # set all error counters to 0
 
+        if self.upstream_peers or self.servers:
+            self.reset_names()
+
         count = 0
         for line in self.tail:
             count += 1
+
+            # a log can be shared by error_log directives of different levels
+            if self.level_ranks.get(self.parser.level(line), self.min_level) < self.min_level:
+                continue
+
             try:
                 error = self.parser.parse(line)
             except:
@@ -52,9 +77,58 @@ class NginxErrorLogsCollector(AbstractCollector):
             if error:
                 try:
                     self.statsd.incr(error)
+                    if (self.upstream_peers or self.servers) and error.endswith('.failed'):
+                        self.count_failure(error, self.parser.parse_fields(line))
                 except Exception as e:
                     exception_name = e.__class__.__name__
                     context.log.error('failed to collect error log metrics due to %s' % exception_name)
                     context.log.debug('additional info:', exc_info=True)
 
         context.log.debug('%s processed %s lines from %s' % (self.object.id, count, self.filename))
+
+    def count_failure(self, error, fields):
+        """
+        nginx.upstream.peer.request.failed||peer
+        nginx.upstream.peer.response.failed||peer
+        nginx.server.upstream.request.failed||server
+        nginx.server.upstream.response.failed||server
+
+        Only the first upstream_peers peers and servers servers of an interval are reported by their names,
+        the rest are counted as overflow_key.
+
+        :param error: str error counter
+        :param fields: {} of parsed line, see NginxErrorLogParser.parse_fields()
+        """
+        if not fields:
+            return
+
+        if self.upstream_peers and fields.get('upstream'):
+            peer = self.capped(self.peers, self.upstream_peers, self.parser.upstream_peer(fields['upstream']))
+            self.statsd.incr('%s||%s' % (error.replace('nginx.upstream.', 'nginx.upstream.peer.', 1), peer))
+
+        if self.servers and fields.get('server'):
+            server = self.capped(self.server_names, self.servers, fields['server'])
+            self.statsd.incr('%s||%s' % (error.replace('nginx.', 'nginx.server.', 1), server))
+
+    def reset_names(self):
+        """
+        Forgets the reported peers and servers once per names_interval, so new ones can take their place
+        """
+        now = time.time()
+        if now >= self.names_reset + self.names_interval:
+            self.peers = set()
+            self.server_names = set()
+            self.names_reset = now
+
+    def capped(self, seen, limit, key):
+        """
+        :param seen: set of keys reported by their names
+        :param limit: int max number of such keys
+        :param key: str key
+        :return: str key or overflow_key
+        """
+        if key not in seen:
+            if len(seen) >= limit:
+                return self.overflow_key
+            seen.add(key)
+        return key
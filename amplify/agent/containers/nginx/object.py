@@ -12,6 +12,8 @@ from amplify.agent.context import context
 from amplify.agent.eventd import INFO
 from amplify.agent.util import host
 from amplify.agent.util import http
+from amplify.agent.util.sampling import AdaptiveSampler
+from amplify.agent.util.workers import WorkerPool
 
 
 __author__ = "Mike Belov"
@@ -43,6 +45,25 @@ class NginxObject(AbstractObject):
         self.upload_ssl = self.data.get('upload_ssl') or default_config.get('upload_ssl', False)
         self.filters = self.data.get('filters') or []
 
+        # log reading settings from the local config
+        self.log_inotify = context.app_config.getboolean('nginx', 'log_inotify', default=False)
+        self.log_min_batch_delay = context.app_config.getfloat('nginx', 'log_min_batch_delay', default=1.0)
+        self.log_workers = context.app_config.getint('nginx', 'log_workers', default=0)
+        self.log_top_uris = context.app_config.getint('nginx', 'top_uris', default=0)
+        self.log_upstream_peers = context.app_config.getint('nginx', 'upstream_peers', default=0)
+        self.log_error_servers = context.app_config.getint('nginx', 'error_servers', default=0)
+        self.log_sampling = context.app_config.getboolean('nginx', 'log_sampling', default=False)
+        self.log_sampling_max_time = context.app_config.getfloat(
+            'nginx', 'log_sampling_max_time', default=self.intervals['logs']
+        )
+        self.log_event_time = context.app_config.getboolean('nginx', 'log_event_time', default=False)
+        self.log_time_bucket = context.app_config.getint('nginx', 'log_time_bucket', default=1)
+        self.log_late_window = context.app_config.getint('nginx', 'log_late_window', default=60)
+
+        # worker processes are shared by all the objects
+        if self.log_workers and context.worker_pool is None:
+            context.worker_pool = WorkerPool(self.log_workers)
+
         self.config = NginxConfig(self.conf_path, prefix=self.prefix)
         self.config.full_parse()
 
@@ -76,6 +97,9 @@ class NginxObject(AbstractObject):
         # access logs
         for log_filename, format_name in self.config.access_logs.iteritems():
             log_format = self.config.log_formats.get(format_name)
+            sampler = None
+            if self.log_sampling:
+                sampler = AdaptiveSampler(self.log_sampling_max_time)
             try:
                 self.collectors.append(
                     NginxAccessLogsCollector(
@@ -83,6 +107,18 @@ class NginxObject(AbstractObject):
                         interval=self.intervals['logs'],
                         filename=log_filename,
                         log_format=log_format,
+                        log_escape=self.config.log_format_escapes.get(format_name),
+                        workers=context.worker_pool if self.log_workers else None,
+                        top_uris=self.log_top_uris,
+                        uri_interval=context.app_config['cloud']['push_interval'],
+                        upstream_peers=self.log_upstream_peers,
+                        peers_interval=context.app_config['cloud']['push_interval'],
+                        sampler=sampler,
+                        event_time=self.log_event_time,
+                        time_bucket=self.log_time_bucket,
+                        late_window=self.log_late_window,
+                        watch=self.log_inotify,
+                        min_delay=self.log_min_batch_delay
                     )
                 )
 
@@ -104,7 +140,12 @@ class NginxObject(AbstractObject):
                         object=self,
                         interval=self.intervals['logs'],
                         filename=log_filename,
-                        level=log_level
+                        level=log_level,
+                        upstream_peers=self.log_upstream_peers,
+                        servers=self.log_error_servers,
+                        names_interval=context.app_config['cloud']['push_interval'],
+                        watch=self.log_inotify,
+                        min_delay=self.log_min_batch_delay
                     )
                 )
 
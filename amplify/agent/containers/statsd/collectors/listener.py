@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import errno
+import socket
+import time
+
+from gevent.select import select
+
+from amplify.agent.context import context
+from amplify.agent.containers.abstract import AbstractCollector
+from amplify.agent.statsd import StatsdBuffer
+from amplify.agent.util.udp import kernel_drops, udp_receiver
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+TIMER_TYPES = ('ms', 'h')
+
+
+def parse_address(value, default_host='127.0.0.1'):
+    """
+    :param value: str host:port or port
+    :return: (str host, int port)
+    """
+    host, _, port = value.strip().rpartition(':')
+    return host.strip('[]') or default_host, int(port)
+
+
+def parse_packet(packet, buffer, gauges):
+    """
+    Parses a datagram of StatsD lines and adds their values to a buffer
+
+        <name>:<value>|<type>[|@<rate>][|#<tags>]
+
+    Counters (c) are scaled up by the sample rate, timers (ms, h) represent 1/rate values each.
+    Gauges (g) are kept as the last value of a datagram, or as a sum of changes (+N, -N) if there is no value.
+    Tags and other fields are ignored, so are sets (s) - they are counted as invalid lines.
+
+    :param packet: str datagram
+    :param buffer: StatsdBuffer for counters and timers
+    :param gauges: {} of name -> (value, bool delta)
+    :return: int number of invalid lines
+    """
+    counters, timer_values, timer_counts = buffer.counters, buffer.timer_values, buffer.timer_counts
+    invalid = 0
+    for line in packet.split('\n'):
+        name, _, rest = line.partition(':')
+        if not rest:
+            if line.strip():
+                invalid += 1
+            continue
+
+        fields = rest.split('|')
+        if len(fields) < 2 or not name:
+            invalid += 1
+            continue
+
+        value, kind = fields[0], fields[1]
+        rate = 1.0
+        if len(fields) > 2 and fields[2][:1] == '@':
+            try:
+                rate = float(fields[2][1:])
+            except ValueError:
+                rate = 0.0
+            if not 0.0 < rate <= 1.0:
+                invalid += 1
+                continue
+
+        try:
+            number = float(value)
+        except ValueError:
+            invalid += 1
+            continue
+
+        if kind == 'c':
+            counters[name] += number / rate
+        elif kind in TIMER_TYPES:
+            timer_values[name].append(number)
+            timer_counts[name] += 1 if rate == 1.0 else int(round(1 / rate))
+        elif kind == 'g':
+            if value[0] in '+-':
+                previous = gauges.get(name)
+                gauges[name] = (previous[0] + number, previous[1]) if previous else (number, True)
+            else:
+                gauges[name] = (number, False)
+        else:
+            invalid += 1
+
+    return invalid
+
+
+class StatsdListenerCollector(AbstractCollector):
+    """
+    Receives StatsD metrics by UDP
+
+    Waits for the socket to become readable, then drains it by batches of datagrams (recvmmsg on Linux)
+    and aggregates all of them in a StatsdBuffer before passing them to the object's StatsdClient at once.
+    A cycle reads at most max_batches batches, so metrics of a never drained socket are still passed regularly.
+
+    The last value of every gauge is kept across cycles and flushes, so changes (+N, -N) are applied to it
+    even if it was set long ago. A change of an unknown gauge is applied to 0.
+
+    Own metrics:
+        statsd.listener.packets - datagrams received
+        statsd.listener.invalid - lines which can't be parsed and truncated datagrams
+        statsd.listener.dropped - datagrams dropped by the kernel because the agent didn't read them in time
+    """
+    short_name = 'statsd_listener'
+
+    max_batches = 16
+    max_gauges = 10000  # gauges to keep the last values of, changes of the others are applied to 0
+    wait_timeout = 1.0  # to notice a stopped object
+
+    def __init__(self, address=None, max_batch=256, max_size=8192, rcvbuf=None, **kwargs):
+        """
+        :param address: (str host, int port) to listen on
+        :param max_batch: int max datagrams read at once
+        :param max_size: int max datagram size
+        :param rcvbuf: int socket receive buffer size in bytes
+        """
+        super(StatsdListenerCollector, self).__init__(**kwargs)
+        self.address = address
+        self.max_batch = max_batch
+        self.max_size = max_size
+        self.rcvbuf = rcvbuf
+
+        self.sock = None
+        self.receiver = None
+        self.truncated = 0
+        self.drops = None
+        self.last_drops_check = 0
+        self.gauges = {}  # name -> last value
+
+    def run(self):
+        try:
+            super(StatsdListenerCollector, self).run()
+        finally:
+            self.close()
+
+    def open(self):
+        """
+        Binds the socket, a stopped object can still hold it for a while, so binding is retried every cycle
+
+        :return: bool - True if the socket is bound
+        """
+        family = socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            if self.rcvbuf:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            sock.bind(self.address)
+        except socket.error as e:
+            sock.close()
+            if e.errno != errno.EADDRINUSE:
+                raise
+            context.log.debug('%s:%s is in use, will retry' % self.address)
+            return False
+
+        self.sock = sock
+        self.receiver = udp_receiver(sock, max_batch=self.max_batch, max_size=self.max_size)
+        self.truncated = 0
+        self.drops = kernel_drops(sock)
+        context.log.debug('listening for statsd metrics on %s:%s' % self.address)
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.receiver = None
+
+    def collect(self):
+        if self.sock is None and not self.open():
+            return
+
+        buffer = StatsdBuffer()
+        gauges = {}
+        packets, invalid = 0, 0
+
+        for _ in xrange(self.max_batches):
+            datagrams = self.receiver.receive()
+            for datagram in datagrams:
+                invalid += parse_packet(datagram, buffer, gauges)
+            packets += len(datagrams)
+            if len(datagrams) < self.max_batch:
+                break
+
+        self.statsd.merge(buffer)
+        for name, (value, delta) in gauges.iteritems():
+            if delta:
+                value += self.gauges.get(name, 0.0)
+            if name in self.gauges or len(self.gauges) < self.max_gauges:
+                self.gauges[name] = value
+            self.statsd.gauge(name, value)
+
+        truncated, self.truncated = self.receiver.truncated - self.truncated, self.receiver.truncated
+        if packets:
+            self.statsd.incr('statsd.listener.packets', packets)
+        if invalid or truncated:
+            self.statsd.incr('statsd.listener.invalid', invalid + truncated)
+
+        self.count_drops()
+
+    def count_drops(self):
+        """
+        Reports kernel drops once per interval
+        """
+        now = time.time()
+        if now < self.last_drops_check + self.interval:
+            return
+        self.last_drops_check = now
+
+        drops = kernel_drops(self.sock)
+        if drops is not None and self.drops is not None and drops > self.drops:
+            self.statsd.incr('statsd.listener.dropped', drops - self.drops)
+        self.drops = drops
+
+    def _sleep(self):
+        if self.sock is None:
+            time.sleep(self.wait_timeout)
+        else:
+            select([self.sock], [], [], self.wait_timeout)
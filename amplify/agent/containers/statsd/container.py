@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from amplify.agent.context import context
+from amplify.agent.containers.abstract import AbstractContainer, definition_id
+from amplify.agent.containers.statsd.object import StatsdObject
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class StatsdListenerContainer(AbstractContainer):
+    """
+    Container for the StatsD listener object
+
+    It is optional and is run only if the listen address is set in the [statsd] section:
+
+        listen = 127.0.0.1:8125
+    """
+
+    type = 'statsd'
+    default_intervals = {'discover': 10.0}
+
+    @staticmethod
+    def enabled():
+        return bool((context.app_config.get('statsd') or {}).get('listen'))
+
+    def discover_objects(self):
+        if not self.objects and self.enabled():
+            listen = context.app_config.get('statsd')['listen'].strip()
+            definition = dict(
+                type=self.type,
+                hostname=context.hostname,
+                listen=listen
+            )
+
+            data = dict(listen=listen)
+
+            object_id = definition_id(definition)
+            self.objects = {object_id: StatsdObject(definition=definition, data=data)}
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from amplify.agent.context import context
+from amplify.agent.containers.abstract import AbstractObject
+from amplify.agent.containers.statsd.collectors.listener import StatsdListenerCollector, parse_address
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class StatsdObject(AbstractObject):
+    """
+    Metrics sent by local applications with the StatsD protocol
+    """
+    type = 'statsd'
+    default_intervals = {'metrics': 10.0}
+
+    def __init__(self, **kwargs):
+        super(StatsdObject, self).__init__(**kwargs)
+
+        self.listen = self.data['listen']
+
+        self.collectors = [
+            StatsdListenerCollector(
+                object=self,
+                interval=self.intervals['metrics'],
+                address=parse_address(self.listen),
+                max_batch=context.app_config.getint('statsd', 'listen_batch', default=256),
+                max_size=context.app_config.getint('statsd', 'listen_max_size', default=8192),
+                rcvbuf=context.app_config.getint('statsd', 'listen_rcvbuf', default=None),
+            )
+        ]
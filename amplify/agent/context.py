@@ -46,6 +46,8 @@ class Context(Singleton):
         self.metad = MetadContainer()
         self.configd = ConfigdContainer()
         self.top_object = None
+        self.tail_offsets = None
+        self.worker_pool = None
         self.ids = {}
         self.action_ids = {}
         self.cloud_restart = False  # Handle improper duplicate logging of start/stop events.
@@ -69,6 +71,7 @@ class Context(Singleton):
         self._setup_app_logs()
         self._setup_host_details()
         self._setup_http_client()
+        self._setup_tail_offsets()
 
     def _setup_app_config(self, **kwargs):
         self.app_name = kwargs.get('app')
@@ -100,6 +103,16 @@ class Context(Singleton):
         from amplify.agent.util.http import HTTPClient
         self.http_client = HTTPClient()
 
+    def _setup_tail_offsets(self):
+        from amplify.agent.util.tail import TailOffsets
+        tail_config = self.app_config.get('tail')
+        self.tail_offsets = TailOffsets(
+            filename=tail_config.get('offsets_file'),
+            max_catchup=int(tail_config['max_catchup']) if 'max_catchup' in tail_config else None,
+            save_interval=float(tail_config.get('offsets_save_interval', 0))
+        )
+        self.tail_offsets.load()
+
     def get_file_handlers(self):
         return [
             self.default_log.handlers[0].stream,
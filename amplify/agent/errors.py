@@ -43,3 +43,7 @@ class AmplifyFileTooLarge(AmplifyException):
 
 class AmplifySubprocessError(AmplifyException):
     description = "Subprocess finished with non-zero code"
+
+
+class AmplifyWorkerError(AmplifyException):
+    description = "Worker process failed"
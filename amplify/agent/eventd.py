@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import time
-import copy
 import hashlib
 
 from amplify.agent import CommonDataTank, CommonDataClient
@@ -71,11 +70,12 @@ class EventdClient(CommonDataClient):
         else:
             self.onetimers[event.id] = True
 
-        if event.id in self.current:
-            stored_event = self.current[event.id]
-            stored_event.inc()
-        else:
-            self.current[event.id] = event
+        with self.lock:
+            if event.id in self.current:
+                stored_event = self.current[event.id]
+                stored_event.inc()
+            else:
+                self.current[event.id] = event
 
     def flush(self):
         """
@@ -86,8 +86,7 @@ class EventdClient(CommonDataClient):
         if not self.current:
             return
 
-        delivery = copy.deepcopy(self.current)
-        self.current = {}
+        delivery = self.swap()
 
         return {
             'object': self.object.definition,
@@ -1,6 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
-
 from collections import defaultdict
 
 from amplify.agent import CommonDataTank, CommonDataClient
@@ -30,8 +28,7 @@ class MetadClient(CommonDataClient):
 
     def flush(self):
         if self.current:
-            delivery = copy.deepcopy(self.current)
-            self.current = defaultdict(dict)
+            delivery = self.swap(defaultdict(dict))
             return {
                 'object': self.object.definition,
                 'meta': delivery,
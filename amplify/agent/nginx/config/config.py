@@ -48,6 +48,7 @@ class NginxConfig(object):
         self.binary = binary
         self.prefix = prefix
         self.log_formats = {}
+        self.log_format_escapes = {}  # format name -> escape mode of log_format escape=
         self.access_logs = {}
         self.error_logs = {}
         self.test_errors = []
@@ -147,6 +148,9 @@ class NginxConfig(object):
             elif key == 'log_format':
                 for k, v in value.iteritems():
                     self.log_formats[k] = v
+            elif key == 'log_format_escape':
+                for k, v in value.iteritems():
+                    self.log_format_escapes[k] = v
             elif key == 'server' and isinstance(value, list) and 'upstream' not in ctx:
                 for server in value:
 
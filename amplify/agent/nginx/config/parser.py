@@ -33,6 +33,9 @@ IGNORED_DIRECTIVES = [
     'secure_link_secret'
 ]
 
+# log_format name [escape=default|json|none] 'format'
+LOG_FORMAT_RE = re.compile(r"([\w\d_-]+)\s+(?:escape=(default|json|none)\s+)?'(.+)'")
+
 
 def set_line_number(string, location, tokens):
     if len(tokens) == 1:
@@ -454,9 +457,13 @@ class NginxConfigParser(object):
                         continue  # Pass ignored directives.
                     elif key == 'log_format':
                         # work with log formats
-                        gwe = re.match("([\w\d_-]+)\s+'(.+)'", value)
+                        gwe = LOG_FORMAT_RE.match(value)
                         if gwe:
-                            format_name, format_value = gwe.group(1), gwe.group(2)
+                            format_name, escape, format_value = gwe.group(1), gwe.group(2), gwe.group(3)
+
+                            if escape:
+                                indexed_escape = self.__idx_save(escape, file_index, row.line_number)
+                                result.setdefault('log_format_escape', {})[format_name] = indexed_escape
 
                             indexed_value = self.__idx_save(format_value, file_index, row.line_number)
                             # Handle odd Python auto-escaping of raw strings when packing/unpacking.
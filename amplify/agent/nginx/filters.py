@@ -16,6 +16,7 @@ class Filter(object):
     def __init__(self, data=None, metric=None, filter_rule_id=None):
         self.metric = metric
         self.filter_rule_id = filter_rule_id
+        self.full_metric_name = '%s||%s' % (metric, filter_rule_id)
         self.filename = None
         self.data = {}
 
@@ -61,3 +62,89 @@ class Filter(object):
                 result = False
                 break
         return result
+
+
+class FilterIndex(object):
+    """
+    Matches a parsed line against many filters at once
+
+    Every distinct (field, value) predicate of the filters is evaluated once per line:
+    - exact values are looked up in a hash table per field
+    - wildcard patterns of a field are combined into one regex with a capturing lookahead per pattern,
+      so a single match tells which of the patterns match the value
+
+    A filter matches if all of its predicates are satisfied, as with Filter.match.
+    """
+
+    max_patterns = 90  # python regexes can't have more than 100 groups
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.exact = {}  # field -> {value: predicate id}
+        self.patterns = {}  # field -> [(regex, [predicate id of every group])]
+        self.users = []  # predicate id -> [filter positions]
+        self.sizes = []  # filter position -> number of predicates
+        self.unconditional = []  # positions of filters without predicates
+
+        predicates = {}  # (field, value or pattern, is pattern) -> predicate id
+        field_patterns = {}  # field -> [(pattern, predicate id)]
+
+        for position, log_filter in enumerate(self.filters):
+            self.sizes.append(len(log_filter.data))
+            if not log_filter.data:
+                self.unconditional.append(position)
+
+            for field, value in log_filter.data.iteritems():
+                key = (field, value.pattern, True) if isinstance(value, RE_TYPE) else (field, value, False)
+                if key not in predicates:
+                    predicates[key] = len(self.users)
+                    self.users.append([])
+
+                    if isinstance(value, str):
+                        self.exact.setdefault(field, {})[value] = predicates[key]
+                    elif isinstance(value, RE_TYPE):
+                        field_patterns.setdefault(field, []).append((value.pattern, predicates[key]))
+                    # other values never match, as in Filter.match
+
+                self.users[predicates[key]].append(position)
+
+        for field, patterns in field_patterns.iteritems():
+            regexes = []
+            for start in xrange(0, len(patterns), self.max_patterns):
+                chunk = patterns[start:start + self.max_patterns]
+                regex = re.compile(''.join('(?:(?=(%s))|)' % pattern for pattern, _ in chunk))
+                regexes.append((regex, [predicate_id for _, predicate_id in chunk]))
+            self.patterns[field] = regexes
+
+    def match(self, parsed):
+        """
+        Returns filters matching a parsed line
+
+        :param parsed: {} of parsed line
+        :return: [] of matched filters in the order they were given
+        """
+        satisfied = []
+
+        for field, table in self.exact.iteritems():
+            value = parsed.get(field)
+            if isinstance(value, basestring) and value in table:
+                satisfied.append(table[value])
+
+        for field, regexes in self.patterns.iteritems():
+            value = parsed.get(field)
+            if isinstance(value, basestring):
+                for regex, predicate_ids in regexes:
+                    for predicate_id, group in zip(predicate_ids, regex.match(value).groups()):
+                        if group is not None:
+                            satisfied.append(predicate_id)
+
+        if not satisfied:
+            return [self.filters[position] for position in self.unconditional]
+
+        hits = [0] * len(self.filters)
+        for predicate_id in satisfied:
+            for position in self.users[predicate_id]:
+                hits[position] += 1
+
+        sizes = self.sizes
+        return [log_filter for position, log_filter in enumerate(self.filters) if hits[position] == sizes[position]]
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import re
+import ujson
+from array import array
+from calendar import timegm
 
 from amplify.agent.util.escape import prep_raw
 
@@ -14,6 +17,90 @@ __email__ = "dedm@nginx.com"
 
 REQUEST_RE = re.compile(r'(?P<request_method>[A-Z]+) (?P<request_uri>/.*) (?P<server_protocol>.+)')
 
+MONTHS = dict(
+    (month, number) for number, month in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1
+    )
+)
+
+
+# values of missing variables: '-', or an empty string with log_format escape=json
+EMPTY_VALUES = ('-', '')
+
+
+def escape_char(char):
+    return char if char.isalpha() or char.isdigit() else '\\%s' % char
+
+
+def json_value(value):
+    """
+    Converts a decoded JSON value to str, as it would be matched by a regex
+    """
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def parse_time_local(value):
+    """
+    Converts $time_local to a unix timestamp
+
+    :param value: str like '18/Jun/2015:17:22:25 +0300'
+    :return: int timestamp
+    """
+    try:
+        day, month, year = value[0:2], MONTHS[value[3:6]], value[7:11]
+        hour, minute, second = value[12:14], value[15:17], value[18:20]
+        tz = value[21:26]
+        offset = (int(tz[1:3]) * 60 + int(tz[3:5])) * 60
+    except (KeyError, ValueError, IndexError):
+        raise ValueError('invalid time_local %r' % value)
+
+    if tz[0] == '+':
+        offset = -offset
+    elif tz[0] != '-':
+        raise ValueError('invalid time_local %r' % value)
+
+    return timegm((int(year), month, int(day), int(hour), int(minute), int(second))) + offset
+
+
+class AccessLogBatch(object):
+    """
+    Columnar parse results for a batch of lines
+
+    Only lines matched by the format are stored, all the columns have the same length:
+    - malformed is a mask of requests which can not be split into method, uri and protocol
+    - int and float variables are arrays of 'l' and 'd', other variables are lists of str
+    - time variables are sums of their values, time_counts keeps the numbers of values (0 for empty ones)
+    - time_values keeps lists of values of the time variables which were asked for with project()
+    - request_method, request_uri and server_protocol are None for malformed requests
+    """
+
+    def __init__(self):
+        self.lines = 0  # total number of lines
+        self.failed = 0  # lines failed to be parsed
+        self.malformed = array('b')
+        self.columns = {}
+        self.time_counts = {}
+        self.time_values = {}
+
+    def __len__(self):
+        return len(self.malformed)
+
+    def select(self, indices):
+        """
+        Returns a batch of the given lines, the numbers of total and failed lines are not copied
+
+        :param indices: [] of line indices
+        :return: AccessLogBatch
+        """
+        batch = AccessLogBatch()
+        batch.malformed = array('b', (self.malformed[i] for i in indices))
+        for section in ('columns', 'time_counts', 'time_values'):
+            selected = getattr(batch, section)
+            for key, column in getattr(self, section).iteritems():
+                values = [column[i] for i in indices]
+                selected[key] = array(column.typecode, values) if isinstance(column, array) else values
+        return batch
+
 
 class NginxAccessLogParser(object):
     """
@@ -48,22 +135,43 @@ class NginxAccessLogParser(object):
         'gzip_ratio': ['.+', float],
     }
 
+    # exact shapes of values formatted by nginx itself, compiled parse functions match these variables by them:
+    # every generic '.+' runs to the end of the line and backtracks, which makes long formats slow
+    shaped_variables = {
+        'remote_addr': r'\S+',
+        'time_local': r'\d{2}/[A-Za-z]{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}',
+        'time_iso8601': r'\S+',
+        'msec': r'[\d\.]+',
+        'request_time': r'[\d\.][\d\.,: ]*|-',
+        'gzip_ratio': r'[\d\.]+|-',
+        'host': r'\S+',
+        'server_name': r'\S+',
+        'server_port': r'\d+',
+        'scheme': r'https?',
+        'upstream_cache_status': r'\S+',
+    }
+
     request_variables = {
         'request_method': ['[A-Z]+', str],
         'request_uri': ['/.*', str],
         'server_protocol': ['[\d\.]+', str],
     }
 
-    def __init__(self, raw_format=None):
+    def __init__(self, raw_format=None, escape=None):
         """
         Takes raw format and generates regex
         :param raw_format: raw log format
+        :param escape: str escape= parameter of the log_format (default, json, none) or None if it is not set
         """
         self.raw_format = self.combined_format if raw_format is None else raw_format
+        self.escape = escape
 
         self.keys = []
         self.regex_string = r''
         self.regex = None
+        self.fields = None  # fields to put into the parse result, None means all of them
+        self.time_values = set()  # time variables to keep lists of values for in columnar mode
+        self.parts = []  # list of (is_variable, variable name or literal char)
         current_key = None
 
         self.raw_format = prep_raw(self.raw_format)
@@ -79,6 +187,11 @@ class NginxAccessLogParser(object):
             else:
                 regex_var_name = key_without_dollar
             self.regex_string += '(?P<%s>%s)' % (regex_var_name, rxp)
+            self.parts.append((True, key_without_dollar))
+
+        def add_char(char):
+            self.regex_string += escape_char(char)
+            self.parts.append((False, char))
 
         for char in self.raw_format:
             if current_key:
@@ -96,19 +209,13 @@ class NginxAccessLogParser(object):
                     else:
                         # otherwise - add char to regex
                         current_key = None
-                        if char.isalpha() or char.isdigit():
-                            self.regex_string += char
-                        else:
-                            self.regex_string += '\%s' % char
+                        add_char(char)
             else:
                 # if there's no current key
                 if char == '$':
                     current_key = char
                 else:
-                    if char.isalpha() or char.isdigit():
-                        self.regex_string += char
-                    else:
-                        self.regex_string += '\%s' % char
+                    add_char(char)
 
         # key can be the last one element in a string
         if current_key:
@@ -116,10 +223,414 @@ class NginxAccessLogParser(object):
 
         self.regex = re.compile(self.regex_string)
 
-    def parse(self, line):
+        # specialized parse functions for this format (parse_generic is the reference implementation)
+        self.row_schema = None
+        self.parse = self.compile_parse()
+        self.parse_row = self.compile_parse(columnar=True)
+
+    def project(self, fields, time_values=None):
+        """
+        Limits parse results to the given fields
+
+        Variables that are not needed are still matched by the format regex, but they are neither
+        captured nor converted. Request is always split, because malformed requests are detected by it.
+
+        :param fields: iterable of field names or None for all the fields
+        :param time_values: iterable of time variables to keep lists of values for in AccessLogBatch
+        """
+        self.fields = set(fields) if fields is not None else None
+        self.time_values = set(time_values) if time_values else set()
+        self.parse = self.compile_parse()
+        self.parse_row = self.compile_parse(columnar=True)
+
+    def variable_regex(self, key):
+        """
+        :param key: str variable name
+        :return: str regex compiled parse functions match the variable with
+        """
+        return self.shaped_variables.get(key) or self.common_variables.get(key, self.default_variable)[0]
+
+    def split_plan(self):
+        """
+        Checks if the format is strictly delimited: "prefix $var sep $var ... sep $var suffix"
+        with the same non-empty separator between all the variables
+
+        :return: (prefix, separator, suffix) or None if the format can not be parsed with split
+        """
+        literals = ['']  # literals before, between and after variables
+        variables = 0
+        for is_variable, value in self.parts:
+            if is_variable:
+                variables += 1
+                literals.append('')
+            else:
+                literals[-1] += value
+
+        if variables < 2:
+            return None
+
+        prefix, separators, suffix = literals[0], set(literals[1:-1]), literals[-1]
+        if len(separators) != 1:
+            return None
+
+        separator = separators.pop()
+        if not separator:
+            return None
+
+        return prefix, separator, suffix
+
+    def json_plan(self):
+        """
+        Checks if the format is a JSON object with variables as whole values (log_format escape=json):
+        '{"status": "$status", "upstream": {"addr": "$upstream_addr", "time": $upstream_response_time}}'
+
+        With escape=none values are written as is, so a quote in any of them breaks the object and such lines
+        would be decoded twice (as JSON and by the regex) - only the regex is used for these formats.
+
+        :return: [] of paths (lists of keys and indexes) to the variables in the order of the format or None
+        """
+        if self.escape == 'none' or not self.raw_format.strip().startswith('{'):
+            return None
+
+        placeholder = '@amplify_var_%s@'
+        template = ''
+        variables = 0
+        for i, (is_variable, value) in enumerate(self.parts):
+            if not is_variable:
+                template += value
+                continue
+
+            quoted = 0 < i < len(self.parts) - 1 and self.parts[i - 1] == (False, '"') and self.parts[i + 1] == (False, '"')
+            template += placeholder % variables if quoted else '"%s"' % placeholder % variables
+            variables += 1
+
+        try:
+            decoded = ujson.loads(template)
+        except ValueError:
+            return None
+
+        if not isinstance(decoded, dict):
+            return None
+
+        paths = {}
+
+        def walk(node, path):
+            if isinstance(node, dict):
+                items = node.iteritems()
+            elif isinstance(node, list):
+                items = enumerate(node)
+            else:
+                return
+            for key, value in items:
+                if isinstance(value, basestring):
+                    paths[value] = path + [key]
+                else:
+                    walk(value, path + [key])
+
+        walk(decoded, [])
+
+        # every variable should be a whole value
+        try:
+            return [paths[placeholder % i] for i in xrange(variables)]
+        except KeyError:
+            return None
+
+    def compile_parse(self, columnar=False):
+        """
+        Generates a parse function specialized for the current format
+
+        Without a projection the function returns exactly the same as parse_generic, but:
+        - fields are taken by position from a regex without named groups (or from a split, see below)
+        - converters are bound per field, time arrays are processed inline
+        - request is split into method, uri and protocol right in the same function
+        - variables out of self.fields are not captured at all
+
+        The request split is not embedded into the main regex: an alternation inside a greedy
+        format regex multiplies the backtracking and makes the whole match about twice slower.
+
+        If the format is strictly delimited (see split_plan) the line is split by the separator,
+        every field is checked with its variable regex and the regex is used only for lines
+        which can not be split unambiguously.
+
+        If the format is JSON (see json_plan) lines are decoded with ujson and the regex is used only
+        for lines which are not valid JSON. Unlike the regex, JSON values are not checked by variable regexes.
+
+        :param columnar: bool - generate a function returning a row of self.row_schema instead of a dict
+        :return: function(line) -> dict (or tuple/None for columnar)
+        """
+        empty_result = 'None' if columnar else '{"malformed": False}'
+        regex_string = ''
+        fields = {}  # key -> group index of its first appearance
+
+        group = 0
+        for is_variable, value in self.parts:
+            if not is_variable:
+                regex_string += escape_char(value)
+                continue
+
+            rxp = self.variable_regex(value)
+            if self.fields is None or value in self.fields or value == 'request':
+                regex_string += '(%s)' % rxp
+                fields.setdefault(value, group)
+                group += 1
+            else:
+                regex_string += '(?:%s)' % rxp
+
+        namespace = {'match': re.compile(regex_string).match}
+        code = [
+            'def parse(line):',
+            '    m = match(line)',
+            '    if m is None:',
+            '        return %s' % empty_result,
+            '    g = m.groups()',
+        ]
+        parse_regex = self._compile_function(code, fields, namespace, columnar)
+
+        paths = self.json_plan()
+        if paths is not None:
+            return self._compile_json(parse_regex, paths, columnar)
+
+        plan = self.split_plan()
+        if plan is None:
+            return parse_regex
+
+        prefix, separator, suffix = plan
+        variables = [value for is_variable, value in self.parts if is_variable]
+
+        # for the split every variable has a fixed position
+        fields = {}
+        for index, key in enumerate(variables):
+            fields.setdefault(key, index)
+
+        namespace = {
+            'parse_regex': parse_regex,
+            'prefix': prefix,
+            'separator': separator,
+            'suffix': suffix,
+        }
+        code = [
+            'def parse(line):',
+            '    if "\\n" in line or not line.startswith(prefix) or not line.endswith(suffix) or \\',
+            '            line.count(separator, %s) != %s:' % (len(prefix), len(variables) - 1),
+            '        return parse_regex(line)',
+        ]
+
+        # str.count skips overlapping occurrences of separators like '" "', so lines with them go to the regex
+        for period in xrange(1, len(separator)):
+            if separator[period:] == separator[:-period]:
+                overlap = 'overlap_%s' % period
+                namespace[overlap] = separator[:period] + separator
+                code += [
+                    '    if %s in line:' % overlap,
+                    '        return parse_regex(line)',
+                ]
+
+        code += [
+            '    g = line[%s:len(line) - %s].split(separator)' % (len(prefix), len(suffix)),
+            '    if len(g) != %s \\' % len(variables),
+        ]
+
+        # every field should be matched by its variable regex as a whole, otherwise the regex can split it differently
+        for index, key in enumerate(variables):
+            rxp = self.variable_regex(key)
+            if rxp == '.+':
+                code.append('        or not g[%s] \\' % index)
+            else:
+                validator = 'validate_%s' % index
+                namespace[validator] = re.compile('(?:%s)\\Z' % rxp).match
+                code.append('        or %s(g[%s]) is None \\' % (validator, index))
+        code[-1] = code[-1][:-2] + ':'
+        code.append('        return parse_regex(line)')
+
+        return self._compile_function(code, fields, namespace, columnar)
+
+    def _compile_json(self, parse_regex, paths, columnar=False):
+        """
+        Generates a parse function for JSON formats
+
+        :param parse_regex: function to parse lines which are not valid JSON
+        :param paths: [] of variable paths from json_plan
+        :param columnar: bool - return rows instead of dicts
+        :return: function(line) -> dict (or tuple/None for columnar)
+        """
+        variables = [value for is_variable, value in self.parts if is_variable]
+
+        fields = {}
+        values = []
+        for key, path in zip(variables, paths):
+            if key in fields or (self.fields is not None and key not in self.fields and key != 'request'):
+                continue
+            fields[key] = len(values)
+            values.append('d%s' % ''.join('[%r]' % step for step in path))
+
+        # strings are decoded to unicode, other values (like unquoted numbers) go through json_value
+        namespace = {'parse_regex': parse_regex, 'json_value': json_value}
+        code = [
+            'def parse(line, d):',
+            '    try:',
+            '        try:',
+            '            g = (%s)' % ''.join('%s.encode("utf-8"), ' % value for value in values),
+            '        except AttributeError:',
+            '            g = (%s)' % ''.join('json_value(%s), ' % value for value in values),
+            '    except (KeyError, IndexError, TypeError):',
+            '        return parse_regex(line)',
+        ]
+        parse_decoded = self._compile_function(code, fields, namespace, columnar)
+        loads = ujson.loads
+
+        def parse(line):
+            try:
+                decoded = loads(line)
+            except ValueError:
+                return parse_regex(line)
+            return parse_decoded(line, decoded)
+
+        return parse
+
+    def _compile_function(self, code, fields, namespace, columnar=False):
+        """
+        Adds field processing to the beginning of a parse function and compiles it
+
+        In columnar mode values are kept in local variables and returned as a tuple:
+        (malformed, value, value, ...) in the order of self.row_schema
+
+        :param code: [] of code lines, they should put captured values into "g"
+        :param fields: {} of key -> index in "g"
+        :param namespace: {} of globals for the function
+        :param columnar: bool - return a row instead of a dict
+        :return: function(line) -> dict (or tuple for columnar)
+        """
+        namespace['request_match'] = REQUEST_RE.match
+        namespace['EMPTY_VALUES'] = EMPTY_VALUES
+        schema = []  # (name, typecode, AccessLogBatch attribute)
+        row = ['malformed']
+
+        def store(key, expression, typecode=None, section='columns'):
+            if columnar:
+                local = 'c%s' % len(schema)
+                schema.append((key, typecode, section))
+                row.append(local)
+                code.append('    %s = %s' % (local, expression))
+            else:
+                code.append('    result[%r] = %s' % (key, expression))
+
+        if columnar:
+            code.append('    malformed = False')
+        else:
+            code.append('    result = {"malformed": False}')
+
+        request_keys = ('request_method', 'request_uri', 'server_protocol')
+
+        for key in sorted(fields, key=fields.get):
+            if self.fields is not None and key not in self.fields:
+                continue
+            if columnar and 'request' in fields and key in request_keys:
+                continue  # will be overwritten by the request split anyway
+
+            index = fields[key]
+            func = self.common_variables.get(key, self.default_variable)[1]
+            if func is str:
+                code.append('    value = g[%s]' % index)
+            else:
+                converter = 'convert_%s' % index
+                namespace[converter] = func
+                code += [
+                    '    try:',
+                    '        value = %s(g[%s])' % (converter, index),
+                    '    except ValueError:',
+                    '        value = 0',
+                ]
+
+            if key.endswith('_time'):
+                code += [
+                    '    if value not in EMPTY_VALUES:',
+                    '        array_value = [',
+                    '            x for x in map(float, value.replace(" ", "").replace(":", ",").split(","))',
+                    '            if x <= 10000000',
+                    '        ]',
+                ]
+                if columnar:
+                    code += [
+                        '    else:',
+                        '        array_value = ()',
+                    ]
+                    store(key, 'sum(array_value)', 'd')
+                    store(key, 'len(array_value)', 'l', section='time_counts')
+                    if key in self.time_values:
+                        store(key, 'array_value', section='time_values')
+                else:
+                    code += [
+                        '        if array_value:',
+                        '            result[%r] = array_value' % key,
+                    ]
+            else:
+                store(key, 'value', {int: 'l', float: 'd'}.get(func))
+
+        if 'request' in fields:
+            code += [
+                '    req = request_match(g[%s])' % fields['request'],
+                '    if req is None:',
+            ]
+            if columnar:
+                code += [
+                    '        malformed = True',
+                    '        request_method = request_uri = server_protocol = None',
+                    '    else:',
+                    '        request_method, request_uri, server_protocol = req.groups()',
+                ]
+                for req_key in request_keys:
+                    store(req_key, req_key)
+            else:
+                code += [
+                    '        result["malformed"] = True',
+                    '    else:',
+                    '        result["request_method"], result["request_uri"], result["server_protocol"] = req.groups()',
+                ]
+
+        if columnar:
+            code.append('    return (%s,)' % ', '.join(row))
+            self.row_schema = schema
+        else:
+            code.append('    return result')
+
+        exec(compile('\n'.join(code), '<%s>' % self.short_name, 'exec'), namespace)
+        return namespace['parse']
+
+    def parse_batch(self, lines):
+        """
+        Parses lines into columns
+
+        :param lines: iterable of log lines
+        :return: AccessLogBatch
+        """
+        batch = AccessLogBatch()
+        parse_row = self.parse_row
+        rows = []
+
+        for line in lines:
+            batch.lines += 1
+            try:
+                row = parse_row(line)
+            except ValueError:
+                batch.failed += 1
+                continue
+            if row is not None:
+                rows.append(row)
+
+        columns = zip(*rows) if rows else [()] * (len(self.row_schema) + 1)
+        batch.malformed = array('b', columns[0])
+        for (key, typecode, section), column in zip(self.row_schema, columns[1:]):
+            if typecode:
+                column = array(typecode, column)
+            else:
+                column = list(column)
+            getattr(batch, section)[key] = column
+
+        return batch
+
+    def parse_generic(self, line):
         """
-        Parses the line and if there are some special fields - parse them too
-        For example we can get HTTP method and HTTP version from request
+        Parses the line with the generic regex going through all the keys of the format
 
         :param line: log line
         :return: dict with parsed info
@@ -140,9 +651,10 @@ class NginxAccessLogParser(object):
                 # time variables should be parsed to array of float
                 if key.endswith('_time'):
                     # skip empty vars
-                    if value != '-':
+                    if value not in EMPTY_VALUES:
                         array_value = []
-                        for x in value.replace(' ', '').split(','):
+                        # values of internal redirects are separated with colons
+                        for x in value.replace(' ', '').replace(':', ',').split(','):
                             x = float(x)
                             # workaround for an old nginx bug with time. ask lonerr@ for details
                             if x > 10000000:
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
-import time
-import copy
+import random
+from bisect import bisect_left
 from collections import defaultdict
+from fnmatch import fnmatchcase
+from functools import partial
+from threading import Lock
 
 from amplify.agent import Singleton
+from amplify.agent.util.clock import clock
+from amplify.agent.util.quantiles import nearest_rank, select
+from amplify.agent.util.sketch import DDSketch
 
 
 __author__ = "Mike Belov"
@@ -46,8 +52,263 @@ class StatsdContainer(Singleton):
         return result
 
 
+class StatsdBuffer(object):
+    """
+    Plain local aggregation of counters, timers and averages
+
+    Has the same methods as StatsdClient for these metrics and is merged into a StatsdClient at once.
+    Collectors fill it during a collect cycle to keep timestamps and slot lists out of the per-line work.
+    Can be pickled, so it is used to return partial results from worker processes.
+    """
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timer_values = defaultdict(list)
+        self.timer_counts = defaultdict(int)  # numbers of values represented by the timers if not all are kept
+        self.average_values = defaultdict(list)
+
+    def incr(self, metric_name, value=None):
+        self.counters[metric_name] += 1 if value is None else value
+
+    def timer(self, metric_name, value):
+        self.timer_values[metric_name].append(value)
+
+    def timers(self, metric_name, values):
+        self.timer_values[metric_name].extend(values)
+
+    def average(self, metric_name, value):
+        self.average_values[metric_name].append(value)
+
+    def averages(self, metric_name, values):
+        self.average_values[metric_name].extend(values)
+
+    def merge(self, buffer):
+        for metric_name, value in buffer.counters.iteritems():
+            self.counters[metric_name] += value
+
+        for metric_name, values in buffer.timer_values.iteritems():
+            self.timer_values[metric_name].extend(values)
+
+        for metric_name, count in buffer.timer_counts.iteritems():
+            self.timer_counts[metric_name] += count
+
+        for metric_name, values in buffer.average_values.iteritems():
+            self.average_values[metric_name].extend(values)
+
+
+class SampledStatsdBuffer(StatsdBuffer):
+    """
+    StatsdBuffer for metrics of 1-in-rate sampled lines
+
+    Counters are scaled back up by the rate. Every timer keeps a uniform sample of at most reservoir_size values
+    (reservoir sampling, Vitter's algorithm R) and the estimated number of all the values for its count metric.
+    Averages don't depend on the rate and are kept as they are.
+    """
+    def __init__(self, rate, reservoir_size=1000, rnd=None):
+        super(SampledStatsdBuffer, self).__init__()
+        self.rate = rate
+        self.reservoir_size = reservoir_size
+        self.timer_seen = defaultdict(int)  # sampled values passed to a timer
+        self.random = rnd if rnd is not None else random.Random()
+
+    def incr(self, metric_name, value=None):
+        self.counters[metric_name] += (1 if value is None else value) * self.rate
+
+    def timer(self, metric_name, value):
+        seen = self.timer_seen[metric_name] = self.timer_seen[metric_name] + 1
+        self.timer_counts[metric_name] += self.rate
+
+        reservoir = self.timer_values[metric_name]
+        if len(reservoir) < self.reservoir_size:
+            reservoir.append(value)
+        else:
+            position = int(self.random.random() * seen)
+            if position < self.reservoir_size:
+                reservoir[position] = value
+
+    def timers(self, metric_name, values):
+        for value in values:
+            self.timer(metric_name, value)
+
+    def merge(self, buffer):
+        """
+        Adds metrics of sampled lines counted with a plain StatsdBuffer
+        """
+        for metric_name, value in buffer.counters.iteritems():
+            self.incr(metric_name, value)
+
+        for metric_name, values in buffer.timer_values.iteritems():
+            self.timers(metric_name, values)
+
+        for metric_name, values in buffer.average_values.iteritems():
+            self.averages(metric_name, values)
+
+
+class TimerOptions(object):
+    """
+    Percentiles and histogram buckets reported for timers
+
+    Both are set in the [statsd] section for all timers and for metric name patterns (fnmatch):
+
+        timer_percentiles = 50, 95
+        timer_percentiles.nginx.upstream.*.time = 50, 90, 99, 99.9
+        timer_buckets.nginx.http.request.time = 0.01, 0.1, 0.5, 1, 5
+
+    Dimensions (like filter ids) are not matched. The longest matching pattern wins.
+    """
+
+    default_percentiles = (50.0, 95.0)
+    max_cached = 10000
+
+    def __init__(self, percentiles=None, buckets=None):
+        """
+        :param percentiles: {} of pattern -> tuple of float percentiles, '*' is for all timers
+        :param buckets: {} of pattern -> tuple of float upper bounds
+        """
+        self.percentiles = {'*': self.default_percentiles}
+        self.percentiles.update(percentiles or {})
+        self.buckets = buckets or {}
+        self.cache = {}  # metric name without dimensions -> (percentiles, buckets)
+
+    @classmethod
+    def from_config(cls, section):
+        """
+        :param section: {} of [statsd] options
+        :return: TimerOptions
+        """
+        settings = {'timer_percentiles': {}, 'timer_buckets': {}}
+        for key, value in section.iteritems():
+            name, _, pattern = key.partition('.')
+            if name in settings and value:
+                settings[name][pattern or '*'] = tuple(sorted(float(x) for x in value.split(',') if x.strip()))
+        return cls(percentiles=settings['timer_percentiles'], buckets=settings['timer_buckets'])
+
+    def get(self, metric_name):
+        """
+        :param metric_name: timer name
+        :return: (tuple of percentiles, tuple of bucket bounds)
+        """
+        name = metric_name.split('||', 1)[0]
+        options = self.cache.get(name)
+        if options is None:
+            if len(self.cache) >= self.max_cached:
+                self.cache.clear()
+            options = self.cache[name] = (
+                self.match(self.percentiles, name) or (), self.match(self.buckets, name) or ()
+            )
+        return options
+
+    @staticmethod
+    def match(patterns, name):
+        matched = [pattern for pattern in patterns if fnmatchcase(name, pattern)]
+        return patterns[max(matched, key=len)] if matched else None
+
+    @staticmethod
+    def percentile_name(percentile):
+        """
+        :param percentile: float percentile
+        :return: str suffix of the metric: median, pctl95, pctl99_9
+        """
+        if percentile == 50:
+            return 'median'
+        return 'pctl%s' % ('%g' % percentile).replace('.', '_')
+
+    @staticmethod
+    def bucket_name(bound):
+        """
+        :param bound: float upper bound
+        :return: str suffix of the metric: le_0_5
+        """
+        return 'le_%s' % ('%g' % bound).replace('.', '_')
+
+
+class MetricKeys(dict):
+    """
+    Registry of the keys metrics are flushed with: metric name -> key
+
+    Keys are metric names with their type prefix ('C|nginx.http.request.count'). Names and keys are interned
+    and formatted on the first lookup only, so the same strings are not allocated again on every flush and
+    known names are looked up at the speed of a dict. The registry is cleared if it grows over max_size
+    (dimensions with too many values).
+    """
+
+    max_size = 100000
+
+    def __init__(self, prefix=''):
+        """
+        :param prefix: str type prefix of the keys - C| or G|
+        """
+        super(MetricKeys, self).__init__()
+        self.prefix = prefix
+
+    @staticmethod
+    def intern(value):
+        # only plain strings can be interned, names from the cloud config can be unicode
+        return intern(value) if type(value) is str else value
+
+    def __missing__(self, metric_name):
+        if len(self) >= self.max_size:
+            self.clear()
+        key = self[self.intern(metric_name)] = self.key(metric_name)
+        return key
+
+    def key(self, metric_name):
+        return self.intern(self.prefix + metric_name)
+
+
+class TimerKeys(MetricKeys):
+    """
+    Registry of the keys timers are flushed with: timer name -> (average key, count key, max key,
+    [] of (percentile, key), [] of (bound, key))
+    """
+
+    def __init__(self, timer_options=None):
+        """
+        :param timer_options: TimerOptions
+        """
+        super(TimerKeys, self).__init__()
+        self.timer_options = timer_options or TimerOptions()
+
+    def key(self, metric_name):
+        percentiles, bounds = self.timer_options.get(metric_name)
+        percentile_name, bucket_name = self.timer_options.percentile_name, self.timer_options.bucket_name
+        return (
+            self.intern('G|%s' % metric_name),
+            self.intern('C|%s.count' % metric_name),
+            self.intern('G|%s.max' % metric_name),
+            [(percentile, self.intern('G|%s.%s' % (metric_name, percentile_name(percentile))))
+             for percentile in percentiles],
+            [(bound, self.intern('C|%s.%s' % (metric_name, bucket_name(bound)))) for bound in bounds],
+        )
+
+
 class StatsdClient(object):
-    def __init__(self, address=None, port=None, interval=None, object=None):
+    """
+    Aggregates metrics of an object between pushes
+
+    Memory is limited by two budgets (0 means no limit):
+    - max_series: new series over the limit are written to the overflow series of their metric
+      (the dimensions are replaced with overflow_key), up to max_overflow_series of such metrics.
+      Values of the other series (names without dimensions too) are dropped, so values of different
+      metrics are never mixed. The numbers of series are reported as statsd.series.overflow and
+      statsd.series.dropped - exactly up to max_tracked_drops, after that every write of such a series is counted
+    - max_samples: values kept in all the timers and averages, when there are more of them every other value
+      is dropped everywhere (so values written before that are kept at a lower rate than later ones),
+      the timer counts include the dropped values, their numbers are reported as statsd.samples.dropped
+    """
+
+    overflow_key = 'other'
+    max_overflow_series = 100
+    max_tracked_drops = 1000
+
+    def __init__(self, address=None, port=None, interval=None, object=None, timer_accuracy=None,
+                 timer_options=None, max_series=0, max_samples=0):
+        """
+        :param timer_accuracy: float relative accuracy of timer quantiles - if set, timers keep DDSketch
+                               instead of all the values
+        :param timer_options: TimerOptions
+        :param max_series: int max number of series between pushes
+        :param max_samples: int max number of values kept in timers and averages
+        """
         # Import context as a class object to avoid circular import on statsd.  This could be refactored later.
         from amplify.agent.context import context
         self.context = context
@@ -56,8 +317,106 @@ class StatsdClient(object):
         self.port = port
         self.object = object
         self.interval = interval
+        self.timer_accuracy = timer_accuracy
+        self.timer_options = timer_options or TimerOptions()
+        self.counter_keys = MetricKeys('C|')
+        self.gauge_keys = MetricKeys('G|')
+        self.timer_keys = TimerKeys(self.timer_options)
         self.current = defaultdict(dict)
         self.delivery = defaultdict(dict)
+        self.lock = Lock()  # see CommonDataClient
+
+        self.max_series = max_series
+        self.max_samples = max_samples
+        self.series = 0  # series in the current metrics
+        self.samples = 0  # values kept in the current timers and averages
+        self.overflow_series = 0  # dimension overflow series in the current metrics
+        self.over_names = set()  # names over the budget, at most max_tracked_drops
+        self.overflowed_series = 0
+        self.dropped_series = 0
+        self.dropped_samples = 0
+
+    def admit(self, kind, metric_name):
+        """
+        Returns the name to write a metric with, should be called with the lock held
+
+        :param kind: str kind of metrics (counter, timer...)
+        :param metric_name: metric name
+        :return: str metric name, the name of its overflow series or None if the value should be dropped
+        """
+        if not self.max_series or metric_name in self.current[kind]:
+            return metric_name
+
+        if self.series < self.max_series:
+            self.series += 1
+            return metric_name
+
+        # dimensions are separated with || (filters, peers) or | (disks, interfaces)
+        overflow_name = None
+        base, separator, _ = metric_name.partition('|')
+        if separator:
+            if metric_name[len(base) + 1:len(base) + 2] == '|':
+                separator = '||'
+            overflow_name = '%s%s%s' % (base, separator, self.overflow_key)
+            if overflow_name not in self.current[kind]:
+                if self.overflow_series < self.max_overflow_series:
+                    self.overflow_series += 1
+                else:
+                    overflow_name = None
+
+        if metric_name not in self.over_names:
+            if overflow_name is None:
+                self.dropped_series += 1
+            else:
+                self.overflowed_series += 1
+            if len(self.over_names) < self.max_tracked_drops:
+                self.over_names.add(metric_name)
+        return overflow_name
+
+    def keep(self, count):
+        """
+        Accounts values added to timers and averages, should be called with the lock held
+
+        :param count: int number of values added
+        """
+        self.samples += count
+        while self.max_samples and self.samples > self.max_samples:
+            if not self.downsample():
+                break
+
+    def downsample(self):
+        """
+        Drops every other value of all the timers and averages
+
+        :return: int number of values dropped
+        """
+        dropped = 0
+        extra_counts = self.current['timer_count']
+
+        def halve(values):
+            length = len(values)
+            values[:] = values[::2]
+            return length - len(values)
+
+        for values in self.current['average'].itervalues():
+            dropped += halve(values)
+
+        for metric_name, values in self.current['timer'].iteritems():
+            if isinstance(values, list):
+                count = halve(values)
+                extra_counts[metric_name] = extra_counts.get(metric_name, 0) + count
+                dropped += count
+
+        for buckets in self.current['timer_at'].itervalues():
+            for bucket in buckets.itervalues():
+                if isinstance(bucket[0], list):
+                    count = halve(bucket[0])
+                    bucket[1] += count
+                    dropped += count
+
+        self.samples -= dropped
+        self.dropped_samples += dropped
+        return dropped
 
     def average(self, metric_name, value):
         """
@@ -66,10 +425,7 @@ class StatsdClient(object):
         :param metric_name:  metric name
         :param value:  metric value
         """
-        if metric_name in self.current['average']:
-            self.current['average'][metric_name].append(value)
-        else:
-            self.current['average'][metric_name] = [value]
+        self.averages(metric_name, (value,))
 
     def timer(self, metric_name, value):
         """
@@ -84,10 +440,52 @@ class StatsdClient(object):
         :param metric_name: metric name
         :param value: metric value
         """
-        if metric_name in self.current['timer']:
-            self.current['timer'][metric_name].append(value)
-        else:
-            self.current['timer'][metric_name] = [value]
+        self.timers(metric_name, (value,))
+
+    def averages(self, metric_name, values):
+        """
+        Same as average but for a list of values
+
+        :param metric_name: metric name
+        :param values: [] of metric values
+        """
+        with self.lock:
+            metric_name = self.admit('average', metric_name)
+            if metric_name is None:
+                return
+            if metric_name in self.current['average']:
+                self.current['average'][metric_name].extend(values)
+            else:
+                self.current['average'][metric_name] = list(values)
+            self.keep(len(values))
+
+    def timers(self, metric_name, values, extra_count=0):
+        """
+        Same as timer but for a list of values
+
+        :param metric_name: metric name
+        :param values: [] of metric values
+        :param extra_count: int number of values represented by the timer, but not passed (sampled lines)
+        """
+        with self.lock:
+            metric_name = self.admit('timer', metric_name)
+            if metric_name is None:
+                return
+            if self.timer_accuracy:
+                sketch = self.current['timer'].get(metric_name)
+                if sketch is None:
+                    sketch = self.current['timer'][metric_name] = DDSketch(self.timer_accuracy)
+                sketch.update(values)
+            else:
+                if metric_name in self.current['timer']:
+                    self.current['timer'][metric_name].extend(values)
+                else:
+                    self.current['timer'][metric_name] = list(values)
+                self.keep(len(values))
+
+            if extra_count:
+                extra_counts = self.current['timer_count']
+                extra_counts[metric_name] = extra_counts.get(metric_name, 0) + extra_count
 
     def incr(self, metric_name, value=None, rate=None):
         """
@@ -97,30 +495,95 @@ class StatsdClient(object):
         :param value: metric value
         :param rate: rate
         """
-        timestamp = int(time.time())
+        with self.lock:
+            metric_name = self.admit('counter', metric_name)
+            if metric_name is None:
+                return
+            timestamp = clock.now
+
+            if value is None:
+                value = 1
+
+            # new metric
+            if metric_name not in self.current['counter']:
+                self.current['counter'][metric_name] = [[timestamp, value]]
+                return
+
+            # metric exists
+            slots = self.current['counter'][metric_name]
+            last_stamp, last_value = slots[-1]
+
+            # if rate is set then check it's time
+            if self.interval and rate:
+                sample_duration = self.interval * rate
+                # write to current slot
+                if timestamp < last_stamp + sample_duration:
+                    self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
+                else:
+                    self.current['counter'][metric_name].append([last_stamp, value])
+            else:
+                self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
 
-        if value is None:
-            value = 1
+    def incr_at(self, metric_name, value, timestamp):
+        """
+        Counter for a given time (event time of a log line for example)
 
-        # new metric
-        if metric_name not in self.current['counter']:
-            self.current['counter'][metric_name] = [[timestamp, value]]
-            return
+        :param metric_name: metric name
+        :param value: metric value
+        :param timestamp: int timestamp
+        """
+        with self.lock:
+            metric_name = self.admit('counter', metric_name)
+            if metric_name is None:
+                return
+            slots = self.current['counter'].setdefault(metric_name, [])
+            for slot in reversed(slots):
+                if slot[0] == timestamp:
+                    slot[1] += value
+                    return
+            slots.append([timestamp, value])
+
+    def merge(self, buffer, timestamp=None):
+        """
+        Adds all metrics of a StatsdBuffer
 
-        # metric exists
-        slots = self.current['counter'][metric_name]
-        last_stamp, last_value = slots[-1]
+        Counters and timers are reported with the timestamp if it is given, otherwise with the current time.
 
-        # if rate is set then check it's time
-        if self.interval and rate:
-            sample_duration = self.interval * rate
-            # write to current slot
-            if timestamp < last_stamp + sample_duration:
-                self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
+        :param buffer: StatsdBuffer
+        :param timestamp: int timestamp
+        """
+        for metric_name, value in buffer.counters.iteritems():
+            if timestamp is None:
+                self.incr(metric_name, value)
             else:
-                self.current['counter'][metric_name].append([last_stamp, value])
-        else:
-            self.current['counter'][metric_name][-1] = [last_stamp, last_value + value]
+                self.incr_at(metric_name, value, timestamp)
+
+        for metric_name, values in buffer.timer_values.iteritems():
+            # timers of sampled lines represent more values than they keep
+            extra_count = max(buffer.timer_counts.get(metric_name, 0) - len(values), 0)
+
+            if timestamp is None:
+                self.timers(metric_name, values, extra_count)
+                continue
+
+            with self.lock:
+                metric_name = self.admit('timer_at', metric_name)
+                if metric_name is None:
+                    continue
+                buckets = self.current['timer_at'].setdefault(metric_name, {})
+                if timestamp not in buckets:
+                    buckets[timestamp] = [DDSketch(self.timer_accuracy) if self.timer_accuracy else [], 0]
+                bucket = buckets[timestamp]
+                if self.timer_accuracy:
+                    bucket[0].update(values)
+                else:
+                    bucket[0].extend(values)
+                bucket[1] += extra_count
+                if not self.timer_accuracy:
+                    self.keep(len(values))
+
+        for metric_name, values in buffer.average_values.iteritems():
+            self.averages(metric_name, values)
 
     def agent(self, metric_name, value):
         """
@@ -128,8 +591,8 @@ class StatsdClient(object):
         :param metric_name: metric
         :param value: value
         """
-        timestamp = int(time.time())
-        self.current['gauge'][metric_name] = [(timestamp, value)]
+        with self.lock:
+            self.current['gauge'][metric_name] = [(clock.now, value)]
 
     def gauge(self, metric_name, value, delta=False, prefix=False):
         """
@@ -138,54 +601,92 @@ class StatsdClient(object):
         :param value: metric value
         :param delta: metric delta (applicable only if we have previous values)
         """
-        timestamp = int(time.time())
-
-        if metric_name in self.current['gauge']:
-            if delta:
-                last_stamp, last_value = self.current['gauge'][metric_name][-1]
-                new_value = last_value + value
+        with self.lock:
+            metric_name = self.admit('gauge', metric_name)
+            if metric_name is None:
+                return
+            timestamp = clock.now
+
+            if metric_name in self.current['gauge']:
+                if delta:
+                    last_stamp, last_value = self.current['gauge'][metric_name][-1]
+                    new_value = last_value + value
+                else:
+                    new_value = value
+                self.current['gauge'][metric_name].append((timestamp, new_value))
             else:
-                new_value = value
-            self.current['gauge'][metric_name].append((timestamp, new_value))
-        else:
-            self.current['gauge'][metric_name] = [(timestamp, value)]
+                self.current['gauge'][metric_name] = [(timestamp, value)]
+
+    def swap(self):
+        """
+        Replaces the current metrics with empty ones
+
+        :return: previous metrics
+        """
+        with self.lock:
+            delivery, self.current = self.current, defaultdict(dict)
+
+            # the agent's own metrics about the budgets
+            timestamp = clock.tick()
+            if self.overflowed_series:
+                delivery['gauge']['statsd.series.overflow'] = [(timestamp, self.overflowed_series)]
+            if self.dropped_series:
+                delivery['gauge']['statsd.series.dropped'] = [(timestamp, self.dropped_series)]
+            if self.dropped_samples:
+                delivery['gauge']['statsd.samples.dropped'] = [(timestamp, self.dropped_samples)]
+
+            self.series = 0
+            self.samples = 0
+            self.overflow_series = 0
+            self.over_names = set()
+            self.overflowed_series = 0
+            self.dropped_series = 0
+            self.dropped_samples = 0
+        return delivery
 
     def flush(self):
         if not self.current:
             return
 
+        # metrics taken away are not shared with writers anymore, so they are aggregated in place
         results = {}
-        delivery = copy.deepcopy(self.current)
-        self.current = defaultdict(dict)
+        delivery = self.swap()
 
         # histogram
-        if 'timer' in delivery:
-            timers = {}
-            timestamp = int(time.time())
-            for metric_name, metric_values in delivery['timer'].iteritems():
-                if len(metric_values):
-                    metric_values.sort()
-                    length = len(metric_values)
-                    timers['G|%s' % metric_name] = [[timestamp, sum(metric_values) / float(length)]]
-                    timers['C|%s.count' % metric_name] = [[timestamp, length]]
-                    timers['G|%s.max' % metric_name] = [[timestamp, metric_values[-1]]]
-                    timers['G|%s.median' % metric_name] = [[timestamp, metric_values[int(round(length / 2 - 1))]]]
-                    timers['G|%s.pctl95' % metric_name] = [[timestamp, metric_values[-int(round(length * .05))]]]
-            results['timer'] = timers
+        if 'timer' in delivery or 'timer_at' in delivery:
+            timers = defaultdict(list)
+            timestamp = clock.now
+            extra_counts = delivery.get('timer_count', {})
+            for metric_name, metric_values in delivery.get('timer', {}).iteritems():
+                self.timer_points(timers, metric_name, timestamp, metric_values, extra_counts.get(metric_name, 0))
+
+            # timers for given times have a point per timestamp
+            for metric_name, buckets in delivery.get('timer_at', {}).iteritems():
+                for stamp, (metric_values, extra_count) in buckets.iteritems():
+                    self.timer_points(timers, metric_name, stamp, metric_values, extra_count)
+
+            for points in timers.itervalues():
+                points.sort()
+            results['timer'] = dict(timers)
 
         # counters
         if 'counter' in delivery:
             counters = {}
             for k, v in delivery['counter'].iteritems():
-                # Aggregate all observed counters into a single record.
-                last_stamp = v[-1][0]  # Use the oldest timestamp.
-                total_value = 0
+                # Aggregate all observed counters into a single record per timestamp.
+                # Usually all the slots have the same timestamp, but counters for given times have many of them.
+                totals = {}
                 for timestamp, value in v:
-                    total_value += value
+                    totals[timestamp] = totals.get(timestamp, 0) + value
 
-                # Condense the list of lists 'v' into a list of a single element.  Remember that we are using lists
+                # Zero values only mean that the counter exists, so they are not needed if there are other points.
+                points = sorted(totals.iteritems())
+                if len(points) > 1:
+                    points = [point for point in points if point[1]] or points[-1:]
+
+                # Condense the list of lists 'v'.  Remember that we are using lists
                 # instead of tuples because we need mutability during self.incr().
-                counters['C|%s' % k] = [[last_stamp, total_value]]
+                counters[self.counter_keys[k]] = [[stamp, value] for stamp, value in points]
 
             results['counter'] = counters
 
@@ -200,17 +701,17 @@ class StatsdClient(object):
                     total_value += value
 
                 # Condense list of tuples 'v' into a list of a single tuple using an average value.
-                gauges['G|%s' % k] = [(last_stamp, float(total_value)/len(v))]
+                gauges[self.gauge_keys[k]] = [(last_stamp, float(total_value)/len(v))]
             results['gauge'] = gauges
 
         # avg
         if 'average' in delivery:
             averages = {}
-            timestamp = int(time.time())  # Take a new timestamp here because it is not collected previously.
+            timestamp = clock.now  # Take a new timestamp here because it is not collected previously.
             for metric_name, metric_values in delivery['average'].iteritems():
                 if len(metric_values):
                     length = len(metric_values)
-                    averages['G|%s' % metric_name] = [[timestamp, sum(metric_values) / float(length)]]
+                    averages[self.gauge_keys[metric_name]] = [[timestamp, sum(metric_values) / float(length)]]
             results['average'] = averages
 
         return {
@@ -218,3 +719,55 @@ class StatsdClient(object):
             'metrics': results,
             'agent_version': self.context.version
         }
+
+    def timer_points(self, timers, metric_name, timestamp, metric_values, extra_count=0):
+        """
+        Adds points of a timer to the flush results
+
+        Percentiles of lists are found with selection (nearest-rank), histogram buckets count values
+        not greater than their bounds, scaled up if the timer represents more values than it keeps.
+
+        :param timers: {} of metric -> [] of points
+        :param metric_name: metric name
+        :param timestamp: int timestamp of the points
+        :param metric_values: [] of metric values or DDSketch
+        :param extra_count: int number of values represented by the timer, but not kept in it
+        """
+        length = len(metric_values)
+        if not length:
+            return
+
+        average_key, count_key, max_key, percentile_keys, bucket_keys = self.timer_keys[metric_name]
+
+        if isinstance(metric_values, DDSketch):
+            average = metric_values.sum / float(length)
+            maximum = metric_values.max
+            values = [metric_values.quantile(percentile / 100.0) for percentile, _ in percentile_keys]
+            buckets = [metric_values.rank(bound) for bound, _ in bucket_keys]
+        else:
+            average = sum(metric_values) / float(length)
+            maximum = max(metric_values)
+            ranks = [nearest_rank(length, percentile) for percentile, _ in percentile_keys]
+            selected = select(metric_values, ranks)
+            values = [selected[rank] for rank in ranks]
+
+            buckets = []
+            if bucket_keys:
+                bounds = [bound for bound, _ in bucket_keys]
+                # one pass to count values by buckets, the last one is for values over all the bounds
+                counts = [0] * (len(bounds) + 1)
+                for i in map(partial(bisect_left, bounds), metric_values):
+                    counts[i] += 1
+                for count in counts[:-1]:
+                    buckets.append(count + (buckets[-1] if buckets else 0))
+
+        timers[average_key].append([timestamp, average])
+        timers[count_key].append([timestamp, length + extra_count])
+        timers[max_key].append([timestamp, maximum])
+
+        for (_, key), value in zip(percentile_keys, values):
+            timers[key].append([timestamp, value])
+
+        scale = (length + extra_count) / float(length)
+        for (_, key), count in zip(bucket_keys, buckets):
+            timers[key].append([timestamp, int(round(count * scale))])
@@ -12,6 +12,7 @@ from amplify.agent.bridge import Bridge
 from amplify.agent.util.threads import spawn
 from amplify.agent.errors import AmplifyCriticalException
 from amplify.agent.cloud import CloudResponse
+from amplify.agent.containers.statsd import StatsdListenerContainer
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -29,6 +30,7 @@ class Supervisor(object):
     """
 
     CONTAINER_CLASS = '%sContainer'
+    CONTAINER_CLASSES = {'statsd': 'StatsdListenerContainer'}  # names not following CONTAINER_CLASS
     CONTAINER_MODULE = 'amplify.agent.containers.%s.%s'
 
     def __init__(self, foreground=False):
@@ -57,10 +59,16 @@ class Supervisor(object):
         Tries to load and create all objects containers specified in config
         """
         containers_from_local_config = context.app_config['containers']
+        container_names = containers_from_local_config.keys()
 
-        for container_name in containers_from_local_config.keys():
+        # optional containers are enabled in the local config only
+        if StatsdListenerContainer.enabled() and StatsdListenerContainer.type not in container_names:
+            container_names.append(StatsdListenerContainer.type)
+
+        for container_name in container_names:
             try:
-                container_classname = self.CONTAINER_CLASS % container_name.title()
+                container_classname = self.CONTAINER_CLASSES.get(container_name) or \
+                    self.CONTAINER_CLASS % container_name.title()
                 container_class = loader.import_class(self.CONTAINER_MODULE % (container_name, container_classname))
 
                 # copy object configs
@@ -116,6 +124,7 @@ class Supervisor(object):
                     pass
 
                 self.check_bridge()
+                context.tail_offsets.save(force=False)
             except OSError as e:
                 if e.errno == 12:  # OSError errno 12 is a memory error (unable to allocate, out of memory, etc.)
                     context.log.error('OSError: [Errno %s] %s' % (e.errno, e.message), exc_info=True)
@@ -132,6 +141,11 @@ class Supervisor(object):
         for container in self.containers.itervalues():
             container.stop_objects()
 
+        context.tail_offsets.save()
+
+        if context.worker_pool is not None:
+            context.worker_pool.stop()
+
     def talk_to_cloud(self, top_object=None):
         """
         Asks cloud for config, object configs, filters, etc
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import time
+
+from gevent.local import local
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class CoarseClock(local):
+    """
+    Current time in whole seconds, refreshed explicitly
+
+    Metrics are stamped with whole seconds, so there is no need to ask the system for the time on every sample.
+    Collectors tick the clock once per collect cycle and all the samples of the cycle share its stamp.
+
+    The time is kept per greenlet: every collector runs in its own one, so a collector sees only its own ticks
+    and other collectors can't move the stamp in the middle of its cycle.
+    """
+
+    def __init__(self):
+        self.now = int(time.time())
+
+    def tick(self, now=None):
+        """
+        :param now: float current time if it is already known
+        :return: int current time in seconds
+        """
+        self.now = int(time.time() if now is None else now)
+        return self.now
+
+
+clock = CoarseClock()
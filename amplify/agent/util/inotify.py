@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+
+from gevent.select import select
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+FILE_EVENTS = IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF
+DIR_EVENTS = IN_CREATE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+libc = _load_libc()
+
+
+class PollingFileWatcher(object):
+    """
+    Fallback watcher for systems without inotify - just sleeps for the whole timeout
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def wait(self, timeout):
+        """
+        Waits for changes of the file
+
+        :param timeout: float max seconds to wait
+        :return: bool - always False, changes are not known and the whole timeout has passed
+        """
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyFileWatcher(object):
+    """
+    Wakes up on changes of a file with Linux inotify
+
+    Watches the file itself for IN_MODIFY/IN_MOVE_SELF and its directory for IN_CREATE,
+    so a new file appeared after rotation is watched too.
+    """
+    def __init__(self, filename):
+        self.fd = None
+        self.filename = filename
+        self.basename = os.path.basename(filename)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.dir_wd = self._add_watch(os.path.dirname(os.path.abspath(filename)), DIR_EVENTS)
+        self.file_wd = self._add_watch(filename, FILE_EVENTS)
+
+    def __del__(self):
+        self.close()
+
+    def _add_watch(self, path, mask):
+        wd = libc.inotify_add_watch(self.fd, path, mask)
+        return wd if wd >= 0 else None
+
+    def wait(self, timeout):
+        """
+        Waits for changes of the file
+
+        :param timeout: float max seconds to wait
+        :return: bool - True if the file was changed, moved or recreated
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            readable, _, _ = select([self.fd], [], [], remaining)
+            if readable and self._read_events():
+                return True
+
+    def _read_events(self):
+        """
+        Reads all pending events and rearms the file watch if the file was recreated
+
+        :return: bool - True if some of the events are related to the watched file
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+        changed = False
+        position = 0
+        while position + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+            name = data[position + EVENT_HEADER.size:position + EVENT_HEADER.size + length].rstrip('\0')
+            position += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changed = True
+            elif wd == self.dir_wd:
+                if name == self.basename:
+                    self.file_wd = self._add_watch(self.filename, FILE_EVENTS)
+                    changed = True
+            elif mask & (FILE_EVENTS | IN_IGNORED):
+                if wd == self.file_wd and mask & IN_IGNORED:
+                    self.file_wd = None
+                changed = True
+
+        # file could be missing at the moment of rotation
+        if self.file_wd is None and os.path.exists(self.filename):
+            self.file_wd = self._add_watch(self.filename, FILE_EVENTS)
+
+        return changed
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+
+
+def file_watcher(filename):
+    """
+    Returns the best available file watcher
+
+    :param filename: str path to a file
+    :return: InotifyFileWatcher or PollingFileWatcher
+    """
+    if libc is not None:
+        try:
+            return InotifyFileWatcher(filename)
+        except OSError:
+            from amplify.agent.context import context
+            context.log.debug('failed to start inotify watcher for %s, falling back to polling' % filename,
+                              exc_info=True)
+    return PollingFileWatcher(filename)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# lists up to this size are just sorted, the C sort is faster than partitioning in Python for them
+SORT_THRESHOLD = 10000
+
+# values sampled to choose a pivot
+PIVOT_SAMPLE = 99
+
+
+def nearest_rank(length, percentile):
+    """
+    Returns the index of a percentile in sorted values (nearest-rank method)
+
+    :param length: int number of values
+    :param percentile: float percentile from 0 to 100
+    :return: int index
+    """
+    position = round(percentile * length / 100.0, 9)  # 99.9% of 1000 is 999, not 999.0000000000001
+    return min(max(int(math.ceil(position)) - 1, 0), length - 1)
+
+
+def select(values, ranks, rnd=random):
+    """
+    Finds values of the given ranks as if the values were sorted, without sorting all of them
+
+    Quickselect for many ranks at once: values are partitioned around a pivot estimated from a sample to be
+    close to the ranks, and only the parts containing ranks are partitioned further.
+
+    :param values: [] of values, not modified
+    :param ranks: iterable of int indices
+    :param rnd: random.Random for pivot samples
+    :return: {} of rank -> value
+    """
+    result = {}
+    parts = [(values, 0, sorted(set(ranks)))]
+    while parts:
+        part, offset, part_ranks = parts.pop()
+        length = len(part)
+
+        if length <= SORT_THRESHOLD:
+            part = sorted(part)
+            for rank in part_ranks:
+                result[rank] = part[rank - offset]
+            continue
+
+        target = part_ranks[len(part_ranks) // 2] - offset
+        sample = sorted(rnd.sample(part, min(PIVOT_SAMPLE, length)))
+        pivot = sample[min(target * len(sample) // length, len(sample) - 1)]
+
+        lower = [value for value in part if value < pivot]
+        upper = [value for value in part if value > pivot]
+        equal_start = offset + len(lower)
+        equal_end = offset + length - len(upper)
+
+        lower_ranks, upper_ranks = [], []
+        for rank in part_ranks:
+            if rank < equal_start:
+                lower_ranks.append(rank)
+            elif rank >= equal_end:
+                upper_ranks.append(rank)
+            else:
+                result[rank] = pivot
+
+        if lower_ranks:
+            parts.append((lower, offset, lower_ranks))
+        if upper_ranks:
+            parts.append((upper, equal_end, upper_ranks))
+
+    return result
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class AdaptiveSampler(object):
+    """
+    Chooses a 1-in-N sampling rate for a log which is written faster than it can be processed
+
+    The rate is doubled while the time spent on the previous collect cycle is over the limit, and halved back
+    when it is under the half of the limit. Sampling makes cycles cheaper, so the time goes down with the rate
+    and goes up again when the rate is lowered - it settles on the lowest rate the agent can keep up with.
+    The lag of the log is not used: every cycle reads the log to the end anyway, so the lag before a cycle
+    shows how much is written per interval and does not go down with sampling.
+    """
+
+    def __init__(self, max_time, max_rate=64):
+        """
+        :param max_time: float max seconds of a collect cycle
+        :param max_rate: int max N
+        """
+        self.max_time = max_time
+        self.max_rate = max_rate
+        self.rate = 1
+
+    def update(self, duration):
+        """
+        :param duration: float seconds spent on the previous collect cycle
+        :return: int new rate
+        """
+        if duration > self.max_time:
+            self.rate = min(self.rate * 2, self.max_rate)
+        elif duration < self.max_time / 2.0:
+            self.rate = max(self.rate // 2, 1)
+        return self.rate
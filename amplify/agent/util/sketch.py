@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import math
+
+from heapq import heapify, heappop, heappush
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitters sketch (Metwally et al.)
+
+    Keeps at most `capacity` keys whatever the number of distinct keys is. When a new key comes and the sketch
+    is full, the key with the smallest count is replaced and the new one inherits its count, so counts are
+    upper bounds and every key with a real count above total / capacity is guaranteed to be kept.
+
+    Besides the count, every key has a number of errors and a sum of times seen since it was taken in.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}  # key -> [count, overestimation, errors, time]
+        self.heap = []  # (count, key), entries with outdated counts are skipped
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, count=1, errors=0, time=0.0):
+        """
+        :param key: str key
+        :param count: int number of occurrences
+        :param errors: int number of errors among them
+        :param time: float sum of their times
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                entry = [0, 0, 0, 0.0]
+            else:
+                min_count, min_key = self._pop_min()
+                del self.entries[min_key]
+                entry = [min_count, min_count, 0, 0.0]
+            self.entries[key] = entry
+
+        entry[0] += count
+        entry[2] += errors
+        entry[3] += time
+
+        heappush(self.heap, (entry[0], key))
+        if len(self.heap) > 4 * self.capacity:
+            self._compact()
+
+    def _pop_min(self):
+        while True:
+            count, key = heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == count:
+                return count, key
+
+    def _compact(self):
+        self.heap = [(entry[0], key) for key, entry in self.entries.iteritems()]
+        heapify(self.heap)
+
+    def merge(self, sketch, weight=1):
+        """
+        Adds all keys of another SpaceSaving sketch
+
+        :param sketch: SpaceSaving
+        :param weight: int multiplier for the values of the other sketch
+        """
+        for key, (count, _, errors, time) in sketch.entries.iteritems():
+            self.add(key, count * weight, errors * weight, time * weight)
+
+    def top(self, k):
+        """
+        Returns k keys with the largest counts
+
+        :param k: int number of keys
+        :return: [] of (key, count, errors, time) sorted by count
+        """
+        ranked = sorted(self.entries.iteritems(), key=lambda item: (-item[1][0], item[0]))[:k]
+        return [(key, count, errors, time) for key, (count, _, errors, time) in ranked]
+
+    def reset(self):
+        self.entries = {}
+        self.heap = []
+
+
+class DDSketch(object):
+    """
+    DDSketch quantile sketch (Masson et al.)
+
+    Positive values are counted in logarithmic bins: a value v goes to the bin ceil(log(v, gamma)),
+    gamma = (1 + accuracy) / (1 - accuracy), so any quantile is returned with the relative error within accuracy.
+    Values too close to zero are counted separately, negative values are not expected (timers) and go there too.
+
+    Memory is bounded by max_bins: when there are more bins, the lowest ones are collapsed into one,
+    so only the lowest quantiles lose accuracy. The sum, the min and the max are exact.
+    Sketches with the same accuracy are merged without any loss.
+    """
+
+    min_value = 1e-9
+
+    def __init__(self, accuracy=0.01, max_bins=2048):
+        """
+        :param accuracy: float relative accuracy of quantiles
+        :param max_bins: int max number of bins
+        """
+        self.accuracy = accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}  # index -> count
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, count=1):
+        """
+        :param value: float value
+        :param count: int number of occurrences
+        """
+        if value > self.min_value:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            bins = self.bins
+            bins[index] = bins.get(index, 0) + count
+            if len(bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += count
+
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update(self, values):
+        """
+        Adds a number of values
+
+        :param values: iterable of float values
+        """
+        for value in values:
+            self.add(value)
+
+    def _collapse(self):
+        indices = sorted(self.bins)
+        extra = len(indices) - self.max_bins
+        lowest = indices[extra]
+        for index in indices[:extra]:
+            self.bins[lowest] += self.bins.pop(index)
+
+    def merge(self, sketch):
+        """
+        Adds all values of another DDSketch with the same accuracy
+
+        :param sketch: DDSketch
+        """
+        if sketch.gamma != self.gamma:
+            raise ValueError('can not merge sketches of different accuracy')
+        if not sketch.count:
+            return
+
+        for index, count in sketch.bins.iteritems():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+        self.zero_count += sketch.zero_count
+        self.count += sketch.count
+        self.sum += sketch.sum
+        self.min = sketch.min if self.min is None else min(self.min, sketch.min)
+        self.max = sketch.max if self.max is None else max(self.max, sketch.max)
+
+    def rank(self, value):
+        """
+        Returns the number of values not greater than the value, within the accuracy
+
+        :param value: float value
+        :return: int number of values
+        """
+        if value < self.min_value:
+            return self.zero_count if value >= 0 else 0
+
+        limit = math.ceil(math.log(value) / self.log_gamma)
+        return self.zero_count + sum(count for index, count in self.bins.iteritems() if index <= limit)
+
+    def quantile(self, q):
+        """
+        :param q: float quantile from 0 to 1
+        :return: float value or None if the sketch is empty
+        """
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0.0)
+
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-from os import stat
+import os
+import time
+import ujson
+
+from collections import deque
+from os import fstat, stat
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -9,10 +14,100 @@ __maintainer__ = "Mike Belov"
 __email__ = "dedm@nginx.com"
 
 
+class TailOffsets(object):
+    """
+    Checkpoint store for FileTail offsets
+
+    Offsets are keyed by file path and are valid only for the same (inode, device) pair.
+    The store is saved to disk periodically and on agent stop, so a restarted agent (or a recreated
+    collector) continues reading logs from the place where the previous one stopped.
+    """
+
+    def __init__(self, filename=None, max_catchup=None, save_interval=None):
+        self.filename = filename
+        self.max_catchup = max_catchup
+        self.save_interval = save_interval
+        self.offsets = {}
+        self.last_save = time.time()
+
+    def load(self):
+        """
+        Loads saved offsets from disk
+        """
+        if not self.filename or not os.path.exists(self.filename):
+            return
+
+        from amplify.agent.context import context
+        try:
+            with open(self.filename, 'r') as f:
+                for path, (inode, device, offset) in ujson.loads(f.read()).iteritems():
+                    self.offsets[path] = (inode, device, offset)
+        except:
+            context.log.error('failed to load tail offsets from %s' % self.filename)
+            context.log.debug('additional info:', exc_info=True)
+
+    def save(self, force=True):
+        """
+        Atomically writes offsets to disk
+
+        :param force: bool - if False then save only if save_interval has passed since the last save
+        """
+        now = time.time()
+        if not self.filename or (not force and self.save_interval and now < self.last_save + self.save_interval):
+            return
+
+        from amplify.agent.context import context
+        tmp_filename = '%s.tmp' % self.filename
+        try:
+            with open(tmp_filename, 'w') as f:
+                f.write(ujson.dumps(self.offsets))
+            os.rename(tmp_filename, self.filename)
+        except:
+            context.log.error('failed to save tail offsets to %s' % self.filename)
+            context.log.debug('additional info:', exc_info=True)
+        self.last_save = now
+
+    def update(self, path, inode, device, offset):
+        self.offsets[path] = (inode, device, offset)
+
+    def restore(self, path, inode, device, size):
+        """
+        Returns an offset to continue reading from or None if there is no checkpoint for the file
+
+        :param path: str file path
+        :param inode: int file inode
+        :param device: int file device
+        :param size: int current file size
+        :return: int or None
+        """
+        if path not in self.offsets:
+            return None
+
+        saved_inode, saved_device, offset = self.offsets[path]
+        if (saved_inode, saved_device) != (inode, device) or offset > size:
+            # file was rotated or truncated since the checkpoint - all its content is new
+            offset = 0
+
+        if self.max_catchup is not None:
+            offset = max(offset, size - self.max_catchup)
+
+        return offset
+
+
 class FileTail(object):
     """
     Creates an iterable object that returns only unread lines.
 
+    There are two reading modes:
+    - line mode (default) reads the file with readline()
+    - bulk mode reads the file in large binary chunks and splits them into lines in memory.
+      An incomplete trailing line is kept until its end is written.
+
+    Rotation is checked only when the end of the current file is reached:
+    - if the path points to a new inode, the old file has been read till its end, so the new one is opened
+    - if the file is smaller than the current offset (copytruncate), it is read from the beginning
+    - if the file is missing, the old one is kept open and the path is checked again with a backoff
+
     Based on some code of Pygtail
     pygtail - a python "port" of logtail2
     Copyright (C) 2011 Brad Greenlee <brad@footle.org>
@@ -20,21 +115,45 @@ class FileTail(object):
     https://raw.githubusercontent.com/bgreenlee/pygtail/master/pygtail/core.py
     """
 
-    def __init__(self, filename):
+    chunk_size = 256 * 1024
+    missing_backoff = 1.0
+    max_missing_backoff = 60.0
+
+    def __init__(self, filename, bulk=False, chunk_size=None, offsets=None):
         self.filename = filename
+        self.bulk = bulk
+        self.offsets = offsets
         self._fh = None
 
-        # open a file and seek to the end
-        with open(self.filename, "r") as f:
-            f.seek(0, 2)
-            self._offset = f.tell()
+        if chunk_size:
+            self.chunk_size = chunk_size
 
-        # save inode to determine rotations
-        self._inode = stat(self.filename).st_ino
+        # bulk mode buffers
+        self._lines = deque()
+        self._partial = ''
+
+        # missing file backoff
+        self._missing_delay = 0
+        self._next_check = 0
+
+        # open a file and seek to the end (or to the saved checkpoint if there is one)
+        self._open()
+        self._fh.seek(0, 2)
+        self._offset = self._fh.tell()
+
+        if self.offsets is not None:
+            offset = self.offsets.restore(self.filename, self._inode, self._device, self._offset)
+            if offset is not None and offset < self._offset:
+                self._fh.seek(offset - 1 if offset else 0)
+
+                # offset limited by max catchup can point to the middle of a line
+                if offset and self._fh.read(1) != '\n':
+                    self._fh.readline()
+                self._offset = self._fh.tell()
 
     def __del__(self):
-        if self._filehandle():
-            self._filehandle().close()
+        if not self._is_closed():
+            self._fh.close()
 
     def __iter__(self):
         return self
@@ -44,29 +163,16 @@ class FileTail(object):
         Return the next line in the file, updating the offset.
         """
         try:
-            line = self._get_next_line()
+            if self.bulk:
+                line = self._get_next_bulk_line()
+            else:
+                line = self._get_next_line()
         except StopIteration:
             # we've reached the end of the file;
             self._update_offset()
             raise
         return line
 
-    def _file_was_rotated(self):
-        """
-        Checks that file was rotated
-        :return: bool
-        """
-        # wait for new file
-        new_inode = self._inode
-        while True:
-            try:
-                new_inode = stat(self.filename).st_ino
-            except:
-                pass
-            else:
-                break
-        return new_inode != self._inode
-
     def __next__(self):
         """`__next__` is the Python 3 version of `next`"""
         return self.next()
@@ -82,30 +188,92 @@ class FileTail(object):
             return True
         return self._fh.closed
 
-    def _filehandle(self):
+    def _open(self):
         """
-        Return a filehandle to the file being tailed, with the position set
-        to the current offset.
+        Opens the file by its path and remembers inode and device to determine rotations
         """
-        file_was_rotated = self._file_was_rotated()
+        self._fh = open(self.filename, "rb" if self.bulk else "r")
+        file_stat = fstat(self._fh.fileno())
+        self._inode = file_stat.st_ino
+        self._device = file_stat.st_dev
 
-        if not self._fh or self._is_closed() or file_was_rotated:
-            if not self._is_closed():
-                self._fh.close()
+    def _check_rotation(self):
+        """
+        Is called at the end of the current file and switches to the new one if the file was rotated
 
-            if file_was_rotated:
-                self._inode = stat(self.filename).st_ino
-                self._offset = 0
+        :return: bool - True if there can be something new to read from the current filehandle
+        """
+        now = time.time()
+        if now < self._next_check:
+            return False
+
+        try:
+            file_stat = stat(self.filename)
+        except OSError:
+            # file was moved away and a new one is not created yet, the old one still can be written
+            self._missing_delay = min(self._missing_delay * 2 or self.missing_backoff, self.max_missing_backoff)
+            self._next_check = now + self._missing_delay
+            return False
 
-            self._fh = open(self.filename, "r")
-            self._fh.seek(self._offset)
-        return self._fh
+        self._missing_delay = 0
+        self._next_check = 0
+
+        if (file_stat.st_ino, file_stat.st_dev) != (self._inode, self._device):
+            # the old file was read till the end, so its incomplete line will never be finished
+            if self._partial:
+                self._lines.append(self._partial.rstrip())
+                self._partial = ''
+
+            old_fh = self._fh
+            try:
+                self._open()
+            except IOError:
+                self._fh = old_fh
+                return False
+            old_fh.close()
+            return True
+
+        if file_stat.st_size < self._fh.tell():
+            # file was truncated
+            self._fh.seek(0)
+            self._partial = ''
+            return True
+
+        return False
 
     def _update_offset(self):
-        self._offset = self._filehandle().tell()
+        # the incomplete trailing line is not consumed yet
+        self._offset = self._fh.tell() - len(self._partial)
+
+        if self.offsets is not None:
+            self.offsets.update(self.filename, self._inode, self._device, self._offset)
 
     def _get_next_line(self):
-        line = self._filehandle().readline()
+        line = self._fh.readline()
+        if not line and self._check_rotation():
+            line = self._fh.readline()
         if not line:
             raise StopIteration
         return line.rstrip()
+
+    def _get_next_bulk_line(self):
+        if not self._lines:
+            self._read_chunk()
+            if not self._lines:
+                raise StopIteration
+        return self._lines.popleft()
+
+    def _read_chunk(self):
+        """
+        Reads chunks from the file until there is at least one complete line or the end of file is reached.
+        """
+        while not self._lines:
+            chunk = self._fh.read(self.chunk_size)
+            if not chunk:
+                if self._check_rotation():
+                    continue
+                break
+
+            lines = (self._partial + chunk).split('\n')
+            self._partial = lines.pop()
+            self._lines.extend(line.rstrip() for line in lines)
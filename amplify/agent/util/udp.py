@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+MSG_TRUNC = 0x20
+MSG_DONTWAIT = 0x40
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+libc = _load_libc()
+
+
+class UDPReceiver(object):
+    """
+    Reads all the datagrams waiting in a non-blocking UDP socket
+
+    Datagrams are read until the socket is drained or max_batch of them are read. Reading goes by the loop
+    of recv() calls, subclasses read many datagrams per call.
+    """
+
+    def __init__(self, sock, max_batch=256, max_size=8192):
+        """
+        :param sock: socket.socket bound UDP socket
+        :param max_batch: int max datagrams read at once
+        :param max_size: int max datagram size, longer ones are truncated
+        """
+        self.sock = sock
+        self.max_batch = max_batch
+        self.max_size = max_size
+        self.truncated = 0  # datagrams longer than max_size
+        self.sock.setblocking(0)
+
+    def receive(self):
+        """
+        :return: [] of str datagrams, empty if there is nothing to read
+        """
+        datagrams = []
+        while len(datagrams) < self.max_batch:
+            try:
+                datagram = self.sock.recv(self.max_size + 1)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+
+            if len(datagram) > self.max_size:
+                datagram = datagram[:self.max_size]
+                self.truncated += 1
+            datagrams.append(datagram)
+        return datagrams
+
+
+class RecvmmsgReceiver(UDPReceiver):
+    """
+    UDPReceiver reading up to max_batch datagrams with one recvmmsg(2) call (Linux)
+
+    Buffers and message headers are allocated once and reused by all the calls.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecvmmsgReceiver, self).__init__(*args, **kwargs)
+        self.buffer = ctypes.create_string_buffer(self.max_batch * self.max_size)
+        self.address = ctypes.addressof(self.buffer)
+        self.iovecs = (iovec * self.max_batch)()
+        self.messages = (mmsghdr * self.max_batch)()
+
+        for i in xrange(self.max_batch):
+            self.iovecs[i].iov_base = self.address + i * self.max_size
+            self.iovecs[i].iov_len = self.max_size
+            self.messages[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.messages[i].msg_hdr.msg_iovlen = 1
+
+    def receive(self):
+        count = libc.recvmmsg(self.sock.fileno(), self.messages, self.max_batch, MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, os.strerror(error))
+
+        datagrams = []
+        for i in xrange(count):
+            message = self.messages[i]
+            if message.msg_hdr.msg_flags & MSG_TRUNC:
+                self.truncated += 1
+            length = min(message.msg_len, self.max_size)
+            datagrams.append(ctypes.string_at(self.address + i * self.max_size, length))
+        return datagrams
+
+
+def udp_receiver(sock, max_batch=256, max_size=8192):
+    """
+    Returns the best available receiver for a socket
+
+    :param sock: socket.socket bound UDP socket
+    :param max_batch: int max datagrams read at once
+    :param max_size: int max datagram size
+    :return: RecvmmsgReceiver or UDPReceiver
+    """
+    receiver_class = RecvmmsgReceiver if libc is not None else UDPReceiver
+    return receiver_class(sock, max_batch=max_batch, max_size=max_size)
+
+
+def kernel_drops(sock):
+    """
+    Returns the number of datagrams dropped by the kernel for the socket (receive buffer overflows)
+
+    The number is taken from the last column of /proc/net/udp (udp6) for the socket's inode.
+
+    :param sock: socket.socket UDP socket
+    :return: int drops or None if it is unknown
+    """
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for filename in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(filename, 'r') as f:
+                f.readline()  # header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[-1])
+        except (IOError, ValueError):
+            continue
+    return None
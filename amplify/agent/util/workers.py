@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import signal
+import traceback
+
+from gevent.queue import Queue
+from gevent.select import select
+
+from amplify.agent.errors import AmplifyWorkerError
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+def worker_loop(conn):
+    """
+    Main loop of a worker process: receives (function, args), sends back (True, result) or (False, traceback)
+
+    :param conn: multiprocessing.Connection
+    """
+    # the agent signal handlers are not for workers, they are stopped with the agent
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            function, args = conn.recv()
+        except (EOFError, IOError):
+            return  # the agent is gone
+
+        try:
+            result = (True, function(*args))
+        except Exception:
+            result = (False, traceback.format_exc())
+        conn.send(result)
+
+
+class Worker(object):
+    """
+    Worker process with a pipe to it
+    """
+    check_interval = 1.0
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop, args=(child_conn,), name='amplify-worker')
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def call(self, function, *args):
+        """
+        Calls a function in the worker process and waits for its result without blocking other greenlets
+
+        :param function: module level function
+        :param args: picklable arguments
+        :return: function result
+        """
+        try:
+            self.conn.send((function, args))
+            while not select([self.conn.fileno()], [], [], self.check_interval)[0]:
+                if not self.process.is_alive():
+                    raise AmplifyWorkerError(message='worker %s exited' % self.process.pid)
+            success, result = self.conn.recv()
+        except (EOFError, IOError, OSError) as e:
+            raise AmplifyWorkerError(message='worker %s failed due to %s' % (self.process.pid, e.__class__.__name__))
+
+        if not success:
+            raise AmplifyWorkerError(message='%s failed in worker %s' % (function.__name__, self.process.pid),
+                                     payload={'traceback': result})
+        return result
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(self.check_interval)
+
+
+class WorkerPool(object):
+    """
+    Pool of worker processes for CPU heavy work, like parsing of busy logs
+
+    Functions and their arguments are pickled, so functions should be defined on a module level.
+    Every worker runs one function at a time, the calling greenlet waits for a free worker.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.workers = [Worker() for _ in xrange(size)]
+        self.idle = Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def call(self, function, *args):
+        """
+        Calls a function in a free worker
+
+        :param function: module level function
+        :param args: picklable arguments
+        :return: function result
+        """
+        worker = self.idle.get()
+        try:
+            return worker.call(function, *args)
+        finally:
+            if not worker.alive():
+                # replace the dead worker
+                worker.stop()
+                self.workers.remove(worker)
+                worker = Worker()
+                self.workers.append(worker)
+            self.idle.put(worker)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
@@ -128,3 +128,23 @@ class LogsFiltersTestCase(NginxCollectorTestCase):
 
         # filter values
         assert_that(counter['C|nginx.http.request.body_bytes_sent||2'][0][1], equal_to(2))
+
+    def test_filter_by_not_counted_field(self):
+        self.fake_object.filters = [
+            Filter(**dict(
+                filter_rule_id=3,
+                metric='nginx.http.status.2xx',
+                data=[
+                    {'$http_user_agent': 'python-requests*'}
+                ]
+            ))
+        ]
+
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=self.lines)
+        assert_that(collector.parser.fields, has_item('http_user_agent'))
+        assert_that(collector.parser.fields, is_not(has_item('http_referer')))
+
+        collector.collect()
+
+        counter = self.fake_object.statsd.flush()['metrics']['counter']
+        assert_that(counter['C|nginx.http.status.2xx||3'][0][1], equal_to(1))
@@ -5,6 +5,7 @@ from hamcrest import *
 
 from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
 from amplify.agent.nginx.log.access import NginxAccessLogParser
+from amplify.agent.statsd import StatsdBuffer
 from test.base import NginxCollectorTestCase
 
 __author__ = "Mike Belov"
@@ -120,6 +121,36 @@ class LogsPerMethodTestCase(NginxCollectorTestCase):
         histogram = metrics['timer']
         assert_that(histogram, equal_to({}))
 
+    def test_json_empty_upstreams(self):
+        log_format = \
+            '{"request": "$request", "status": "$status", "upstream_status": "$upstream_status", ' + \
+            '"upstream_response_time": "$upstream_response_time", "upstream_cache_status": "$upstream_cache_status"}'
+
+        lines = [
+            '{"request": "GET /a HTTP/1.1", "status": "200", "upstream_status": "", ' +
+            '"upstream_response_time": "", "upstream_cache_status": ""}',
+            '{"request": "GET /b HTTP/1.1", "status": "200", "upstream_status": "", ' +
+            '"upstream_response_time": "0.002", "upstream_cache_status": ""}',
+        ]
+
+        # run single method
+        parser = NginxAccessLogParser(log_format, escape='json')
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=[])
+        for line in lines:
+            collector.upstreams(parser.parse(line))
+
+        # the request without upstream info is skipped, empty statuses are not counted
+        counters = self.fake_object.statsd.current['counter']
+        assert_that(sorted(counters), equal_to(['nginx.upstream.next.count', 'nginx.upstream.request.count']))
+        assert_that(counters['nginx.upstream.request.count'][0][1], equal_to(1))
+
+        # the same for batches
+        statsd = StatsdBuffer()
+        batch = parser.parse_batch(lines)
+        NginxAccessLogsCollector.count_batch_upstreams(batch, [True] * len(batch), statsd)
+        assert_that(statsd.counters, equal_to({'nginx.upstream.next.count': 0, 'nginx.upstream.request.count': 1}))
+        assert_that(statsd.timer_values, equal_to({'nginx.upstream.response.time': [0.002]}))
+
     def test_part_empty_upstreams(self):
         log_format = '$remote_addr - $remote_user [$time_local] ' + \
                      '"$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" ' + \
@@ -258,3 +289,38 @@ class LogsPerMethodTestCase(NginxCollectorTestCase):
         assert_that(histogram, has_item('nginx.upstream.response.time'))
         assert_that(histogram['nginx.upstream.response.time'], equal_to([2.001 + 0.345]))
 
+
+    def test_line_plan(self):
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=[])
+        assert_that(
+            [method.__name__ for method in collector.line_plan],
+            equal_to(['http_method', 'http_status', 'http_version', 'body_bytes_sent'])
+        )
+
+        log_format = '$remote_addr "$request" $status rt=$request_time us=$upstream_status ua=$upstream_addr'
+        collector = NginxAccessLogsCollector(object=self.fake_object, log_format=log_format, tail=[])
+        assert_that(
+            [method.__name__ for method in collector.line_plan],
+            equal_to(['http_method', 'http_status', 'http_version', 'request_time', 'upstreams'])
+        )
+        assert_that(collector.upstream_keys, has_item('upstream_addr'))
+
+    def test_prebuilt_metric_names(self):
+        for method in ('GET', 'get', 'PROPFIND'):
+            method_name = method.lower() if method.lower() in NginxAccessLogsCollector.valid_http_methods else 'other'
+            assert_that(
+                NginxAccessLogsCollector.method_metric(method), equal_to('nginx.http.method.%s' % method_name)
+            )
+
+        for status in ('101', '200', '404', '444', '499', '503'):
+            assert_that(
+                NginxAccessLogsCollector.status_metrics[status],
+                equal_to('nginx.http.status.%s' % NginxAccessLogsCollector.status_suffix(status))
+            )
+
+        for proto in ('HTTP/1.1', 'HTTP/2.0', 'HTTP/3', 'SPDY'):
+            suffix = NginxAccessLogsCollector.version_suffix(proto)
+            assert_that(
+                NginxAccessLogsCollector.version_metric(proto),
+                equal_to(None if suffix is None else 'nginx.http.v%s' % suffix)
+            )
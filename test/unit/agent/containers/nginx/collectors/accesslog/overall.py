@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import time
+
 from hamcrest import *
 
 from test.base import NginxCollectorTestCase
 from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
+from amplify.agent.util.sampling import AdaptiveSampler
+from amplify.agent.util.workers import WorkerPool
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -260,3 +264,282 @@ class LogsOverallTestCase(NginxCollectorTestCase):
             else:
                 if counter_key not in collector.parser.request_variables:
                     assert_that(counter, not_(has_key('C|%s' % counter_name)))
+
+    def test_batches_equal_lines(self):
+        """
+        Checks that columnar counting of batches gives the same metrics as counting lines one by one
+        """
+        log_format = '$remote_addr - $remote_user [$time_local] ' + \
+                     '"$request" $status $body_bytes_sent "$http_referer" "$http_user_agent" ' + \
+                     'rt=$request_time ua="$upstream_addr" us="$upstream_status" ut="$upstream_response_time" ' + \
+                     'uct="$upstream_connect_time" ul=$upstream_response_length cs=$upstream_cache_status gz=$gzip_ratio'
+
+        line = '1.2.3.4 - - [22/Jan/2010:19:34:21 +0300] "GET /foo/ HTTP/1.1" 200 11078 ' + \
+               '"http://www.rambler.ru/" "Mozilla/5.0 (Windows; U; Windows NT 5.1" rt=0.010 ua="10.0.0.1:80" ' + \
+               'us="200" ut="2.001, 0.345" uct="0.001, 0.002" ul=100 cs=MISS gz=2.50'
+
+        lines = [
+            line,
+            line.replace('"GET /foo/ HTTP/1.1"', '"POST /bar/ HTTP/2.0"').replace('us="200"', 'us="502"'),
+            line.replace('"GET /foo/ HTTP/1.1"', '"PATCH / HTTP/1.0"').replace(' 200 ', ' 499 '),
+            line.replace('"GET /foo/ HTTP/1.1"', '"garbage"'),
+            line.replace('ua="10.0.0.1:80"', 'ua="-"').replace('ut="2.001, 0.345"', 'ut="-"'),
+            line.replace('cs=MISS', 'cs=-').replace('uct="0.001, 0.002"', 'uct="0.5"').replace('gz=2.50', 'gz=-'),
+            line.replace('rt=0.010', 'rt=abc'),
+            'not a line',
+        ]
+
+        def values(metrics):
+            return dict(
+                (metric_type, dict((name, [point[1] for point in points]) for name, points in by_name.iteritems()))
+                for metric_type, by_name in metrics.iteritems()
+            )
+
+        for log_format, lines in (
+            (log_format, lines),
+            (log_format.replace(' ul=$upstream_response_length', ''), [l.replace(' ul=100', '') for l in lines]),
+            (None, [l[:l.index(' rt=')] for l in lines if ' rt=' in l]),
+        ):
+            collector = NginxAccessLogsCollector(object=self.fake_object, log_format=log_format, tail=[])
+            collector.batch_size = 3
+
+            collector.init_counters()
+            collector.collect_lines(lines)
+            expected = values(self.fake_object.statsd.flush()['metrics'])
+
+            collector.init_counters()
+            collector.collect_batches(lines)
+            assert_that(values(self.fake_object.statsd.flush()['metrics']), equal_to(expected))
+
+            # the same through the cycle buffer of collect()
+            collector.tail = lines
+            collector.collect()
+            assert_that(collector.statsd, is_(self.fake_object.statsd))
+            assert_that(values(self.fake_object.statsd.flush()['metrics']), equal_to(expected))
+
+            # the same with partial results of worker processes
+            collector.workers = WorkerPool(2)
+            try:
+                collector.init_counters()
+                collector.collect_in_workers(lines)
+            finally:
+                collector.workers.stop()
+            assert_that(values(self.fake_object.statsd.flush()['metrics']), equal_to(expected))
+
+    def test_top_uris(self):
+        log_format = '"$request" $status rt=$request_time'
+        lines = [
+            '"GET /a?x=1 HTTP/1.1" 200 rt=0.5',
+            '"GET /a?x=2 HTTP/1.1" 502 rt=1.5',
+            '"POST /b HTTP/1.1" 500 rt=0.25',
+            '"GET /a HTTP/1.1" 200 rt=-',
+            '"GET /c HTTP/1.1" 200 rt=0.125',
+            '"garbage" 200 rt=0.5',
+        ]
+        expected = {
+            'C|nginx.http.uri.count||/a': 3,
+            'C|nginx.http.uri.status.5xx||/a': 1,
+            'C|nginx.http.uri.time||/a': 2.0,
+            'C|nginx.http.uri.count||/b': 1,
+            'C|nginx.http.uri.status.5xx||/b': 1,
+            'C|nginx.http.uri.time||/b': 0.25,
+        }
+
+        collector = NginxAccessLogsCollector(object=self.fake_object, log_format=log_format, tail=[], top_uris=2)
+        collector.batch_size = 4
+
+        for collect, workers in (
+            (collector.collect_lines, None),
+            (collector.collect_batches, None),
+            (collector.collect_in_workers, WorkerPool(2)),
+        ):
+            collector.workers = workers
+            try:
+                collect(lines)
+            finally:
+                if workers:
+                    workers.stop()
+            collector.report_top_uris(force=True)
+
+            counters = self.fake_object.statsd.flush()['metrics']['counter']
+            assert_that(
+                dict((name, points[0][1]) for name, points in counters.iteritems() if '||' in name),
+                equal_to(expected)
+            )
+            assert_that(collector.uri_sketch, has_length(0))
+
+    def test_top_uris_interval(self):
+        collector = NginxAccessLogsCollector(object=self.fake_object, tail=[], top_uris=2)
+        collector.collect_lines(['127.0.0.1 - - [02/Jul/2015:14:49:48 +0000] "GET /a HTTP/1.1" 200 110 "-" "-"'])
+
+        # nothing is reported until the push interval has passed
+        collector.report_top_uris()
+        assert_that(collector.uri_sketch, has_length(1))
+
+        collector.uri_reported -= collector.uri_interval
+        collector.report_top_uris()
+        assert_that(collector.uri_sketch, has_length(0))
+        assert_that(self.fake_object.statsd.current['counter'], has_key('nginx.http.uri.count||/a'))
+
+    def test_upstream_peers(self):
+        log_format = '"$request" $status ua="$upstream_addr" us="$upstream_status" ut="$upstream_response_time"'
+        lines = [
+            '"GET /a HTTP/1.1" 200 ua="10.0.0.1:80" us="200" ut="0.5"',
+            '"GET /a HTTP/1.1" 200 ua="10.0.0.2:80, 10.0.0.1:80" us="502, 200" ut="1.0, 0.25"',
+            '"GET /a HTTP/1.1" 200 ua="10.0.0.3:80 : unix:/tmp/sock" us="404 : 200" ut="0.125 : 0.125"',
+            '"GET /a HTTP/1.1" 502 ua="backend" us="502" ut="-"',
+            '"GET /a HTTP/1.1" 200 ua="-" us="-" ut="-"',
+            '"garbage" 200 ua="10.0.0.1:80" us="200" ut="0.5"',
+        ]
+
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=log_format, tail=[], upstream_peers=3
+        )
+        collector.batch_size = 4
+
+        for collect, workers in (
+            (collector.collect_lines, None),
+            (collector.collect_batches, None),
+            (collector.collect_in_workers, WorkerPool(2)),
+        ):
+            collector.workers = workers
+            try:
+                collect(lines)
+            finally:
+                if workers:
+                    workers.stop()
+
+            metrics = self.fake_object.statsd.flush()['metrics']
+            counters = dict((name, points[0][1]) for name, points in metrics['counter'].iteritems() if '||' in name)
+            timers = dict((name, points[0][1]) for name, points in metrics['timer'].iteritems() if '||' in name)
+
+            # the busiest peers are admitted first, the rest go to the overflow
+            assert_that(collector.peers, equal_to({'10.0.0.1:80', '10.0.0.2:80', '10.0.0.3:80'}))
+            assert_that(counters, equal_to({
+                'C|nginx.upstream.peer.request.count||10.0.0.1:80': 2,
+                'C|nginx.upstream.peer.http.status.2xx||10.0.0.1:80': 2,
+                'C|nginx.upstream.peer.request.count||10.0.0.2:80': 1,
+                'C|nginx.upstream.peer.http.status.5xx||10.0.0.2:80': 1,
+                'C|nginx.upstream.peer.request.count||10.0.0.3:80': 1,
+                'C|nginx.upstream.peer.http.status.4xx||10.0.0.3:80': 1,
+                'C|nginx.upstream.peer.request.count||other': 2,
+                'C|nginx.upstream.peer.http.status.2xx||other': 1,
+                'C|nginx.upstream.peer.http.status.5xx||other': 1,
+            }))
+            assert_that(timers['C|nginx.upstream.peer.response.time||10.0.0.1:80.count'], equal_to(2))
+            assert_that(timers['G|nginx.upstream.peer.response.time||10.0.0.1:80.max'], equal_to(0.5))
+            assert_that(timers['C|nginx.upstream.peer.response.time||other.count'], equal_to(1))
+            collector.peers = set()
+
+    def test_upstream_peers_reset(self):
+        log_format = '"$request" $status ua="$upstream_addr" us="$upstream_status" ut="$upstream_response_time"'
+        line = '"GET /a HTTP/1.1" 200 ua="%s" us="200" ut="0.5"'
+
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=log_format, tail=[line % '10.0.0.1:80'], upstream_peers=1
+        )
+        collector.collect()
+
+        # a new peer is counted as other during the interval
+        collector.tail = [line % '10.0.0.2:80']
+        collector.collect()
+        counters = self.fake_object.statsd.flush()['metrics']['counter']
+        assert_that(counters['C|nginx.upstream.peer.request.count||10.0.0.1:80'][0][1], equal_to(1))
+        assert_that(counters['C|nginx.upstream.peer.request.count||other'][0][1], equal_to(1))
+
+        # and takes the place of the old one in the next interval
+        collector.peers_reset -= collector.peers_interval
+        collector.collect()
+        counters = self.fake_object.statsd.flush()['metrics']['counter']
+        assert_that(collector.peers, equal_to({'10.0.0.2:80'}))
+        assert_that(counters['C|nginx.upstream.peer.request.count||10.0.0.2:80'][0][1], equal_to(1))
+        assert_that(counters, is_not(has_key('C|nginx.upstream.peer.request.count||other')))
+
+    def test_sampling(self):
+        log_format = '"$request" $status rt=$request_time'
+        lines = ['"GET /a HTTP/1.1" 200 rt=0.5'] * 8 + ['"GET /a HTTP/1.1" 500 rt=1.5'] * 8
+
+        # the limit is always exceeded, so every cycle doubles the rate
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=log_format, tail=lines,
+            sampler=AdaptiveSampler(max_time=-1.0, max_rate=4)
+        )
+        collector.reservoir_size = 3
+
+        for rate in (2, 4):
+            collector.collect()
+            assert_that(collector.sample_rate, equal_to(rate))
+
+            metrics = self.fake_object.statsd.flush()['metrics']
+            counters, timers = metrics['counter'], metrics['timer']
+
+            # counters and numbers of timer values are scaled back up
+            assert_that(counters['C|nginx.http.status.2xx'][0][1], equal_to(8))
+            assert_that(counters['C|nginx.http.status.5xx'][0][1], equal_to(8))
+            assert_that(counters['C|nginx.http.method.get'][0][1], equal_to(16))
+            assert_that(timers['C|nginx.http.request.time.count'][0][1], equal_to(16))
+
+            # while timers keep only a sample of the values
+            assert_that(timers['G|nginx.http.request.time.max'][0][1], is_in([0.5, 1.5]))
+            assert_that(metrics['gauge']['G|log.sample_rate||None'][0][1], equal_to(rate))
+
+    def test_event_time(self):
+        log_format = '[$time_local] "$request" $status rt=$request_time'
+        now = int(time.time())
+
+        def line(timestamp, status):
+            return '[%s] "GET /a HTTP/1.1" %s rt=0.5' % (
+                time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(timestamp)), status
+            )
+
+        lines = [line(now - 5, 200), line(now - 5, 200), line(now - 3, 500), line(now - 3600, 200)]
+
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=log_format, tail=lines, event_time=True, late_window=30
+        )
+        assert_that(collector.time_key, equal_to('time_local'))
+
+        # lines and batches are split by buckets in the same way, too old lines go to the oldest bucket of the window
+        for collect in (collector.collect_lines, collector.collect_batches):
+            collector.buckets = {}
+            collect(lines)
+
+            buckets = sorted(collector.buckets)
+            assert_that(buckets, has_length(3))
+            assert_that(buckets[0], greater_than_or_equal_to(now - 30))
+            assert_that(buckets[1:], equal_to([now - 5, now - 3]))
+
+            counters = [collector.buckets[bucket].counters for bucket in buckets]
+            assert_that(counters[0]['nginx.http.status.2xx'], equal_to(1))
+            assert_that(counters[1]['nginx.http.status.2xx'], equal_to(2))
+            assert_that(counters[2]['nginx.http.status.5xx'], equal_to(1))
+            assert_that(collector.buckets[now - 5].timer_values['nginx.http.request.time'], equal_to([0.5, 0.5]))
+
+        # the same $time_local is parsed once
+        assert_that(collector.time_cache, has_length(3))
+
+        # counters and timers are flushed with a point per bucket
+        collector.buckets = {}
+        collector.collect()
+        metrics = self.fake_object.statsd.flush()['metrics']
+        counters, timers = metrics['counter'], metrics['timer']
+
+        assert_that(counters['C|nginx.http.status.2xx'][1:], equal_to([[now - 5, 2]]))
+        assert_that(counters['C|nginx.http.status.5xx'], equal_to([[now - 3, 1]]))
+        assert_that(timers['C|nginx.http.request.time.count'][1:], equal_to([[now - 5, 2], [now - 3, 1]]))
+        assert_that(collector.buckets, equal_to({}))
+
+    def test_event_time_msec(self):
+        log_format = '$msec "$request" $status'
+        lines = ['%.3f "GET /a HTTP/1.1" 200' % (time.time() - 10)]
+
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, log_format=log_format, tail=lines, event_time=True, time_bucket=60
+        )
+        assert_that(collector.time_key, equal_to('msec'))
+
+        collector.collect()
+        counter = self.fake_object.statsd.flush()['metrics']['counter']['C|nginx.http.status.2xx']
+        assert_that(counter, has_length(1))
+        assert_that(counter[0][0] % 60, equal_to(0))
+        assert_that(counter[0][1], equal_to(1))
@@ -55,3 +55,47 @@ class LogsOverallTestCase(NginxCollectorTestCase):
         # check zero values
         for error_counter in collector.counters:
             assert_that(counter, has_key('C|%s' % error_counter))
+
+    def test_failures_by_upstream_and_server(self):
+        def line(level, message, server, upstream):
+            return '2015/07/14 08:42:57 [%s] 28386#28386: *38698 %s, client: 127.0.0.1, server: %s, ' \
+                   'request: "GET /1.0/ HTTP/1.0", upstream: "%s", host: "localhost:5000"' % (
+                       level, message, server, upstream
+                   )
+
+        connect = 'connect() failed (111: Connection refused) while connecting to upstream'
+        timeout = 'upstream timed out (110: Connection timed out) while reading response header from upstream'
+        lines = [
+            line('error', connect, 'a.example.com', 'http://10.0.0.1:80/'),
+            line('error', connect, 'a.example.com', 'http://10.0.0.1:80/api/'),
+            line('error', timeout, 'b.example.com', 'http://10.0.0.2:80/'),
+            line('error', timeout, 'c.example.com', 'http://10.0.0.3:80/'),
+            line('warn', timeout, 'a.example.com', 'http://10.0.0.1:80/'),  # below the level
+        ]
+
+        collector = NginxErrorLogsCollector(
+            level='error', object=self.fake_object, tail=lines, upstream_peers=2, servers=1
+        )
+        collector.collect()
+        counter = self.fake_object.statsd.flush()['metrics']['counter']
+
+        assert_that(counter['C|nginx.upstream.request.failed'][0][1], equal_to(2))
+        assert_that(counter['C|nginx.upstream.response.failed'][0][1], equal_to(2))
+
+        assert_that(counter['C|nginx.upstream.peer.request.failed||10.0.0.1:80'][0][1], equal_to(2))
+        assert_that(counter['C|nginx.upstream.peer.response.failed||10.0.0.2:80'][0][1], equal_to(1))
+        assert_that(counter['C|nginx.upstream.peer.response.failed||other'][0][1], equal_to(1))
+
+        assert_that(counter['C|nginx.server.upstream.request.failed||a.example.com'][0][1], equal_to(2))
+        assert_that(counter['C|nginx.server.upstream.response.failed||other'][0][1], equal_to(2))
+
+        # the next interval starts with other peers and servers
+        collector.tail = lines[2:4]
+        collector.names_reset -= collector.names_interval
+        collector.collect()
+        counter = self.fake_object.statsd.flush()['metrics']['counter']
+
+        assert_that(counter['C|nginx.upstream.peer.response.failed||10.0.0.2:80'][0][1], equal_to(1))
+        assert_that(counter['C|nginx.upstream.peer.response.failed||10.0.0.3:80'][0][1], equal_to(1))
+        assert_that(counter['C|nginx.server.upstream.response.failed||b.example.com'][0][1], equal_to(1))
+        assert_that(counter['C|nginx.server.upstream.response.failed||other'][0][1], equal_to(1))
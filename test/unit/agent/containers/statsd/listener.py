@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import socket
+
+from hamcrest import *
+
+from test.base import BaseTestCase
+from amplify.agent.context import context
+from amplify.agent.statsd import StatsdBuffer
+from amplify.agent.containers.statsd.container import StatsdListenerContainer
+from amplify.agent.containers.statsd.collectors.listener import parse_address, parse_packet
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class StatsdListenerTestCase(BaseTestCase):
+
+    def teardown_method(self, method):
+        context.app_config.get('statsd').pop('listen', None)
+        super(StatsdListenerTestCase, self).teardown_method(method)
+
+    def test_parse_packet(self):
+        buffer, gauges = StatsdBuffer(), {}
+        invalid = parse_packet(
+            'app.requests:1|c\n'
+            'app.requests:2|c|@0.5\n'
+            'app.latency:320|ms\n'
+            'app.latency:100|ms|@0.1|#route:home\n'
+            'app.size:12.5|h\n'
+            'app.queue:10|g\n'
+            'app.queue:-3|g\n'
+            'app.workers:+2|g\n'
+            'app.users:42|s\n'
+            'app.bad:x|c\n'
+            'app.rate:1|c|@2\n'
+            'garbage\n'
+            ':1|c\n',
+            buffer, gauges
+        )
+
+        assert_that(invalid, equal_to(5))
+        assert_that(buffer.counters, equal_to({'app.requests': 5.0}))
+        assert_that(buffer.timer_values, equal_to({'app.latency': [320.0, 100.0], 'app.size': [12.5]}))
+        assert_that(buffer.timer_counts, equal_to({'app.latency': 11, 'app.size': 1}))
+        assert_that(gauges, equal_to({'app.queue': (7.0, False), 'app.workers': (2.0, True)}))
+
+    def test_parse_address(self):
+        assert_that(parse_address('8125'), equal_to(('127.0.0.1', 8125)))
+        assert_that(parse_address('0.0.0.0:8125'), equal_to(('0.0.0.0', 8125)))
+        assert_that(parse_address('[::1]:8125'), equal_to(('::1', 8125)))
+
+    def test_listener(self):
+        container = StatsdListenerContainer()
+        container.discover_objects()
+        assert_that(container.objects, has_length(0))
+
+        context.app_config.config.setdefault('statsd', {})['listen'] = '127.0.0.1:0'
+        container.discover_objects()
+        assert_that(container.objects, has_length(1))
+
+        statsd_obj = container.objects.values().pop()
+        collector = statsd_obj.collectors[0]
+        collector.collect()  # binds the socket
+        address = collector.sock.getsockname()
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in xrange(100):
+            client.sendto('app.requests:1|c\napp.latency:%d|ms' % i, address)
+        client.sendto('app.queue:5|g\nbroken', address)
+        client.close()
+
+        collector.collect()
+        collector.close()
+
+        metrics = statsd_obj.statsd.flush()['metrics']
+        assert_that(metrics['counter']['C|app.requests'][0][1], equal_to(100))
+        assert_that(metrics['counter']['C|statsd.listener.packets'][0][1], equal_to(101))
+        assert_that(metrics['counter']['C|statsd.listener.invalid'][0][1], equal_to(1))
+        assert_that(metrics['timer']['C|app.latency.count'][0][1], equal_to(100))
+        assert_that(metrics['timer']['G|app.latency.max'][0][1], equal_to(99))
+        assert_that(metrics['gauge']['G|app.queue'][0][1], equal_to(5))
+
+    def test_gauges(self):
+        context.app_config.config.setdefault('statsd', {})['listen'] = '127.0.0.1:0'
+        container = StatsdListenerContainer()
+        container.discover_objects()
+
+        statsd_obj = container.objects.values().pop()
+        collector = statsd_obj.collectors[0]
+        collector.collect()
+        address = collector.sock.getsockname()
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # changes are applied to the last value even if it was flushed
+        for packet, queue in (('app.queue:5|g', 5), ('app.queue:+2|g', 7), ('app.queue:-3|g\napp.queue:-1|g', 3)):
+            client.sendto(packet, address)
+            collector.collect()
+            gauges = statsd_obj.statsd.flush()['metrics']['gauge']
+            assert_that(gauges['G|app.queue'][0][1], equal_to(queue))
+
+        # a change of an unknown gauge starts from 0
+        client.sendto('app.workers:+2|g', address)
+        collector.collect()
+        gauges = statsd_obj.statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|app.workers'][0][1], equal_to(2))
+
+        client.close()
+        collector.close()
+
+    def test_dropped(self):
+        context.app_config.config.setdefault('statsd', {})['listen'] = '127.0.0.1:0'
+        container = StatsdListenerContainer()
+        container.discover_objects()
+
+        statsd_obj = container.objects.values().pop()
+        collector = statsd_obj.collectors[0]
+        collector.rcvbuf = 4096  # the kernel can't keep them all
+        collector.collect()
+        address = collector.sock.getsockname()
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in xrange(500):
+            client.sendto('app.requests:1|c', address)
+        client.close()
+
+        collector.last_drops_check = 0
+        collector.collect()
+        collector.close()
+
+        counters = statsd_obj.statsd.flush()['metrics']['counter']
+        received = counters['C|statsd.listener.packets'][0][1]
+        dropped = counters['C|statsd.listener.dropped'][0][1]
+        assert_that(dropped, greater_than(0))
+        assert_that(received + dropped, equal_to(500))
@@ -24,6 +24,7 @@ proxy_buffers_complex_config = os.getcwd() + '/test/fixtures/nginx/proxy_buffers
 tabs_config = os.getcwd() + '/test/fixtures/nginx/custom/tabs.conf'
 fastcgi_config = os.getcwd() + '/test/fixtures/nginx/fastcgi/nginx.conf'
 json_config = os.getcwd() + '/test/fixtures/nginx/custom/json.conf'
+escape_json_config = os.getcwd() + '/test/fixtures/nginx/custom/escape_json.conf'
 ssl_simple_config = os.getcwd() + '/test/fixtures/nginx/ssl/simple/nginx.conf'
 regex_status_config = os.getcwd() + '/test/fixtures/nginx/regex_status/nginx.conf'
 
@@ -188,6 +189,14 @@ class ConfigTestCase(BaseTestCase):
         assert_that(location, has_key('fastcgi_param'))
         assert_that(location['fastcgi_param'], has_length(17))
 
+    def test_escape_json(self):
+        config = NginxConfig(escape_json_config)
+        config.full_parse()
+
+        assert_that(config.log_formats, has_key('main'))
+        assert_that(config.log_formats, has_key('plain'))
+        assert_that(config.log_format_escapes, equal_to({'main': 'json'}))
+
     def test_json(self):
         config = NginxConfig(json_config)
         config.full_parse()
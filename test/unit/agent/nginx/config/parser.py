@@ -26,6 +26,7 @@ includes_config = os.getcwd() + '/test/fixtures/nginx/includes/nginx.conf'
 windows_config = os.getcwd() + '/test/fixtures/nginx/windows/nginx.conf'
 tab_config = os.getcwd() + '/test/fixtures/nginx/custom/tabs.conf'
 json_config = os.getcwd() + '/test/fixtures/nginx/custom/json.conf'
+escape_json_config = os.getcwd() + '/test/fixtures/nginx/custom/escape_json.conf'
 ssl_simple_config = os.getcwd() + '/test/fixtures/nginx/ssl/simple/nginx.conf'
 sub_filter_config = os.getcwd() + '/test/fixtures/nginx/custom/sub_filter.conf'
 
@@ -284,6 +285,18 @@ class ParserTestCase(BaseTestCase):
         for log_format in tree['http']['log_format'].itervalues():
             assert_that(log_format.find('\\'), equal_to(-1))
 
+    def test_parse_escape_json(self):
+        cfg = NginxConfigParser(escape_json_config)
+
+        cfg.parse()
+        tree = cfg.simplify()
+
+        log_formats = tree['http']['log_format']
+        assert_that(log_formats, has_key('main'))
+        assert_that(log_formats['main'], starts_with('{"time_local": "$time_local"'))
+        assert_that(log_formats, has_key('plain'))
+        assert_that(tree['http']['log_format_escape'], equal_to({'main': 'json'}))
+
     def test_parse_ssl_simple_config(self):
         cfg = NginxConfigParser(ssl_simple_config)
         cfg.parse()
@@ -3,7 +3,7 @@ import re
 
 from hamcrest import *
 
-from amplify.agent.nginx.filters import Filter
+from amplify.agent.nginx.filters import Filter, FilterIndex
 from test.base import BaseTestCase
 
 __author__ = "Mike Belov"
@@ -57,3 +57,41 @@ class FiltersTestCase(BaseTestCase):
         filtr = Filter(**raw_filter_data)
         assert_that(filtr.empty, equal_to(True))
 
+
+    def test_index_equals_match(self):
+        rules = [
+            {'$request_method': 'post'},
+            {'$request_method': 'GET'},
+            {'$request_uri': '*.gif'},
+            {'$request_uri': '/img/*'},
+            {'$request_uri': '/img/a.gif'},
+            {'$status': '200'},
+            {'$status': '4*'},
+            {'$status': '*'},
+            {'$body_bytes_sent': '100'},
+            {'$request_time': '*'},
+        ]
+
+        filters = [Filter(filter_rule_id='empty', metric='http.something', data=[{'filename': 'foo.txt'}])]
+        for i, first in enumerate(rules):
+            for j, second in enumerate(rules[i:]):
+                filters.append(Filter(filter_rule_id='%s-%s' % (i, j), metric='http.something', data=[first, second]))
+
+        index = FilterIndex(filters)
+
+        # predicates shared by filters are evaluated once
+        assert_that(len(index.users), equal_to(len(rules)))
+        assert_that(index.patterns['request_uri'], has_length(1))
+
+        for parsed in (
+            {},
+            {'request_method': 'POST', 'request_uri': '/img/a.gif', 'status': '200', 'body_bytes_sent': 100},
+            {'request_method': 'GET', 'request_uri': '/img/b.png', 'status': '404', 'request_time': '0.1'},
+            {'request_method': 'GET', 'request_uri': '/c.gif', 'status': '499', 'body_bytes_sent': 0},
+            {'request_method': 'PUT', 'request_uri': '/', 'status': ''},
+        ):
+            expected = [log_filter for log_filter in filters if log_filter.match(parsed)]
+            assert_that(index.match(parsed), equal_to(expected))
+
+        # patterns are not applied to values which are not strings
+        assert_that(index.match({'request_time': [0.1]}), equal_to(filters[:1]))
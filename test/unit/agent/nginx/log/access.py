@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from hamcrest import *
 
-from amplify.agent.nginx.log.access import NginxAccessLogParser
+from amplify.agent.nginx.log.access import NginxAccessLogParser, parse_time_local
 from test.base import BaseTestCase
 
 __author__ = "Mike Belov"
@@ -286,3 +286,226 @@ class LogParserTestCase(BaseTestCase):
 
         for key in expected_keys:
             assert_that(parsed, has_item(key))
+
+    def test_compiled_parse_equals_generic(self):
+        """
+        Checks that the function compiled for a format returns exactly the same as the generic parser
+        """
+        combined_line = \
+            '127.0.0.1 - - [02/Jul/2015:14:49:48 +0000] "GET /basic_status HTTP/1.1" 200 110 "-" ' + \
+            '"python-requests/2.2.1 CPython/2.7.6 Linux/3.13.0-48-generic"'
+
+        cases = [
+            (None, combined_line),
+            (None, combined_line.replace('GET /basic_status HTTP/1.1', 'GARBAGE')),
+            (None, combined_line.replace('"GET', '"GET "quoted" /x "GET')),
+            (None, 'not a log line at all'),
+            (
+                '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" ' +
+                '"$http_user_agent" rt=$request_time ut="$upstream_response_time" cs=$upstream_cache_status',
+                '1.2.3.4 - - [22/Jan/2010:19:34:21 +0300] "GET /foo/ HTTP/1.1" 200 11078 "http://www.rambler.ru/" ' +
+                '"Mozilla/5.0 (Windows; U; Windows NT 5.1" rt=0.010 ut="2.001, 0.345, 12999999999.1" cs=MISS'
+            ),
+            (
+                '$remote_addr "$request" "$request_uri" $status $status "$request_time" $gzip_ratio',
+                '1.2.3.4 "POST /wp-login.php HTTP/1.1" "/other" 200 201 "-" -'
+            ),
+            (
+                '$request_uri $request_method $request $server_protocol',
+                '/a PUT GET /b HTTP/2.0 HTTP/1.0'
+            ),
+        ]
+
+        # formats parsed with split, including lines which can not be split unambiguously
+        tab_format = '$remote_addr\t$time_local\t$request\t$status\t$body_bytes_sent\t$request_time\t$pipe'
+        tab_line = '10.0.0.1\t27/Jan/2016:12:30:04 -0800\tGET /a?b=c HTTP/1.1\t200\t5909\t0.010\t.'
+        pipe_format = '[$remote_addr|$status|$upstream_response_time|$http_user_agent]'
+        quoted_format = '"$remote_addr" "$request" "$status" "$http_user_agent"'
+        quoted_line = '"10.0.0.1" "GET / HTTP/1.1" "404" "curl/7.35.0"'
+
+        cases += [
+            (tab_format, tab_line),
+            (tab_format, tab_line.replace('\t200\t', '\t2x0\t')),
+            (tab_format, tab_line.replace('\t.', '\tpp')),
+            (tab_format, tab_line + '\textra'),
+            (tab_format, tab_line.replace('0.010', '0.010, 0.020')),
+            (tab_format, '\t\t\t\t\t\t'),
+            (pipe_format, '[10.0.0.1|502|1.0, 2.0|Mozilla/5.0 (X11; Linux)]'),
+            (pipe_format, '[10.0.0.1|502|1.0|Mozilla|5.0]'),
+            (pipe_format, '[10.0.0.1|502|1.0|Mozilla/5.0] trailing'),
+            (pipe_format, '[10.0.0.1|502|-|Mozilla/5.0]]'),
+            (pipe_format, '[|'),
+            (quoted_format, quoted_line),
+            (quoted_format, quoted_line.replace('curl/7.35.0', 'curl" "7.35.0')),
+            (quoted_format, quoted_line.replace('curl/7.35.0', 'curl" " "7.35.0')),
+            (quoted_format, quoted_line.replace('curl/7.35.0', '" "')),
+            (quoted_format, quoted_line.replace('GET / HTTP/1.1', 'garbage')),
+        ]
+
+        def parse(func, line):
+            try:
+                return func(line)
+            except ValueError as e:
+                return e.__class__
+
+        for user_format, line in cases:
+            parser = NginxAccessLogParser(user_format)
+            assert_that(parse(parser.parse, line), equal_to(parse(parser.parse_generic, line)))
+
+    def test_compiled_parse_shaped_variables(self):
+        """
+        Checks that compiled parse functions match variables formatted by nginx by their shape,
+        so ambiguous lines are split where the generic parser would swallow them into one greedy variable
+        """
+        user_format = '$remote_addr\t$time_local\t$request\t$status\t$body_bytes_sent\t$request_time\t$pipe'
+        line = '10.0.0.1\t27/Jan/2016:12:30:04 -0800\tGET /a\tb HTTP/1.1\t200\t5909\t0.010\t.'
+
+        parser = NginxAccessLogParser(user_format)
+        assert_that(parser.parse_generic(line)['remote_addr'], equal_to('10.0.0.1\t27/Jan/2016:12:30:04 -0800'))
+
+        parsed = parser.parse(line)
+        assert_that(parsed['malformed'], equal_to(False))
+        assert_that(parsed['remote_addr'], equal_to('10.0.0.1'))
+        assert_that(parsed['time_local'], equal_to('27/Jan/2016:12:30:04 -0800'))
+        assert_that(parsed['request_uri'], equal_to('/a\tb'))
+        assert_that(parsed['request_time'], equal_to([0.01]))
+
+    def test_projection(self):
+        user_format = \
+            '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" ' + \
+            '"$http_user_agent" rt=$request_time ut="$upstream_response_time" cs=$upstream_cache_status'
+        line = \
+            '1.2.3.4 - - [22/Jan/2010:19:34:21 +0300] "GET /foo/ HTTP/1.1" 200 11078 "http://www.rambler.ru/" ' + \
+            '"Mozilla/5.0 (Windows; U; Windows NT 5.1" rt=0.010 ut="2.001, 0.345" cs=MISS'
+
+        parser = NginxAccessLogParser(user_format)
+        full = parser.parse(line)
+
+        parser.project(['status', 'upstream_response_time'])
+        parsed = parser.parse(line)
+
+        assert_that(parsed, equal_to(dict(
+            malformed=False,
+            status=full['status'],
+            upstream_response_time=full['upstream_response_time'],
+            request_method='GET',
+            request_uri='/foo/',
+            server_protocol='HTTP/1.1'
+        )))
+
+        # malformed requests are still detected
+        assert_that(parser.parse(line.replace('GET /foo/ HTTP/1.1', 'foo'))['malformed'], equal_to(True))
+
+    def test_split_plan(self):
+        assert_that(NginxAccessLogParser().split_plan(), equal_to(None))
+        assert_that(NginxAccessLogParser('$status').split_plan(), equal_to(None))
+        assert_that(NginxAccessLogParser('$status$request').split_plan(), equal_to(None))
+        assert_that(NginxAccessLogParser('$status $time_local$request').split_plan(), equal_to(None))
+        assert_that(NginxAccessLogParser('$status--$request').split_plan(), equal_to(('', '--', '')))
+        assert_that(NginxAccessLogParser('$status\t$request').split_plan(), equal_to(('', '\t', '')))
+        assert_that(
+            NginxAccessLogParser('"$status" "$request" "$http_user_agent"').split_plan(),
+            equal_to(('"', '" "', '"'))
+        )
+
+    def test_json_format(self):
+        user_format = \
+            '{"remote_addr": "$remote_addr", "request": {"line": "$request", "time": "$request_time"}, ' + \
+            '"status": $status, "upstreams": ["$upstream_addr", "$upstream_response_time"]}'
+        line = \
+            '{"remote_addr": "10.0.0.1", "request": {"line": "GET /a?b=c HTTP/1.1", "time": "0.010"}, ' + \
+            '"status": 200, "upstreams": ["10.0.0.2:80, 10.0.0.3:80", "0.002, 0.005"]}'
+
+        parser = NginxAccessLogParser(user_format)
+        assert_that(parser.json_plan(), equal_to([
+            ['remote_addr'], ['request', 'line'], ['request', 'time'], ['status'], ['upstreams', 0], ['upstreams', 1]
+        ]))
+        assert_that(NginxAccessLogParser('{"request": "GET $uri"}').json_plan(), equal_to(None))
+        assert_that(NginxAccessLogParser().json_plan(), equal_to(None))
+
+        # the same as regex results for simple values
+        assert_that(parser.parse(line), equal_to(parser.parse_generic(line)))
+
+        # JSON escapes are decoded
+        escaped_line = line.replace('/a?b=c', '/\\"a\\"')
+        assert_that(parser.parse(escaped_line)['request_uri'], equal_to('/"a"'))
+
+        # lines which are not JSON are parsed with regex
+        default_escaped_line = line.replace('/a?b=c', '/\\x22a\\x22')
+        assert_that(parser.parse(default_escaped_line), equal_to(parser.parse_generic(default_escaped_line)))
+
+        # batches are decoded line by line, lines which are not JSON go to the regex
+        for lines in ([line, escaped_line], [line, default_escaped_line, 'garbage']):
+            batch = parser.parse_batch(lines)
+            assert_that(batch.lines, equal_to(len(lines)))
+            assert_that(len(batch), equal_to(2))
+            assert_that(batch.columns['request_uri'][0], equal_to('/a?b=c'))
+            assert_that(list(batch.time_counts['upstream_response_time']), equal_to([2, 2]))
+
+    def test_json_empty_values(self):
+        user_format = \
+            '{"request": "$request", "status": "$status", "upstream_addr": "$upstream_addr", ' + \
+            '"upstream_status": "$upstream_status", "upstream_response_time": "$upstream_response_time"}'
+        line = \
+            '{"request": "GET /a HTTP/1.1", "status": "200", "upstream_addr": "", ' + \
+            '"upstream_status": "", "upstream_response_time": ""}'
+
+        parser = NginxAccessLogParser(user_format, escape='json')
+        assert_that(parser.json_plan(), not_none())
+        assert_that(NginxAccessLogParser(user_format, escape='none').json_plan(), equal_to(None))
+
+        # missing variables are empty strings with escape=json
+        parsed = parser.parse(line)
+        assert_that(parsed['malformed'], equal_to(False))
+        assert_that(parsed['upstream_status'], equal_to(''))
+        assert_that(parsed, is_not(has_key('upstream_response_time')))
+        assert_that(parser.parse_generic(line), is_not(has_key('upstream_response_time')))
+
+        batch = parser.parse_batch([line, line.replace('""}', '"0.005"}')])
+        assert_that(batch.lines, equal_to(2))
+        assert_that(batch.failed, equal_to(0))
+        assert_that(list(batch.time_counts['upstream_response_time']), equal_to([0, 1]))
+
+    def test_time_values(self):
+        log_format = 'ua="$upstream_addr" ut="$upstream_response_time" rt=$request_time'
+        lines = [
+            'ua="10.0.0.1:80, 10.0.0.2:80 : 10.0.0.3:80" ut="0.001, 0.002 : 0.004" rt=0.010',
+            'ua="-" ut="-" rt=0.010',
+        ]
+
+        parser = NginxAccessLogParser(log_format)
+        assert_that(parser.parse(lines[0])['upstream_response_time'], equal_to([0.001, 0.002, 0.004]))
+        assert_that(parser.parse(lines[0]), equal_to(parser.parse_generic(lines[0])))
+
+        # lists of values are kept in batches only if they are asked for
+        assert_that(parser.parse_batch(lines).time_values, equal_to({}))
+
+        parser.project(None, time_values=['upstream_response_time'])
+        batch = parser.parse_batch(lines)
+        assert_that(batch.time_values, equal_to({'upstream_response_time': [[0.001, 0.002, 0.004], ()]}))
+        assert_that(list(batch.time_counts['upstream_response_time']), equal_to([3, 0]))
+
+    def test_time_local(self):
+        assert_that(parse_time_local('18/Jun/2015:17:22:25 +0000'), equal_to(1434648145))
+        assert_that(parse_time_local('18/Jun/2015:20:22:25 +0300'), equal_to(1434648145))
+        assert_that(parse_time_local('18/Jun/2015:12:52:25 -0430'), equal_to(1434648145))
+        assert_that(calling(parse_time_local).with_args('18/Foo/2015:17:22:25 +0000'), raises(ValueError))
+        assert_that(calling(parse_time_local).with_args('-'), raises(ValueError))
+
+    def test_select(self):
+        log_format = '$msec "$request" $status ut="$upstream_response_time"'
+        lines = [
+            '1434648145.100 "GET /a HTTP/1.1" 200 ut="0.1"',
+            '1434648146.100 "GET /b HTTP/1.1" 404 ut="-"',
+            '1434648147.100 "GET /c HTTP/1.1" 500 ut="0.2, 0.3"',
+        ]
+
+        parser = NginxAccessLogParser(log_format)
+        parser.project(None, time_values=['upstream_response_time'])
+        batch = parser.parse_batch(lines).select([0, 2])
+
+        assert_that(len(batch), equal_to(2))
+        assert_that(list(batch.columns['msec']), equal_to([1434648145.1, 1434648147.1]))
+        assert_that(batch.columns['status'], equal_to(['200', '500']))
+        assert_that(list(batch.time_counts['upstream_response_time']), equal_to([1, 2]))
+        assert_that(batch.time_values['upstream_response_time'], equal_to([[0.1], [0.2, 0.3]]))
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import re
+
 from hamcrest import *
 
-from amplify.agent.nginx.log.error import NginxErrorLogParser
+from amplify.agent.nginx.log.error import ErrorClassifier, NginxErrorLogParser, error_re
 from test.base import BaseTestCase
 
 __author__ = "Mike Belov"
@@ -41,3 +43,85 @@ class LogParserTestCase(BaseTestCase):
         parser = NginxErrorLogParser()
         parsed = parser.parse(line)
         assert_that(parsed, equal_to(None))
+
+    def test_classifier_equals_patterns(self):
+        messages = [
+            'connect() failed (111: Connection refused) while connecting to upstream, client: 10.0.0.1',
+            'upstream timed out (110: Connection timed out) while connecting to upstream, client: 10.0.0.1',
+            'upstream queue is full while connecting to upstream',
+            'no live upstreams while connecting to upstream, client: 10.0.0.1',
+            'recv() failed (104: Connection reset by peer) while reading upstream',
+            'upstream buffer is too small to read response',
+            'upstream sent no valid HTTP/1.0 header while reading response header from upstream',
+            'upstream sent invalid chunked response',
+            'a client request body is buffered to a temporary file',
+            'an upstream response is buffered to a temporary file while reading upstream',
+            'open() "/usr/share/nginx/html/favicon.ico" failed (2: No such file or directory)',
+            'client timed out (110: Connection timed out) while waiting for request',
+            'upstream: "http://127.0.0.1:3000/"',
+            '',
+        ]
+
+        def match_all(line):
+            for error, regexps in error_re.iteritems():
+                for regexp in regexps:
+                    if re.match(regexp, line):
+                        return error
+            return None
+
+        parser = NginxErrorLogParser()
+        for message in messages:
+            line = '2015/07/14 08:42:57 [error] 28386#28386: *38698 %s' % message
+            assert_that(parser.parse(line), equal_to(match_all(line)))
+
+    def test_classifier_without_keywords(self):
+        # patterns which are not plain literals are always matched
+        classifier = ErrorClassifier({
+            'nginx.upstream.request.failed': [re.compile(r'.*(connect|recv)\(\) failed.*')],
+        })
+        assert_that(classifier.gated, equal_to(False))
+        assert_that(classifier.classify('connect() failed (111: Connection refused)'),
+                    equal_to('nginx.upstream.request.failed'))
+        assert_that(classifier.classify('open() failed'), equal_to(None))
+
+    def test_parse_fields(self):
+        line = '2015/07/14 08:42:57 [error] 28386#28387: *38698 upstream timed out ' + \
+               '(110: Connection timed out) while reading response header from upstream, ' + \
+               'client: 127.0.0.1, server: localhost, request: "GET /1.0/?a=1, 2 HTTP/1.0", ' + \
+               'upstream: "uwsgi://127.0.0.1:3131", host: "localhost:5000"'
+
+        parser = NginxErrorLogParser()
+        assert_that(parser.parse_fields(line), equal_to({
+            'time': '2015/07/14 08:42:57',
+            'level': 'error',
+            'pid': '28386',
+            'tid': '28387',
+            'connection': '38698',
+            'message': 'upstream timed out (110: Connection timed out) while reading response header from upstream',
+            'client': '127.0.0.1',
+            'server': 'localhost',
+            'request': 'GET /1.0/?a=1, 2 HTTP/1.0',
+            'upstream': 'uwsgi://127.0.0.1:3131',
+            'host': 'localhost:5000',
+        }))
+        assert_that(parser.level(line), equal_to('error'))
+
+        # messages not about requests have no connection and context
+        line = '2015/07/15 05:56:30 [notice] 28386#28386: signal process started'
+        assert_that(parser.parse_fields(line), equal_to({
+            'time': '2015/07/15 05:56:30',
+            'level': 'notice',
+            'pid': '28386',
+            'tid': '28386',
+            'message': 'signal process started',
+        }))
+
+        # continuation of a multiline message
+        assert_that(parser.parse_fields('    in /etc/nginx/nginx.conf:10'), equal_to(None))
+        assert_that(parser.level('    in /etc/nginx/nginx.conf:10'), equal_to(None))
+
+    def test_upstream_peer(self):
+        parser = NginxErrorLogParser()
+        assert_that(parser.upstream_peer('http://127.0.0.1:3000/api/metrics/'), equal_to('127.0.0.1:3000'))
+        assert_that(parser.upstream_peer('uwsgi://127.0.0.1:3131'), equal_to('127.0.0.1:3131'))
+        assert_that(parser.upstream_peer('http://unix:/tmp/app.sock:/api/'), equal_to('unix:/tmp/app.sock'))
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+import gevent
+from hamcrest import *
+
+from test.base import NginxCollectorTestCase
+from amplify.agent.statsd import StatsdClient, TimerOptions, MetricKeys, TimerKeys
+from amplify.agent.util.clock import clock
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class StatsdClientTestCase(NginxCollectorTestCase):
+
+    def test_timer_sketch(self):
+        values = [i / 1000.0 for i in xrange(1, 1001)]
+
+        plain = StatsdClient(object=self.fake_object)
+        sketched = StatsdClient(object=self.fake_object, timer_accuracy=0.01)
+        for statsd in (plain, sketched):
+            statsd.timer('nginx.http.request.time', values[0])
+            statsd.timers('nginx.http.request.time', values[1:])
+
+        plain_timers = plain.flush()['metrics']['timer']
+        sketched_timers = sketched.flush()['metrics']['timer']
+
+        # the same metrics, quantiles are within the accuracy
+        assert_that(sorted(sketched_timers), equal_to(sorted(plain_timers)))
+        for name in ('G|nginx.http.request.time', 'C|nginx.http.request.time.count', 'G|nginx.http.request.time.max'):
+            assert_that(sketched_timers[name][0][1], close_to(plain_timers[name][0][1], 1e-9))
+        for name in ('G|nginx.http.request.time.median', 'G|nginx.http.request.time.pctl95'):
+            exact = plain_timers[name][0][1]
+            assert_that(sketched_timers[name][0][1], close_to(exact, exact * 0.01 + 0.001))
+
+    def test_swap(self):
+        statsd = StatsdClient(object=self.fake_object)
+        statsd.incr('nginx.http.status.2xx', 2)
+        statsd.timers('nginx.http.request.time', [0.1, 0.2])
+
+        delivery = statsd.swap()
+
+        # writes after the swap go to the new buffer only
+        statsd.incr('nginx.http.status.2xx', 3)
+        statsd.timer('nginx.http.request.time', 0.3)
+        assert_that(delivery['counter']['nginx.http.status.2xx'][0][1], equal_to(2))
+        assert_that(delivery['timer']['nginx.http.request.time'], equal_to([0.1, 0.2]))
+
+        metrics = statsd.flush()['metrics']
+        assert_that(metrics['counter']['C|nginx.http.status.2xx'][0][1], equal_to(3))
+        assert_that(metrics['timer']['C|nginx.http.request.time.count'][0][1], equal_to(1))
+        assert_that(statsd.flush(), equal_to(None))
+
+    def test_small_timers(self):
+        statsd = StatsdClient(object=self.fake_object)
+        statsd.timers('one', [0.5])
+        statsd.timers('three', [0.3, 0.1, 0.2])
+        statsd.timers('five', [0.1, 0.2, 0.3, 0.4, 0.5])
+        timers = statsd.flush()['metrics']['timer']
+
+        assert_that(timers['G|one.median'][0][1], equal_to(0.5))
+        assert_that(timers['G|one.pctl95'][0][1], equal_to(0.5))
+        assert_that(timers['G|three.median'][0][1], equal_to(0.2))
+        assert_that(timers['G|five.median'][0][1], equal_to(0.3))
+        assert_that(timers['G|five.pctl95'][0][1], equal_to(0.5))
+
+    def test_timer_options(self):
+        options = TimerOptions.from_config({
+            'timer_percentiles': '50, 90',
+            'timer_percentiles.nginx.upstream.*.time': '50, 99, 99.9',
+            'timer_buckets.nginx.http.request.time': '0.5, 0.1',
+            'timer_sketch': 'false',
+        })
+        assert_that(options.get('nginx.upstream.response.time'), equal_to(((50.0, 99.0, 99.9), ())))
+        assert_that(options.get('nginx.http.request.time||3'), equal_to(((50.0, 90.0), (0.1, 0.5))))
+
+        # options are cached once for all the dimensions of a timer, and the cache is bounded
+        for i in xrange(100):
+            options.get('nginx.http.request.time||%s' % i)
+        assert_that(options.cache, has_length(2))
+
+        options.max_cached = 10
+        for i in xrange(100):
+            options.get('timer.%s' % i)
+        assert_that(len(options.cache), less_than_or_equal_to(10))
+
+        values = [i / 1000.0 for i in xrange(1, 1001)]
+        for timer_accuracy in (None, 0.01):
+            statsd = StatsdClient(object=self.fake_object, timer_accuracy=timer_accuracy, timer_options=options)
+            statsd.timers('nginx.upstream.response.time', values)
+            statsd.timers('nginx.http.request.time', values)
+            timers = statsd.flush()['metrics']['timer']
+
+            upstream = dict((name, points[0][1]) for name, points in timers.iteritems() if 'upstream' in name)
+            assert_that(sorted(upstream), equal_to([
+                'C|nginx.upstream.response.time.count',
+                'G|nginx.upstream.response.time',
+                'G|nginx.upstream.response.time.max',
+                'G|nginx.upstream.response.time.median',
+                'G|nginx.upstream.response.time.pctl99',
+                'G|nginx.upstream.response.time.pctl99_9',
+            ]))
+            assert_that(upstream['G|nginx.upstream.response.time.pctl99'], close_to(0.99, 0.01))
+            assert_that(upstream['G|nginx.upstream.response.time.pctl99_9'], close_to(0.999, 0.01))
+
+            assert_that(timers['G|nginx.http.request.time.pctl90'][0][1], close_to(0.9, 0.01))
+            assert_that(timers['C|nginx.http.request.time.le_0_1'][0][1], close_to(100, 2))
+            assert_that(timers['C|nginx.http.request.time.le_0_5'][0][1], close_to(500, 10))  # sketch is within 1%
+
+    def test_max_series(self):
+        statsd = StatsdClient(object=self.fake_object, max_series=3)
+        for filter_id in xrange(5):
+            statsd.incr('nginx.http.status.2xx||%s' % filter_id)
+        statsd.gauge('system.disk.free|/mnt', 1)
+        statsd.incr('nginx.http.status.2xx||0')  # known series are still written
+        statsd.agent('status', 1)  # agent metrics are not limited
+
+        metrics = statsd.flush()['metrics']
+        counters, gauges = metrics['counter'], metrics['gauge']
+        assert_that(counters['C|nginx.http.status.2xx||0'][0][1], equal_to(2))
+        assert_that(counters['C|nginx.http.status.2xx||other'][0][1], equal_to(2))
+        assert_that(counters, has_length(4))
+        assert_that(gauges, has_key('G|system.disk.free|other'))
+        assert_that(gauges, has_key('G|status'))
+        assert_that(gauges['G|statsd.series.overflow'][0][1], equal_to(3))
+        assert_that(gauges, is_not(has_key('G|statsd.series.dropped')))
+
+        # the budget is per push
+        statsd.incr('nginx.http.status.2xx||4')
+        metrics = statsd.flush()['metrics']
+        assert_that(metrics['counter'], has_key('C|nginx.http.status.2xx||4'))
+        assert_that(metrics, is_not(has_key('gauge')))
+
+    def test_max_series_without_dimensions(self):
+        statsd = StatsdClient(object=self.fake_object, max_series=10)
+        for i in xrange(10000):
+            statsd.incr('app.metric%s' % i)
+
+        # names over the limit have no overflow series, their values are dropped
+        counters = statsd.current['counter']
+        assert_that(counters, has_length(10))
+        assert_that(len(statsd.over_names), less_than_or_equal_to(statsd.max_tracked_drops))
+
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|statsd.series.dropped'][0][1], equal_to(9990))
+
+    def test_max_overflow_series(self):
+        statsd = StatsdClient(object=self.fake_object, max_series=1)
+        statsd.max_overflow_series = 2
+        for i in xrange(5):
+            statsd.incr('app.metric%s||1' % i)
+
+        counters = statsd.current['counter']
+        assert_that(counters, has_key('app.metric0||1'))
+        assert_that(counters, has_key('app.metric1||other'))
+        assert_that(counters, has_key('app.metric2||other'))
+        assert_that(counters, has_length(3))
+
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|statsd.series.overflow'][0][1], equal_to(2))
+        assert_that(gauges['G|statsd.series.dropped'][0][1], equal_to(2))
+
+    def test_overflow_metrics_not_mixed(self):
+        statsd = StatsdClient(object=self.fake_object, max_series=1)
+        statsd.max_overflow_series = 2
+        statsd.gauge('system.disk.free|/', 1)
+        for mount, free, used in (('/mnt', 10, 1000), ('/data', 20, 2000)):
+            statsd.gauge('system.disk.free|%s' % mount, free)
+            statsd.gauge('system.disk.used|%s' % mount, used)
+        statsd.gauge('system.disk.total|/mnt', 5000)  # no overflow series left for it
+        statsd.gauge('system.load', 5)
+
+        gauges = statsd.flush()['metrics']['gauge']
+        assert_that(gauges['G|system.disk.free|/'][0][1], equal_to(1))
+        assert_that(gauges['G|system.disk.free|other'][0][1], equal_to(15))
+        assert_that(gauges['G|system.disk.used|other'][0][1], equal_to(1500))
+        assert_that(gauges, is_not(has_key('G|system.disk.total|other')))
+        assert_that(gauges, is_not(has_key('G|system.load')))
+        assert_that(gauges['G|statsd.series.overflow'][0][1], equal_to(4))
+        assert_that(gauges['G|statsd.series.dropped'][0][1], equal_to(2))
+
+    def test_max_samples(self):
+        statsd = StatsdClient(object=self.fake_object, max_samples=100)
+        statsd.timers('nginx.http.request.time', [0.5] * 90)
+        statsd.averages('nginx.http.gzip.ratio', [2.0] * 10)
+        statsd.timers('nginx.upstream.response.time', [0.1] * 30)
+
+        # every list is halved, the counts of timers stay the same
+        assert_that(statsd.samples, less_than_or_equal_to(100))
+        metrics = statsd.flush()['metrics']
+        timers = metrics['timer']
+        assert_that(timers['C|nginx.http.request.time.count'][0][1], equal_to(90))
+        assert_that(timers['C|nginx.upstream.response.time.count'][0][1], equal_to(30))
+        assert_that(timers['G|nginx.http.request.time'][0][1], equal_to(0.5))
+        assert_that(metrics['average']['G|nginx.http.gzip.ratio'][0][1], equal_to(2.0))
+        assert_that(metrics['gauge']['G|statsd.samples.dropped'][0][1], equal_to(45 + 5 + 15))
+
+    def test_coarse_clock(self):
+        statsd = StatsdClient(object=self.fake_object)
+        clock.now = 1000
+        statsd.incr('nginx.http.status.2xx')
+        statsd.gauge('nginx.workers.count', 4)
+        statsd.agent('status', 1)
+
+        # samples are stamped with the last tick
+        assert_that(statsd.current['counter']['nginx.http.status.2xx'], equal_to([[1000, 1]]))
+        assert_that(statsd.current['gauge']['nginx.workers.count'], equal_to([(1000, 4)]))
+        assert_that(statsd.current['gauge']['status'], equal_to([(1000, 1)]))
+
+        # flush ticks the clock
+        clock.tick()
+        assert_that(clock.now, greater_than(1000))
+
+    def test_coarse_clock_per_greenlet(self):
+        statsd = StatsdClient(object=self.fake_object)
+        clock.tick(1000)
+
+        def collect(stamp):
+            clock.tick(stamp)
+            gevent.sleep(0)  # let the other collector tick in the middle of the cycle
+            statsd.incr('stamp.%s' % stamp)
+
+        gevent.joinall([gevent.spawn(collect, 2000), gevent.spawn(collect, 3000)])
+
+        # every collector stamps its samples with its own ticks only
+        assert_that(statsd.current['counter']['stamp.2000'], equal_to([[2000, 1]]))
+        assert_that(statsd.current['counter']['stamp.3000'], equal_to([[3000, 1]]))
+        assert_that(clock.now, equal_to(1000))
+
+    def test_metric_keys(self):
+        counter_keys = MetricKeys('C|')
+        counter = counter_keys['nginx.http.status.2xx']
+        assert_that(counter, equal_to('C|nginx.http.status.2xx'))
+        assert_that(counter_keys['nginx.http.status.2xx'], same_instance(counter))
+
+        timer_keys = TimerKeys(TimerOptions(buckets={'*': (0.5,)}))
+        average, count, maximum, percentiles, buckets = timer_keys['nginx.http.request.time']
+        assert_that(average, equal_to('G|nginx.http.request.time'))
+        assert_that(count, equal_to('C|nginx.http.request.time.count'))
+        assert_that(maximum, equal_to('G|nginx.http.request.time.max'))
+        assert_that(percentiles, equal_to([
+            (50.0, 'G|nginx.http.request.time.median'), (95.0, 'G|nginx.http.request.time.pctl95')
+        ]))
+        assert_that(buckets, equal_to([(0.5, 'C|nginx.http.request.time.le_0_5')]))
+
+        # the registry doesn't grow without limit
+        counter_keys.max_size = 2
+        counter_keys['one']
+        counter_keys['two']
+        assert_that(counter_keys, has_length(1))
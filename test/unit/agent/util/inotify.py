@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from hamcrest import *
+
+from test.base import BaseTestCase, NginxCollectorTestCase
+from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
+from amplify.agent.util.inotify import InotifyFileWatcher, PollingFileWatcher, file_watcher
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class InotifyTestCase(BaseTestCase):
+    test_log = 'log/watched.log'
+    test_log_rotated = 'log/watched.log.rotated'
+
+    def setup_method(self, method):
+        super(InotifyTestCase, self).setup_method(method)
+        self.write_log('start')
+
+    def teardown_method(self, method):
+        for filename in (self.test_log, self.test_log_rotated):
+            if os.path.exists(filename):
+                os.remove(filename)
+        super(InotifyTestCase, self).teardown_method(method)
+
+    def write_log(self, line):
+        with open(self.test_log, 'a') as f:
+            f.write('%s\n' % line)
+
+    def test_best_watcher(self):
+        watcher = file_watcher(self.test_log)
+        assert_that(watcher, instance_of(InotifyFileWatcher))
+        watcher.close()
+
+    def test_idle(self):
+        watcher = InotifyFileWatcher(self.test_log)
+        start = time.time()
+        assert_that(watcher.wait(0.2), equal_to(False))
+        assert_that(time.time() - start, greater_than_or_equal_to(0.2))
+        watcher.close()
+
+    def test_modify(self):
+        watcher = InotifyFileWatcher(self.test_log)
+        self.write_log('something')
+
+        start = time.time()
+        assert_that(watcher.wait(5.0), equal_to(True))
+        assert_that(time.time() - start, less_than(1.0))
+
+        # events are consumed
+        assert_that(watcher.wait(0.1), equal_to(False))
+        watcher.close()
+
+    def test_rotate(self):
+        watcher = InotifyFileWatcher(self.test_log)
+
+        os.rename(self.test_log, self.test_log_rotated)
+        assert_that(watcher.wait(1.0), equal_to(True))
+
+        # new file is created and then written
+        self.write_log('from a new file')
+        assert_that(watcher.wait(1.0), equal_to(True))
+        watcher.wait(0.1)
+
+        self.write_log('one more line')
+        assert_that(watcher.wait(1.0), equal_to(True))
+        watcher.close()
+
+    def test_polling(self):
+        watcher = PollingFileWatcher(self.test_log)
+        start = time.time()
+        assert_that(watcher.wait(0.1), equal_to(False))
+        assert_that(time.time() - start, greater_than_or_equal_to(0.1))
+
+
+class LogsCollectorWatchTestCase(NginxCollectorTestCase):
+    test_log = 'log/watched.log'
+
+    def setup_method(self, method):
+        super(LogsCollectorWatchTestCase, self).setup_method(method)
+        open(self.test_log, 'w').close()
+
+    def teardown_method(self, method):
+        if os.path.exists(self.test_log):
+            os.remove(self.test_log)
+        super(LogsCollectorWatchTestCase, self).teardown_method(method)
+
+    def test_polling_interval(self):
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, interval=0.2, filename=self.test_log, watch=True, min_delay=1.0
+        )
+        collector.watcher.close()
+        collector.watcher = PollingFileWatcher(self.test_log)
+
+        # polling waits for the interval only, without the batch delay
+        start = time.time()
+        collector._sleep()
+        assert_that(time.time() - start, all_of(greater_than_or_equal_to(0.2), less_than(1.0)))
+
+    def test_watcher_closed(self):
+        collector = NginxAccessLogsCollector(
+            object=self.fake_object, interval=0.1, filename=self.test_log, watch=True
+        )
+        watcher = collector.watcher
+        assert_that(watcher, instance_of(InotifyFileWatcher))
+
+        # the object is not running, so the collector stops at once
+        collector.run()
+        assert_that(collector.watcher, equal_to(None))
+        assert_that(watcher.fd, equal_to(None))
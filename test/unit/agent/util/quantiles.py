@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import random
+
+from hamcrest import *
+
+from test.base import BaseTestCase
+from amplify.agent.util import quantiles
+from amplify.agent.util.quantiles import nearest_rank, select
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class QuantilesTestCase(BaseTestCase):
+
+    def test_nearest_rank(self):
+        assert_that(nearest_rank(1, 50), equal_to(0))
+        assert_that(nearest_rank(1, 95), equal_to(0))
+        assert_that(nearest_rank(3, 50), equal_to(1))
+        assert_that(nearest_rank(4, 50), equal_to(1))
+        assert_that(nearest_rank(5, 95), equal_to(4))
+        assert_that(nearest_rank(100, 95), equal_to(94))
+        assert_that(nearest_rank(1000, 99.9), equal_to(998))
+        assert_that(nearest_rank(10, 0), equal_to(0))
+        assert_that(nearest_rank(10, 100), equal_to(9))
+
+    def test_select_equals_sort(self):
+        rnd = random.Random(0)
+        threshold = quantiles.SORT_THRESHOLD
+        quantiles.SORT_THRESHOLD = 50  # partition small lists too
+        try:
+            for length in (1, 7, 100, 5000):
+                # with a lot of duplicates
+                values = [round(rnd.expovariate(20), 2) for _ in xrange(length)]
+                ranks = [nearest_rank(length, p) for p in (0, 50, 90, 95, 99, 99.9, 100)]
+
+                ordered = sorted(values)
+                original = list(values)
+                selected = select(values, ranks, rnd)
+
+                assert_that(selected, equal_to(dict((rank, ordered[rank]) for rank in ranks)))
+                assert_that(values, equal_to(original))
+        finally:
+            quantiles.SORT_THRESHOLD = threshold
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from hamcrest import *
+
+from test.base import BaseTestCase
+from amplify.agent.util.sampling import AdaptiveSampler
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class AdaptiveSamplerTestCase(BaseTestCase):
+
+    def test_rate(self):
+        sampler = AdaptiveSampler(max_time=10.0, max_rate=8)
+        assert_that(sampler.update(1.0), equal_to(1))
+
+        # grows while the limit is exceeded, but not over the max rate
+        assert_that(sampler.update(20.0), equal_to(2))
+        assert_that(sampler.update(20.0), equal_to(4))
+        assert_that(sampler.update(20.0), equal_to(8))
+        assert_that(sampler.update(20.0), equal_to(8))
+
+        # stays between the half of the limit and the limit
+        assert_that(sampler.update(7.0), equal_to(8))
+
+        # goes back when the time is low
+        assert_that(sampler.update(1.0), equal_to(4))
+        assert_that(sampler.update(1.0), equal_to(2))
+        assert_that(sampler.update(1.0), equal_to(1))
+        assert_that(sampler.update(1.0), equal_to(1))
+
+    def test_recovery(self):
+        """
+        Traffic stays high all along, the rate follows the cost of processing it
+        """
+        sampler = AdaptiveSampler(max_time=10.0, max_rate=64)
+        lines = 1000000
+
+        def run(cost, cycles=10):
+            duration = 0.0
+            for _ in xrange(cycles):
+                rate = sampler.update(duration)
+                duration = cost * lines / rate
+            return rate
+
+        # 25s to parse all the lines, sampling brings a cycle under 10s and keeps it there
+        assert_that(run(cost=0.000025), equal_to(4))
+
+        # parsing gets cheaper (e.g. fewer filters), the rate goes back down
+        assert_that(run(cost=0.000008), equal_to(1))
+
+        # and up again
+        assert_that(run(cost=0.0001), equal_to(16))
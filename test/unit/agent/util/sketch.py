@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import random
+
+from hamcrest import *
+
+from test.base import BaseTestCase
+from amplify.agent.util.sketch import DDSketch, SpaceSaving
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class SpaceSavingTestCase(BaseTestCase):
+
+    def test_exact_under_capacity(self):
+        sketch = SpaceSaving(10)
+        for key in ('a', 'b', 'a', 'c', 'a', 'b'):
+            sketch.add(key, errors=1 if key == 'b' else 0, time=0.5)
+
+        assert_that(sketch.top(2), equal_to([('a', 3, 0, 1.5), ('b', 2, 2, 1.0)]))
+        assert_that(sketch.top(10), has_length(3))
+
+    def test_heavy_hitters(self):
+        rnd = random.Random(0)
+        sketch = SpaceSaving(50)
+
+        # a few heavy keys in a stream of thousands of unique ones
+        heavy = ['/heavy/%s' % i for i in xrange(5)]
+        for i in xrange(20000):
+            key = rnd.choice(heavy) if i % 4 == 0 else '/unique/%s' % i
+            sketch.add(key)
+
+        assert_that(len(sketch), equal_to(50))
+        assert_that(len(sketch.heap), less_than_or_equal_to(4 * 50))
+        assert_that(sorted(key for key, _, _, _ in sketch.top(5)), equal_to(heavy))
+
+        # counts are upper bounds
+        for key, count, _, _ in sketch.top(5):
+            assert_that(count, greater_than_or_equal_to(800))
+
+    def test_merge(self):
+        first, second = SpaceSaving(10), SpaceSaving(10)
+        first.add('a', 2, 1, 1.0)
+        second.add('a', 3, 0, 2.0)
+        second.add('b')
+
+        first.merge(second)
+        assert_that(first.top(2), equal_to([('a', 5, 1, 3.0), ('b', 1, 0, 0.0)]))
+
+        first.reset()
+        assert_that(first.top(2), equal_to([]))
+
+
+class DDSketchTestCase(BaseTestCase):
+
+    def test_relative_accuracy(self):
+        rnd = random.Random(0)
+        values = [rnd.lognormvariate(-3, 1.5) for _ in xrange(20000)]
+        sketch = DDSketch(accuracy=0.01)
+        sketch.update(values)
+
+        values.sort()
+        for q in (0.1, 0.5, 0.9, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert_that(abs(sketch.quantile(q) - exact), less_than_or_equal_to(exact * 0.01 + 1e-12))
+
+        assert_that(sketch.count, equal_to(len(values)))
+        assert_that(sketch.max, equal_to(values[-1]))
+        assert_that(sketch.sum, close_to(sum(values), 1e-6))
+
+    def test_zeros(self):
+        sketch = DDSketch()
+        sketch.update([0.0, 0.0, 0.0, 1.0])
+        assert_that(sketch.quantile(0.5), equal_to(0.0))
+        assert_that(sketch.quantile(1.0), close_to(1.0, 0.01))
+        assert_that(DDSketch().quantile(0.5), equal_to(None))
+
+    def test_merge(self):
+        rnd = random.Random(1)
+        values = [rnd.expovariate(10) for _ in xrange(5000)]
+
+        whole, first, second = DDSketch(), DDSketch(), DDSketch()
+        whole.update(values)
+        first.update(values[:1000])
+        second.update(values[1000:])
+        first.merge(second)
+
+        assert_that(first.bins, equal_to(whole.bins))
+        assert_that(first.count, equal_to(whole.count))
+        assert_that(first.min, equal_to(whole.min))
+        assert_that(first.max, equal_to(whole.max))
+        assert_that(calling(first.merge).with_args(DDSketch(accuracy=0.05)), raises(ValueError))
+
+    def test_max_bins(self):
+        values = [10 ** (i / 100.0) for i in xrange(-600, 600)]
+        sketch = DDSketch(accuracy=0.01, max_bins=100)
+        sketch.update(values)
+
+        # only the lowest quantiles are collapsed
+        assert_that(sketch.bins, has_length(100))
+        exact = values[int(0.99 * (len(values) - 1))]
+        assert_that(sketch.quantile(0.99), close_to(exact, exact * 0.01))
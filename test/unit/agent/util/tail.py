@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 
 from hamcrest import *
 
 from test.base import BaseTestCase
-from amplify.agent.util.tail import FileTail
+from amplify.agent.util import tail as tail_module
+from amplify.agent.util.tail import FileTail, TailOffsets
 
 __author__ = "Mike Belov"
 __copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
@@ -63,7 +65,7 @@ class TailTestCase(BaseTestCase):
         assert_that(new_lines, has_length(1))
         assert_that(new_lines, equal_to(['from a new file']))
 
-    def test_lose_changes_while_rotate(self):
+    def test_no_changes_lost_while_rotate(self):
         tail = FileTail(filename=self.test_log)
 
         # write something
@@ -77,8 +79,49 @@ class TailTestCase(BaseTestCase):
 
         # read tail and get two lines
         new_lines = tail.readlines()
-        assert_that(new_lines, has_length(1))
-        assert_that(new_lines, equal_to(['from a new file']))
+        assert_that(new_lines, has_length(2))
+        assert_that(new_lines, equal_to(['from the old file', 'from a new file']))
+
+    def test_write_to_moved_file(self):
+        tail = FileTail(filename=self.test_log)
+
+        # rotate it, but nginx still writes to the old file
+        os.rename(self.test_log, self.test_log_rotated)
+        os.system('echo "to the old file" >> %s' % self.test_log_rotated)
+
+        # no new file yet
+        assert_that(tail.readlines(), equal_to(['to the old file']))
+        assert_that(tail.readlines(), has_length(0))
+
+        # log was reopened
+        tail._next_check = 0
+        self.write_log("from a new file")
+        assert_that(tail.readlines(), equal_to(['from a new file']))
+
+    def test_missing_file_backoff(self):
+        tail = FileTail(filename=self.test_log)
+        os.remove(self.test_log)
+
+        start = time.time()
+        assert_that(tail.readlines(), has_length(0))
+        assert_that(time.time() - start, less_than(1.0))
+
+        # no new stat calls until backoff is over
+        first_check = tail._next_check
+        assert_that(tail.readlines(), has_length(0))
+        assert_that(tail._next_check, equal_to(first_check))
+
+    def test_copytruncate(self):
+        tail = FileTail(filename=self.test_log)
+        self.write_log("before truncate")
+        assert_that(tail.readlines(), equal_to(['before truncate']))
+
+        # copy and truncate
+        with open(self.test_log, 'w'):
+            pass
+
+        self.write_log("after")
+        assert_that(tail.readlines(), equal_to(['after']))
 
     def test_no_new_lines(self):
         # check one new line
@@ -96,3 +139,136 @@ class TailTestCase(BaseTestCase):
         self.write_log('something')
         new_lines = tail.readlines()
         assert_that(new_lines, has_length(1))
+
+
+class BulkTailTestCase(TailTestCase):
+
+    def test_read_new_lines(self):
+        tail = FileTail(filename=self.test_log, bulk=True)
+
+        # write messages and read them
+        for i in xrange(10):
+            line = "this is %s line" % i
+            self.write_log(line)
+            new_lines = tail.readlines()
+            assert_that(new_lines, has_length(1))
+            assert_that(new_lines.pop(), equal_to(line))
+
+    def test_rotate(self):
+        tail = FileTail(filename=self.test_log, bulk=True)
+
+        # rotate it
+        os.rename(self.test_log, self.test_log_rotated)
+
+        # write something in a new one
+        self.write_log("from a new file")
+
+        # read tail and get two lines
+        new_lines = tail.readlines()
+        assert_that(new_lines, has_length(1))
+        assert_that(new_lines, equal_to(['from a new file']))
+
+    def test_lines_across_chunks(self):
+        tail = FileTail(filename=self.test_log, bulk=True, chunk_size=16)
+
+        lines = ['this is a pretty long line number %s' % i for i in xrange(100)]
+        with open(self.test_log, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        assert_that(tail.readlines(), equal_to(lines))
+        assert_that(tail.readlines(), has_length(0))
+
+    def test_incomplete_line(self):
+        tail = FileTail(filename=self.test_log, bulk=True)
+
+        with open(self.test_log, 'a') as f:
+            f.write('first line\nsecond ')
+
+        # incomplete line should wait for its end
+        assert_that(tail.readlines(), equal_to(['first line']))
+
+        with open(self.test_log, 'a') as f:
+            f.write('line\n')
+
+        assert_that(tail.readlines(), equal_to(['second line']))
+
+    def test_rotation_checked_once_per_chunk(self):
+        tail = FileTail(filename=self.test_log, bulk=True)
+
+        with open(self.test_log, 'a') as f:
+            f.write(''.join('line %s\n' % i for i in xrange(1000)))
+
+        stat_calls = []
+        original_stat = tail_module.stat
+
+        def counting_stat(filename):
+            stat_calls.append(filename)
+            return original_stat(filename)
+
+        tail_module.stat = counting_stat
+        try:
+            new_lines = tail.readlines()
+        finally:
+            tail_module.stat = original_stat
+
+        assert_that(new_lines, has_length(1000))
+        assert_that(len(stat_calls), less_than(5))
+
+
+class TailOffsetsTestCase(TailTestCase):
+    test_offsets = 'log/tail.offsets'
+
+    def teardown_method(self, method):
+        if os.path.exists(self.test_offsets):
+            os.remove(self.test_offsets)
+        super(TailOffsetsTestCase, self).teardown_method(method)
+
+    def test_resume(self):
+        offsets = TailOffsets()
+        tail = FileTail(filename=self.test_log, bulk=True, offsets=offsets)
+        self.write_log('first')
+        assert_that(tail.readlines(), equal_to(['first']))
+
+        # lines written while there was no tail
+        self.write_log('second')
+        self.write_log('third')
+
+        tail = FileTail(filename=self.test_log, bulk=True, offsets=offsets)
+        assert_that(tail.readlines(), equal_to(['second', 'third']))
+
+    def test_save_and_load(self):
+        offsets = TailOffsets(filename=self.test_offsets)
+        tail = FileTail(filename=self.test_log, offsets=offsets)
+        self.write_log('first')
+        tail.readlines()
+        offsets.save()
+
+        self.write_log('second')
+
+        offsets = TailOffsets(filename=self.test_offsets)
+        offsets.load()
+        tail = FileTail(filename=self.test_log, offsets=offsets)
+        assert_that(tail.readlines(), equal_to(['second']))
+
+    def test_max_catchup(self):
+        offsets = TailOffsets(max_catchup=20)
+        tail = FileTail(filename=self.test_log, bulk=True, offsets=offsets)
+        tail.readlines()
+
+        for i in xrange(10):
+            self.write_log('line number %s' % i)
+
+        # the first line in the catchup window is incomplete and should be skipped
+        tail = FileTail(filename=self.test_log, bulk=True, offsets=offsets)
+        assert_that(tail.readlines(), equal_to(['line number 9']))
+
+    def test_rotated_while_stopped(self):
+        offsets = TailOffsets()
+        tail = FileTail(filename=self.test_log, offsets=offsets)
+        tail.readlines()
+
+        os.rename(self.test_log, self.test_log_rotated)
+        self.write_log('from a new file')
+
+        tail = FileTail(filename=self.test_log, offsets=offsets)
+        assert_that(tail.readlines(), equal_to(['from a new file']))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+
+import gevent
+from hamcrest import *
+
+from test.base import BaseTestCase
+from amplify.agent.errors import AmplifyWorkerError
+from amplify.agent.util.workers import WorkerPool
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev", "Grant Hulegaard"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+def get_pid(value):
+    return os.getpid(), value
+
+
+def fail():
+    raise ValueError('oops')
+
+
+def die():
+    os._exit(1)
+
+
+class WorkerPoolTestCase(BaseTestCase):
+
+    def setup_method(self, method):
+        super(WorkerPoolTestCase, self).setup_method(method)
+        self.pool = WorkerPool(2)
+
+    def teardown_method(self, method):
+        self.pool.stop()
+        super(WorkerPoolTestCase, self).teardown_method(method)
+
+    def test_call(self):
+        pid, value = self.pool.call(get_pid, 'value')
+        assert_that(value, equal_to('value'))
+        assert_that(pid, is_not(equal_to(os.getpid())))
+
+    def test_parallel_calls(self):
+        greenlets = [gevent.spawn(self.pool.call, get_pid, i) for i in xrange(10)]
+        gevent.joinall(greenlets)
+
+        results = [greenlet.value for greenlet in greenlets]
+        assert_that([value for pid, value in results], equal_to(range(10)))
+        assert_that(set(pid for pid, value in results), has_length(2))
+
+    def test_exception(self):
+        assert_that(calling(self.pool.call).with_args(fail), raises(AmplifyWorkerError))
+
+        # worker is still usable
+        assert_that(self.pool.call(get_pid, 1)[1], equal_to(1))
+
+    def test_dead_worker_is_replaced(self):
+        assert_that(calling(self.pool.call).with_args(die), raises(AmplifyWorkerError))
+
+        assert_that(self.pool.workers, has_length(2))
+        for worker in self.pool.workers:
+            assert_that(worker.alive(), equal_to(True))
+        assert_that(self.pool.call(get_pid, 1)[1], equal_to(1))
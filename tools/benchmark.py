@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+from optparse import OptionParser, Option
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import BENCHMARKS
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+usage = "usage: %prog [-n LINES] [benchmark ...]"
+
+option_list = (
+    Option(
+        '-n', '--lines',
+        action='store',
+        dest='lines',
+        type='int',
+        help='Number of log lines per run (50000 by default)',
+        default=50000,
+    ),
+    Option(
+        '-r', '--repeat',
+        action='store',
+        dest='repeat',
+        type='int',
+        help='Number of runs, the best one is reported (3 by default)',
+        default=3,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+if __name__ == '__main__':
+    names = args or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %s, available: %s' % (name, ', '.join(sorted(BENCHMARKS))))
+
+    for name in names:
+        print '== %s' % name
+        __import__('benchmarks.%s' % BENCHMARKS[name], fromlist=['run']).run(options)
+        print
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+# benchmark name -> module in this package
+BENCHMARKS = {
+    'accesslog': 'accesslog',
+    'collector': 'collector',
+    'errorlog': 'errorlog',
+    'filters': 'filters',
+    'statsd': 'statsd',
+    'statsd_keys': 'statsd_keys',
+    'statsd_listener': 'statsd_listener',
+}
+
+
+def measure(func, items, repeat=3):
+    """
+    Runs func for every item several times
+
+    :param func: function to call
+    :param items: list of arguments for func
+    :param repeat: int number of runs
+    :return: float best time per item in microseconds
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for item in items:
+            func(item)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000000.0 / max(len(items), 1)
+
+
+def report(name, per_item, baseline=None):
+    """
+    Prints a result line
+
+    :param name: str what was measured
+    :param per_item: float microseconds per item
+    :param baseline: float microseconds per item of the baseline implementation
+    """
+    line = '%-40s %8.2f us/line %10d lines/s' % (name, per_item, 1000000.0 / per_item if per_item else 0)
+    if baseline:
+        line += '  x%.2f' % (baseline / per_item)
+    print line
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import random
+
+from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
+from amplify.agent.nginx.log.access import NginxAccessLogParser
+
+from benchmarks import measure, report
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# a wide format with 25 variables, close to what heavy users have
+WIDE_FORMAT = \
+    '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" ' + \
+    '"$http_user_agent" "$http_x_forwarded_for" $host $server_name $server_port $scheme $request_length ' + \
+    '$bytes_sent $connection $connection_requests $pipe $gzip_ratio rt=$request_time ' + \
+    'ua="$upstream_addr" us="$upstream_status" ut="$upstream_response_time" ' + \
+    'uct="$upstream_connect_time" cs=$upstream_cache_status'
+
+# a strictly delimited format, parsed with split
+TAB_FORMAT = '\t'.join([
+    '$remote_addr', '$time_local', '$request', '$status', '$body_bytes_sent', '$http_referer', '$http_user_agent',
+    '$request_time', '$upstream_addr', '$upstream_status', '$upstream_response_time', '$upstream_cache_status'
+])
+
+# log_format escape=json with the same variables as TAB_FORMAT
+JSON_KEYS = [key[1:] for key in TAB_FORMAT.split('\t')]
+JSON_FORMAT = '{%s}' % ', '.join('"%s": "$%s"' % (key, key) for key in JSON_KEYS)
+
+METHODS = ['GET', 'GET', 'GET', 'POST', 'HEAD', 'PUT']
+STATUSES = ['200', '200', '200', '200', '301', '304', '404', '500', '502']
+URIS = ['/', '/index.html', '/api/v1/items?id=%d', '/static/app.js', '/img/%d.png', '/login']
+AGENTS = [
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/47.0',
+    'curl/7.35.0',
+    'python-requests/2.2.1 CPython/2.7.6 Linux/3.13.0-48-generic',
+]
+
+
+def combined_line(rnd):
+    return '%s - - [27/Jan/2016:12:30:04 -0800] "%s %s HTTP/1.1" %s %d "-" "%s"' % (
+        '10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(0, 255)),
+        rnd.choice(METHODS),
+        rnd.choice(URIS).replace('%d', str(rnd.randint(0, 1000))),
+        rnd.choice(STATUSES),
+        rnd.randint(0, 100000),
+        rnd.choice(AGENTS)
+    )
+
+
+def wide_line(rnd):
+    return combined_line(rnd) + \
+        ' "-" example.com example.com 443 https %d %d %d %d . %s rt=%.3f ua="10.0.0.%d:80" us="%s" ut="%.3f" ' \
+        'uct="%.3f" cs=%s' % (
+            rnd.randint(100, 2000), rnd.randint(100, 100000), rnd.randint(1, 100000), rnd.randint(1, 100),
+            rnd.choice(['-', '2.51']), rnd.random(), rnd.randint(1, 5), rnd.choice(STATUSES), rnd.random(),
+            rnd.random() / 10, rnd.choice(['HIT', 'MISS', '-'])
+        )
+
+
+def tab_line(rnd):
+    return '\t'.join([
+        '10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(0, 255)),
+        '27/Jan/2016:12:30:04 -0800',
+        '%s %s HTTP/1.1' % (rnd.choice(METHODS), rnd.choice(URIS).replace('%d', str(rnd.randint(0, 1000)))),
+        rnd.choice(STATUSES),
+        str(rnd.randint(0, 100000)),
+        '-',
+        rnd.choice(AGENTS),
+        '%.3f' % rnd.random(),
+        '10.0.0.%d:80' % rnd.randint(1, 5),
+        rnd.choice(STATUSES),
+        '%.3f' % rnd.random(),
+        rnd.choice(['HIT', 'MISS', '-'])
+    ])
+
+
+def json_line(rnd):
+    values = tab_line(rnd).split('\t')
+    return '{%s}' % ', '.join('"%s": "%s"' % (key, value) for key, value in zip(JSON_KEYS, values))
+
+
+def run(options):
+    rnd = random.Random(0)
+    for name, log_format, make_line in (
+        ('combined', None, combined_line),
+        ('wide (25 vars)', WIDE_FORMAT, wide_line),
+        ('tab-separated', TAB_FORMAT, tab_line),
+        ('json', JSON_FORMAT, json_line),
+    ):
+        lines = [make_line(rnd) for _ in xrange(options.lines)]
+        parser = NginxAccessLogParser(log_format)
+
+        generic = measure(parser.parse_generic, lines, options.repeat)
+        report('%s: generic' % name, generic)
+        report('%s: compiled' % name, measure(parser.parse, lines, options.repeat), baseline=generic)
+
+        # the same projection as the collector without filters makes
+        fields = set(NginxAccessLogsCollector.counters.itervalues()) | NginxAccessLogsCollector.fields
+        fields.update(key for key in parser.keys if key.startswith('upstream'))
+        parser.project(fields)
+        report('%s: compiled, projected' % name, measure(parser.parse, lines, options.repeat), baseline=generic)
+
+        batch_size = 10000
+        batches = [lines[i:i + batch_size] for i in xrange(0, len(lines), batch_size)]
+        per_line = measure(parser.parse_batch, batches, options.repeat) * len(batches) / len(lines)
+        report('%s: batch, projected' % name, per_line, baseline=generic)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import random
+
+from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
+from amplify.agent.statsd import StatsdBuffer, StatsdClient
+from amplify.agent.util.workers import WorkerPool
+
+from benchmarks import measure, report
+from benchmarks.accesslog import WIDE_FORMAT, TAB_FORMAT, combined_line, wide_line, tab_line
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+class FakeObject(object):
+    """
+    Just enough of an nginx object for an access log collector
+    """
+    id = 'benchmark'
+    definition = {}
+    filters = []
+    metad = eventd = configd = None
+
+    def __init__(self):
+        self.statsd = StatsdClient(object=self)
+
+
+def run(options):
+    rnd = random.Random(0)
+    for name, log_format, make_line in (
+        ('combined', None, combined_line),
+        ('wide (25 vars)', WIDE_FORMAT, wide_line),
+        ('tab-separated', TAB_FORMAT, tab_line),
+    ):
+        lines = [make_line(rnd) for _ in xrange(options.lines)]
+        collector = NginxAccessLogsCollector(object=FakeObject(), log_format=log_format, tail=[])
+
+        # counting of already parsed lines with the per-line extractors, directly and through a cycle buffer
+        parsed = [collector.parser.parse(line) for line in lines]
+        per_line = measure(collector.count_line, parsed, options.repeat)
+        report('%s: %s' % (name, collector.count_line.__name__), per_line)
+        collector.statsd.flush()
+
+        statsd, collector.statsd = collector.statsd, StatsdBuffer()
+        per_line_buffered = measure(collector.count_line, parsed, options.repeat)
+        report('%s: %s (buffer)' % (name, collector.count_line.__name__), per_line_buffered, baseline=per_line)
+        collector.statsd = statsd
+
+        baseline = None
+        for method in (collector.collect_lines, collector.collect_batches):
+            per_line = measure(method, [lines], options.repeat) / len(lines)
+            report('%s: %s' % (name, method.__name__), per_line, baseline=baseline)
+            baseline = baseline or per_line
+            collector.statsd.flush()
+
+        # the same with the heavy hitters of request uris
+        uri_collector = NginxAccessLogsCollector(object=FakeObject(), log_format=log_format, tail=[], top_uris=10)
+        per_line = measure(uri_collector.collect_batches, [lines], options.repeat) / len(lines)
+        report('%s: %s (top uris)' % (name, uri_collector.collect_batches.__name__), per_line, baseline=baseline)
+
+        workers = 1
+        while workers <= multiprocessing.cpu_count():
+            collector.workers = WorkerPool(workers)
+            per_line = measure(collector.collect_in_workers, [lines], options.repeat) / len(lines)
+            report('%s: %s workers' % (name, workers), per_line, baseline=baseline)
+            collector.workers.stop()
+            collector.statsd.flush()
+            workers *= 2
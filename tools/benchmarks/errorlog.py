@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import random
+import re
+
+from amplify.agent.nginx.log.error import NginxErrorLogParser, error_re
+
+from benchmarks import measure, report
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# messages without upstream errors, the most of a real error log
+COMMON_MESSAGES = [
+    ('error', 'open() "/usr/share/nginx/html/favicon.ico" failed (2: No such file or directory)'),
+    ('info', 'client 10.196.158.41 closed keepalive connection'),
+    ('info', 'client timed out (110: Connection timed out) while waiting for request'),
+    ('error', 'access forbidden by rule'),
+    ('notice', 'signal process started'),
+    ('warn', 'a client request body is buffered to a temporary file /var/cache/nginx/client_temp/0000000001'),
+]
+
+UPSTREAM_MESSAGES = [
+    ('error', 'connect() failed (111: Connection refused) while connecting to upstream'),
+    ('error', 'upstream timed out (110: Connection timed out) while reading response header from upstream'),
+    ('error', 'no live upstreams while connecting to upstream'),
+    ('error', 'upstream prematurely closed connection while reading response header from upstream'),
+    ('warn', 'an upstream response is buffered to a temporary file /var/cache/nginx/proxy_temp/4/08/0000000084 '
+             'while reading upstream'),
+    ('error', 'upstream sent invalid header while reading response header from upstream'),
+]
+
+
+def error_line(rnd, upstream_share=0.1):
+    """
+    Makes an error log line, a share of them is about upstreams
+    """
+    proxied = rnd.random() < upstream_share
+    level, message = rnd.choice(UPSTREAM_MESSAGES if proxied else COMMON_MESSAGES)
+    return '2016/01/27 12:30:04 [%s] 28386#28386: *%d %s, client: 10.0.%d.%d, server: example.com, ' \
+           'request: "GET /api/v1/items?id=%d HTTP/1.1", %shost: "example.com"' % (
+               level, rnd.randint(1, 100000), message, rnd.randint(0, 255), rnd.randint(0, 255),
+               rnd.randint(0, 1000), 'upstream: "http://127.0.0.1:3000/", ' if proxied else ''
+           )
+
+
+def match_all(line):
+    """
+    Previous implementation: all the patterns one by one
+    """
+    for error, regexps in error_re.iteritems():
+        for regexp in regexps:
+            if re.match(regexp, line):
+                return error
+    return None
+
+
+def run(options):
+    rnd = random.Random(0)
+    parser = NginxErrorLogParser()
+
+    for upstream_share in (0.1, 1.0):
+        lines = [error_line(rnd, upstream_share) for _ in xrange(options.lines)]
+        name = '%d%% upstream errors' % (upstream_share * 100)
+
+        baseline = measure(match_all, lines, options.repeat)
+        report('%s: all patterns' % name, baseline)
+        report('%s: classifier' % name, measure(parser.parse, lines, options.repeat), baseline)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import random
+
+from amplify.agent.nginx.filters import Filter, FilterIndex
+from amplify.agent.nginx.log.access import NginxAccessLogParser
+
+from benchmarks import measure, report
+from benchmarks.accesslog import METHODS, STATUSES, URIS, combined_line
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+def make_filters(rnd, count):
+    """
+    Makes filters with one or two predicates, like the ones set up in the UI
+    """
+    predicates = [{'$request_method': method} for method in set(METHODS)] + \
+        [{'$status': status} for status in set(STATUSES)] + \
+        [{'$status': '%s*' % digit} for digit in '2345'] + \
+        [{'$request_uri': uri.replace('%d', '*')} for uri in URIS] + \
+        [{'$request_uri': '*.%s' % ext} for ext in ('png', 'js', 'css', 'html')]
+
+    return [
+        Filter(filter_rule_id=i, metric='nginx.http.status.2xx', data=rnd.sample(predicates, rnd.randint(1, 2)))
+        for i in xrange(count)
+    ]
+
+
+def run(options):
+    rnd = random.Random(0)
+    parser = NginxAccessLogParser()
+    parsed = [parser.parse(combined_line(rnd)) for _ in xrange(options.lines)]
+
+    for count in (10, 50, 100):
+        filters = make_filters(rnd, count)
+        index = FilterIndex(filters)
+
+        def match_one_by_one(data):
+            return [log_filter for log_filter in filters if log_filter.match(data)]
+
+        baseline = measure(match_one_by_one, parsed, options.repeat)
+        report('%s filters: Filter.match' % count, baseline)
+        report('%s filters: FilterIndex.match' % count, measure(index.match, parsed, options.repeat), baseline)
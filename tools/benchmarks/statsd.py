@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+import random
+import resource
+import time
+import ujson
+
+from amplify.agent.statsd import StatsdClient
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# timers of an object with a couple of filters: request, upstream and filtered times
+TIMERS = [
+    'nginx.http.request.time',
+    'nginx.upstream.connect.time',
+    'nginx.upstream.header.time',
+    'nginx.upstream.response.time',
+] + ['nginx.http.request.time||%d' % i for i in xrange(4)]
+
+
+class FakeObject(object):
+    definition = {'type': 'nginx'}
+
+
+def filled_client(rnd, values, timer_accuracy=None):
+    """
+    Makes a StatsdClient with a push interval worth of timer values
+    """
+    client = StatsdClient(object=FakeObject(), timer_accuracy=timer_accuracy)
+    client.context.version = 'benchmark'
+    for metric_name in TIMERS:
+        client.timers(metric_name, [rnd.expovariate(20) for _ in xrange(values)])
+    return client
+
+
+def peak_rss():
+    """
+    :return: int peak RSS of the process in bytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def in_child(func):
+    """
+    Runs func in a child process, so its memory is not affected by the other runs
+
+    :return: result of func
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            elapsed = func()
+            os.write(write_fd, ujson.dumps(elapsed))
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    data = os.read(read_fd, 1024)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return ujson.loads(data)
+
+
+def run(options):
+    def flush(copied, timer_accuracy=None):
+        """
+        Measures the time of a flush and how much it grows the peak RSS over the one of filling the client
+        """
+        def func():
+            client = filled_client(random.Random(0), options.lines, timer_accuracy)
+            peak = peak_rss()
+            start = time.time()
+            if copied:
+                copy.deepcopy(client.current)  # what flush() did before taking the metrics away
+            client.flush()
+            return time.time() - start, peak_rss() - peak
+        return func
+
+    values = len(TIMERS) * options.lines
+    for name, func in (
+        ('deepcopy + flush', flush(True)),
+        ('swap + flush', flush(False)),
+        ('swap + flush (sketch)', flush(False, 0.01)),
+    ):
+        elapsed, growth = in_child(func)
+        print '%-40s %8.1f ms/flush %6.1f MB peak growth  (%d timer values)' % (
+            name, elapsed * 1000, growth / 1048576.0, values
+        )
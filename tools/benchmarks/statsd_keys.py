@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+
+from amplify.agent.containers.nginx.collectors.accesslog import NginxAccessLogsCollector
+from amplify.agent.statsd import MetricKeys, StatsdClient
+from amplify.agent.util.clock import clock
+
+from benchmarks import measure, report
+from benchmarks.statsd import FakeObject
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+# counters of an object with filters and a number of upstream peers
+COUNTERS = [
+    'nginx.http.status.%sxx' % digit for digit in '12345'
+] + [
+    'nginx.upstream.peer.http.status.%sxx||10.0.0.%d:80' % (digit, peer) for digit in '2345' for peer in xrange(20)
+] + [
+    'nginx.http.status.2xx||%d' % i for i in xrange(50)
+]
+
+
+def run(options):
+    rnd = random.Random(0)
+    names = [rnd.choice(COUNTERS) for _ in xrange(options.lines)]
+    statuses = [rnd.choice('22223345') + '00' for _ in xrange(options.lines)]
+
+    # samples: a clock read per sample vs the coarse clock ticked once per cycle
+    client = StatsdClient(object=FakeObject())
+
+    def incr_with_time(metric_name):
+        int(time.time())
+        client.incr(metric_name)
+
+    baseline = measure(incr_with_time, names, options.repeat)
+    report('incr + time()', baseline)
+    clock.tick()
+    report('incr + coarse clock', measure(client.incr, names, options.repeat), baseline)
+
+    # flush: keys formatted every time vs the key registry
+    keys = MetricKeys('C|')
+    baseline = measure('C|%s'.__mod__, names, options.repeat)
+    report('flush key: format', baseline)
+    report('flush key: MetricKeys', measure(keys.__getitem__, names, options.repeat), baseline)
+
+    # per-line names: formatted vs pre-built
+    metrics = NginxAccessLogsCollector.upstream_status_metrics
+    baseline = measure(lambda status: 'nginx.upstream.http.status.%s' % ('%sxx' % status[0]), statuses, options.repeat)
+    report('status name: format', baseline)
+    report('status name: pre-built', measure(lambda status: metrics[status[0]], statuses, options.repeat), baseline)
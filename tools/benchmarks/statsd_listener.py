@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import random
+import re
+
+from amplify.agent.containers.statsd.collectors.listener import parse_packet
+from amplify.agent.statsd import StatsdBuffer
+
+from benchmarks import measure, report
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+
+NAMES = ['app.%s.%s' % (part, metric) for part in ('api', 'web', 'worker', 'db')
+         for metric in ('requests', 'errors', 'latency', 'queue')]
+
+LINE_RE = re.compile(r'^(?P<name>[^:]+):(?P<value>[^|]+)\|(?P<type>[a-z]+)(?:\|@(?P<rate>[\d.]+))?')
+
+
+def statsd_line(rnd):
+    name = rnd.choice(NAMES)
+    if name.endswith('latency'):
+        return '%s:%d|ms' % (name, rnd.randint(1, 2000))
+    elif name.endswith('queue'):
+        return '%s:%d|g' % (name, rnd.randint(0, 100))
+    elif rnd.random() < 0.2:
+        return '%s:1|c|@0.1' % name
+    return '%s:1|c' % name
+
+
+def statsd_packet(rnd, lines):
+    """
+    Makes a datagram of StatsD lines like the ones sent by client libraries with buffering
+    """
+    return '\n'.join(statsd_line(rnd) for _ in xrange(lines))
+
+
+def parse_packet_re(packet, buffer, gauges):
+    """
+    The same parsing with a regex
+    """
+    counters, timer_values, timer_counts = buffer.counters, buffer.timer_values, buffer.timer_counts
+    invalid = 0
+    for line in packet.split('\n'):
+        match = LINE_RE.match(line)
+        if not match:
+            invalid += 1
+            continue
+        name, value, kind, rate = match.group('name', 'value', 'type', 'rate')
+        rate = float(rate) if rate else 1.0
+        number = float(value)
+        if kind == 'c':
+            counters[name] += number / rate
+        elif kind in ('ms', 'h'):
+            timer_values[name].append(number)
+            timer_counts[name] += 1 if rate == 1.0 else int(round(1 / rate))
+        elif kind == 'g':
+            gauges[name] = (number, False)
+    return invalid
+
+
+def run(options):
+    rnd = random.Random(0)
+    packets = [statsd_packet(rnd, 5) for _ in xrange(options.lines // 5)]
+
+    def parser(func):
+        buffer, gauges = StatsdBuffer(), {}
+        return lambda packet: func(packet, buffer, gauges)
+
+    # per datagram of 5 lines
+    baseline = measure(parser(parse_packet_re), packets, options.repeat)
+    report('regex', baseline / 5)
+    report('split/partition', measure(parser(parse_packet), packets, options.repeat) / 5, baseline / 5)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import random
+import socket
+import sys
+import time
+
+from optparse import OptionParser, Option
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.statsd_listener import statsd_packet
+
+__author__ = "Mike Belov"
+__copyright__ = "Copyright (C) Nginx, Inc. All rights reserved."
+__credits__ = ["Mike Belov", "Andrei Belov", "Ivan Poluyanov", "Oleg Mamontov", "Andrew Alexeev"]
+__license__ = ""
+__maintainer__ = "Mike Belov"
+__email__ = "dedm@nginx.com"
+
+usage = "usage: %prog [-a HOST:PORT] [-r PACKETS] [-d SECONDS] [-l LINES]"
+
+option_list = (
+    Option(
+        '-a', '--address',
+        action='store',
+        dest='address',
+        type='string',
+        help='StatsD listener address (127.0.0.1:8125 by default)',
+        default='127.0.0.1:8125',
+    ),
+    Option(
+        '-r', '--rate',
+        action='store',
+        dest='rate',
+        type='int',
+        help='Datagrams per second, 0 is as fast as possible (10000 by default)',
+        default=10000,
+    ),
+    Option(
+        '-d', '--duration',
+        action='store',
+        dest='duration',
+        type='float',
+        help='Seconds to send for (10 by default)',
+        default=10.0,
+    ),
+    Option(
+        '-l', '--lines',
+        action='store',
+        dest='lines',
+        type='int',
+        help='Metric lines per datagram (5 by default)',
+        default=5,
+    ),
+)
+
+parser = OptionParser(usage, option_list=option_list)
+(options, args) = parser.parse_args()
+
+if __name__ == '__main__':
+    host, _, port = options.address.rpartition(':')
+    address = (host.strip('[]') or '127.0.0.1', int(port))
+    sock = socket.socket(socket.AF_INET6 if ':' in address[0] else socket.AF_INET, socket.SOCK_DGRAM)
+
+    # datagrams are prepared in advance, so the generator is not slower than the listener
+    rnd = random.Random(0)
+    packets = [statsd_packet(rnd, options.lines) for _ in xrange(1000)]
+
+    sent, errors = 0, 0
+    start = time.time()
+    deadline = start + options.duration
+    step = 100  # datagrams sent between rate checks
+
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+
+        if options.rate and sent >= (now - start) * options.rate:
+            time.sleep(float(step) / options.rate / 2)
+            continue
+
+        for packet in packets[sent % len(packets):][:step]:
+            try:
+                sock.sendto(packet, address)
+                sent += 1
+            except socket.error:
+                errors += 1
+
+    elapsed = time.time() - start
+    print 'sent %d datagrams (%d lines) in %.1f s: %d datagrams/s, %d send errors' % (
+        sent, sent * options.lines, elapsed, sent / elapsed, errors
+    )